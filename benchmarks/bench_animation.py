@@ -0,0 +1,108 @@
+"""
+Frame throughput of animated templates: the streaming path of ImageGenerator
+(text laid out and rasterized once, frames encoded one at a time) against
+drawing the text onto every frame and saving the whole animation at once
+
+Usage: python benchmarks/bench_animation.py [-f FRAMES] [-s WIDTH HEIGHT]
+"""
+from __future__ import annotations
+
+import argparse
+import dataclasses
+import json
+import os
+import sys
+import tempfile
+import time
+
+from PIL import Image
+from PIL import ImageDraw
+from PIL import ImageSequence
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+)
+
+from meme_creator import ImageGenerator  # noqa: E402
+from schemas import Settings  # noqa: E402
+from template_record import iter_text_boxes  # noqa: E402
+from template_record import text_boxes_from_locations  # noqa: E402
+
+TEXTS = ["When the benchmark", "finally runs", "and it is fast"]
+
+
+def create_animation(path: str, frames: int, size: tuple[int, int]) -> None:
+    images = [
+        Image.new("RGB", size, (i * 37 % 256, i * 91 % 256, i * 53 % 256))
+        for i in range(frames)
+    ]
+    images[0].save(path, save_all=True, append_images=images[1:], duration=40, loop=0)
+
+
+def naive(gen: ImageGenerator, texts: list[str]) -> str:
+    """
+    Lays out and draws the texts on every frame
+    """
+    frames = []
+    for frame in ImageSequence.Iterator(gen.image):
+        frame = frame.convert("RGB")
+        draw = ImageDraw.Draw(frame)
+        for text, box in zip(texts, iter_text_boxes(gen.text_boxes)):
+            gen.add_text(draw, text, *box, gen.settings)
+        frames.append(frame)
+
+    path = gen.get_file_path()
+    frames[0].save(path, save_all=True, append_images=frames[1:], duration=40, loop=0)
+    return path
+
+
+def streaming(gen: ImageGenerator, texts: list[str]) -> str:
+    return gen.add_all_text(texts)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-f", "--frames", type=int, default=60)
+    parser.add_argument("-s", "--size", type=int, nargs=2, default=(480, 360))
+    parser.add_argument(
+        "-c",
+        "--config",
+        help="The path to the config file",
+        default="./configs/dev.settings.json",
+    )
+    args = parser.parse_args()
+
+    with open(args.config) as file:
+        settings = Settings.from_dict(json.load(file))
+
+    width, height = args.size
+    locations = [
+        {"x": 0, "y": i * height // 3, "width": width, "height": height // 3}
+        for i in range(len(TEXTS))
+    ]
+
+    with tempfile.TemporaryDirectory() as directory:
+        settings = dataclasses.replace(
+            settings, template_directory=directory, created_directory=directory
+        )
+        create_animation(
+            os.path.join(directory, "bench.gif"), args.frames, (width, height)
+        )
+
+        for name, render in (("naive", naive), ("streaming", streaming)):
+            with ImageGenerator(
+                "0",
+                "bench",
+                text_boxes_from_locations(locations),
+                "bench.gif",
+                "bench",
+                settings,
+            ) as gen:
+                start = time.perf_counter()
+                render(gen, TEXTS)
+                elapsed = time.perf_counter() - start
+
+            print(
+                f"{name:>10}: {elapsed:.3f}s for {args.frames} frames "
+                f"({args.frames / elapsed:.1f} frames/s)"
+            )
@@ -0,0 +1,118 @@
+"""
+Compositing time of the stitched shuffle image: the PIL backend (paste onto a
+pooled canvas, draw the labels and guide texts) against the numpy backend
+(array writes, precomputed overlays blended onto the canvas). The templates are
+scaled once per layout, only the compositing is timed
+
+Usage: python benchmarks/bench_compositing.py [-n ROUNDS]
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import sys
+import time
+import unittest.mock
+
+from PIL import Image
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+)
+
+from compositing import NumpyCompositor  # noqa: E402
+from meme_creator import ImageGenerator  # noqa: E402
+from meme_creator import ImageShuffler  # noqa: E402
+from schemas import Settings  # noqa: E402
+from template_record import TemplateRecord  # noqa: E402
+
+# Sets of three templates of tests/mock_data.json
+LAYOUTS = ("TEST_DATA_SHUFFLE", "TEST_DATA")
+
+
+def scaled_layout(shuffler: ImageShuffler, records: dict[str, TemplateRecord]):
+    images = [
+        Image.open(
+            os.path.join(
+                shuffler.settings.get_template_directory(),
+                records[opt].template_location,
+            )
+        )
+        for opt in shuffler.settings.options
+    ]
+    in_row = shuffler._images_in_row(images)
+    max_width, max_height, coordinates = shuffler._determine_dimensions(
+        images, in_row
+    ).values()
+    text_boxes = shuffler._scale_images(
+        images, coordinates, in_row, max_height, max_width, records
+    )
+    if in_row:
+        size = (coordinates[-1][0] + images[-1].width, max_height)
+    else:
+        size = (max_width, coordinates[-1][1] + images[-1].height)
+    return images, coordinates, text_boxes, size
+
+
+def pil(shuffler: ImageShuffler, images, coordinates, text_boxes, size) -> None:
+    # Both backends get copies, _composite closes the images it pasted
+    copies = [image.copy() for image in images]
+    with shuffler.canvas_pool.borrow(shuffler.settings.file_mode, size) as canvas:
+        shuffler._composite(canvas, copies, coordinates, text_boxes)
+
+
+def numpy(shuffler: ImageShuffler, images, coordinates, text_boxes, size) -> None:
+    copies = [image.copy() for image in images]
+    with shuffler.compositor.render(size, [], copies, coordinates, text_boxes):
+        pass
+    for image in copies:
+        image.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--rounds", type=int, default=50)
+    parser.add_argument(
+        "-c",
+        "--config",
+        help="The path to the config file",
+        default="./configs/dev.settings.json",
+    )
+    args = parser.parse_args()
+
+    with open(args.config) as file:
+        settings = Settings.from_dict(json.load(file))
+    with open("./tests/mock_data.json") as file:
+        test_data = json.load(file)
+
+    # Only the layout methods of the shuffler are used, no database is needed
+    with unittest.mock.patch(
+        "pymongo.collection.Collection.count_documents", return_value=0
+    ):
+        shuffler = ImageShuffler(settings)
+    shuffler.compositor = NumpyCompositor(settings, ImageGenerator)
+
+    for layout in LAYOUTS:
+        documents = test_data[layout]
+        if isinstance(documents, dict):
+            documents = list(documents.values())
+        records = {
+            opt: TemplateRecord.from_document(doc)
+            for opt, doc in zip(settings.options, documents)
+        }
+        images, coordinates, text_boxes, size = scaled_layout(shuffler, records)
+
+        for name, render in (("pil", pil), ("numpy", numpy)):
+            # Warm up the font and overlay caches
+            render(shuffler, images, coordinates, text_boxes, size)
+            start = time.perf_counter()
+            for _ in range(args.rounds):
+                render(shuffler, images, coordinates, text_boxes, size)
+            elapsed = (time.perf_counter() - start) / args.rounds
+
+            print(f"{layout} {size[0]}x{size[1]} {name:>6}: {elapsed * 1000:.2f}ms")
+
+        for image in images:
+            image.close()
+    shuffler.close()
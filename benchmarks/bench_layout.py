@@ -0,0 +1,123 @@
+"""
+Pixel count and render time of the stitched shuffle image per layout: the
+single row and column against the grid picked by the search (marked with *),
+for sets of tall, wide and mixed templates. Every render decodes, scales and
+composites the templates and encodes the JPEG
+
+Usage: python benchmarks/bench_layout.py [-n ROUNDS]
+"""
+from __future__ import annotations
+
+import argparse
+import dataclasses
+import json
+import os
+import sys
+import tempfile
+import time
+import unittest.mock
+
+from PIL import Image
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+)
+
+from layout import arrange  # noqa: E402
+from layout import Layout  # noqa: E402
+from layout import plan_layout  # noqa: E402
+from meme_creator import ImageShuffler  # noqa: E402
+from schemas import Settings  # noqa: E402
+from template_record import text_boxes_from_locations  # noqa: E402
+from template_record import TemplateRecord  # noqa: E402
+
+TEMPLATE_SETS = {
+    "tall": [(300, 1500), (320, 1400), (280, 1600)],
+    "wide": [(1600, 300), (1500, 280), (1400, 320)],
+    "mixed": [(1024, 1024), (300, 900), (1200, 300)],
+    "four": [(300, 1500), (1600, 300), (500, 500), (400, 800)],
+    "six squares": [(600, 600)] * 6,
+}
+
+
+def create_templates(directory: str, sizes: list[tuple[int, int]]):
+    records = {}
+    options = [chr(ord("A") + i) for i in range(len(sizes))]
+    for opt, (width, height) in zip(options, sizes):
+        location = f"{opt}_{width}x{height}.jpeg"
+        Image.radial_gradient("L").resize((width, height)).convert("RGB").save(
+            os.path.join(directory, location)
+        )
+        records[opt] = TemplateRecord(
+            opt,
+            opt,
+            location,
+            text_boxes_from_locations(
+                [{"x": 10, "y": 10, "width": width - 20, "height": height // 5}]
+            ),
+        )
+    return options, records
+
+
+def render(shuffler: ImageShuffler, records, layout: Layout, rounds: int) -> float:
+    """
+    :return: Seconds per render of the stitched image in the given layout
+    """
+    with unittest.mock.patch("meme_creator.plan_layout", return_value=layout):
+        shuffler.generate_shuffle_image("bench", records)
+        start = time.perf_counter()
+        for _ in range(rounds):
+            shuffler.generate_shuffle_image("bench", records)
+        return (time.perf_counter() - start) / rounds
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--rounds", type=int, default=10)
+    parser.add_argument(
+        "-c",
+        "--config",
+        help="The path to the config file",
+        default="./configs/dev.settings.json",
+    )
+    args = parser.parse_args()
+
+    with open(args.config) as file:
+        base_settings = Settings.from_dict(json.load(file))
+    max_size = base_settings.shuffle_max_size
+    min_size = base_settings.layout_min_template_size
+
+    # Only the layout methods of the shuffler are used, no database is needed
+    with unittest.mock.patch(
+        "pymongo.collection.Collection.count_documents", return_value=0
+    ):
+        shuffler = ImageShuffler(base_settings)
+
+    with tempfile.TemporaryDirectory() as directory:
+        for name, sizes in TEMPLATE_SETS.items():
+            options, records = create_templates(directory, sizes)
+            shuffler.settings = dataclasses.replace(
+                base_settings,
+                options=options,
+                template_directory=directory,
+                stitch_directory=directory,
+                layout_strategy="search",
+            )
+
+            searched = plan_layout(sizes, min_size, max_size)
+            layouts = [
+                arrange(sizes, by_rows, (len(sizes),), min_size, max_size)
+                for by_rows in (True, False)
+            ]
+            if searched.name not in ("row", "column"):
+                layouts.append(searched)
+
+            for layout in layouts:
+                elapsed = render(shuffler, records, layout, args.rounds)
+                chosen = "*" if layout.name == searched.name else " "
+                print(
+                    f"{name:>11} {layout.name:>14}{chosen}: "
+                    f"{layout.area / 1e6:6.3f} MP {elapsed * 1000:7.2f}ms, "
+                    f"smallest side {layout.smallest_side}"
+                )
+    shuffler.close()
@@ -1,10 +1,55 @@
 from __future__ import annotations
 
+import dataclasses
+import json
 import os
 import sys
 
+import pytest
+
 current_directory = os.path.dirname(os.path.abspath(__file__))
 src_directory = os.path.join(current_directory, "src")
 
 # Insert the 'src' directory into sys.path
 sys.path.insert(0, src_directory)
+
+from src.schemas import Settings  # noqa: E402
+
+DEV_CONFIG_LOCATION = os.path.join(current_directory, "configs", "dev.settings.json")
+
+
+class FakeClock:
+    """
+    Clock for the time based policies and caches, tests move it by hand
+    """
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture()
+def clock() -> FakeClock:
+    return FakeClock()
+
+
+@pytest.fixture()
+def settings() -> Settings:
+    with open(DEV_CONFIG_LOCATION) as f:
+        return Settings.from_dict(json.load(f))
+
+
+@pytest.fixture()
+def tmp_settings(settings, tmp_path) -> Settings:
+    """
+    Dev settings that read the templates from tmp_path and write
+    the stitched and created images to it
+    """
+    return dataclasses.replace(
+        settings,
+        template_directory=str(tmp_path),
+        created_directory=str(tmp_path / "created"),
+        stitch_directory=str(tmp_path),
+    )
@@ -0,0 +1,100 @@
+from __future__ import annotations
+
+from collections.abc import Iterator
+from typing import BinaryIO
+
+from PIL import GifImagePlugin
+from PIL import Image
+from PIL import ImageSequence
+
+# GIF disposal method: clear the frame to the background before the next one
+RESTORE_BACKGROUND = 2
+
+# Maps alpha values to the mask of the pixels that become transparent
+TRANSPARENT_ALPHA = [255] * 128 + [0] * 128
+
+
+def iter_overlaid_frames(
+    image: Image.Image, overlay: Image.Image
+) -> Iterator[tuple[Image.Image, int]]:
+    """
+    Decodes the frames of an animated image one at a time
+    and composites the overlay onto each of them
+    :param image: The animated image
+    :param overlay: RGBA image with the size of the animation
+    :return: Iterator over the composited frames and their duration in ms,
+    the caller has to close the frames
+    """
+    for frame in ImageSequence.Iterator(image):
+        composited = frame.convert("RGBA")
+        composited.alpha_composite(overlay)
+        yield composited, frame.info.get("duration", 0)
+
+
+class GifStreamWriter:
+    """
+    Encodes a GIF frame by frame, so the frames do not have to be kept
+    in memory until the whole animation is saved (as Image.save does)
+    """
+
+    def __init__(self, fp: BinaryIO, loop: int | None = 0):
+        """
+        :param fp: The file the GIF is written to
+        :param loop: Number of times the animation is repeated, 0 is forever.
+        None writes no loop extension, the animation is played once
+        """
+        self.fp = fp
+        self.loop = loop
+        self.frames = 0
+
+    def write_frame(self, frame: Image.Image, duration: int) -> None:
+        """
+        Quantize the frame to its own palette and append it to the file.
+        Pixels that are less than half opaque become transparent
+        :param frame: The frame, in RGB or RGBA mode
+        :param duration: How long the frame is shown in ms
+        """
+        # Every frame replaces the whole previous one, also where it is transparent
+        info: dict = {"duration": duration, "disposal": RESTORE_BACKGROUND}
+        with frame.convert("RGB") as rgb:
+            quantized = rgb.quantize(colors=255)
+        with quantized:
+            if frame.mode == "RGBA":
+                self._make_transparent(quantized, frame, info)
+
+            if self.frames == 0:
+                header_info = {"duration": duration}
+                if self.loop is not None:
+                    header_info["loop"] = self.loop
+                header, _ = GifImagePlugin.getheader(quantized, info=header_info)
+                self.fp.write(b"".join(header))
+
+            for data in GifImagePlugin.getdata(
+                quantized, include_color_table=True, **info
+            ):
+                self.fp.write(data)
+        self.frames += 1
+
+    @staticmethod
+    def _make_transparent(
+        quantized: Image.Image, frame: Image.Image, info: dict
+    ) -> None:
+        """
+        Paint the transparent pixels of the frame with a palette entry of their own
+        and mark it as the transparent one in the encoder info
+        """
+        with frame.getchannel("A") as alpha, alpha.point(TRANSPARENT_ALPHA) as mask:
+            if mask.getbbox() is None:
+                return
+            palette = quantized.getpalette() or []
+            # At most 255 colors were used, the next entry is free
+            index = len(palette) // 3
+            quantized.putpalette(palette + [0, 0, 0])
+            quantized.paste(index, mask=mask)
+        info["transparency"] = index
+
+    def close(self) -> None:
+        """
+        Write the GIF trailer
+        """
+        self.fp.write(b";")
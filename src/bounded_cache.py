@@ -0,0 +1,123 @@
+from __future__ import annotations
+
+import collections
+import time
+from collections.abc import Hashable
+from dataclasses import dataclass
+from typing import Callable
+from typing import Generic
+from typing import TypeVar
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+@dataclass
+class _Entry(Generic[V]):
+    value: V
+    num_bytes: int
+    added: float
+
+
+class BoundedCache(Generic[K, V]):
+    """
+    Entries with their size in bytes, least recently used first. Entries expire
+    ttl seconds after they were added and the least recently used ones are
+    evicted while all entries take up more than max_bytes. Not thread safe,
+    the owner guards it with its own lock and frees the evicted values
+    """
+
+    def __init__(
+        self,
+        max_bytes: int,
+        ttl: float | None = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        """
+        :param max_bytes: Maximum number of bytes of all entries
+        :param ttl: Seconds after which an entry expires, None to keep entries
+        until they are evicted for space
+        :param clock: Returns the current time in seconds, replaced in tests
+        """
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.clock = clock
+
+        self._entries: collections.OrderedDict[K, _Entry[V]] = collections.OrderedDict()
+        self.bytes = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: K) -> bool:
+        return key in self._entries
+
+    def get(self, key: K) -> V | None:
+        """
+        :return: The value of the key without marking it as used, None if missing
+        """
+        entry = self._entries.get(key)
+        return None if entry is None else entry.value
+
+    def touch(self, key: K) -> None:
+        """
+        Mark the entry as the most recently used one
+        """
+        self._entries.move_to_end(key)
+
+    def put(self, key: K, value: V, num_bytes: int = 0) -> V | None:
+        """
+        Add the value as the most recently used entry, call evict afterwards
+        :return: The value that was replaced, None if the key was new
+        """
+        previous = self.pop(key)
+        self._entries[key] = _Entry(value, num_bytes, self.clock())
+        self.bytes += num_bytes
+        return previous
+
+    def add_bytes(self, key: K, num_bytes: int) -> None:
+        """
+        Account for an entry that grew after it was added
+        """
+        self._entries[key].num_bytes += num_bytes
+        self.bytes += num_bytes
+
+    def pop(self, key: K) -> V | None:
+        """
+        :return: The removed value, None if the key was missing
+        """
+        if key not in self._entries:
+            return None
+        return self._drop(key)
+
+    def _drop(self, key: K) -> V:
+        entry = self._entries.pop(key)
+        self.bytes -= entry.num_bytes
+        return entry.value
+
+    def evict(self) -> list[V]:
+        """
+        :return: The expired values and the least recently used ones above max_bytes
+        """
+        evicted: list[V] = []
+        if self.ttl is not None:
+            now = self.clock()
+            for key, entry in list(self._entries.items()):
+                if now - entry.added > self.ttl:
+                    evicted.append(self._drop(key))
+
+        while self.bytes > self.max_bytes and self._entries:
+            evicted.append(self._drop(next(iter(self._entries))))
+
+        self.evictions += len(evicted)
+        return evicted
+
+    def clear(self) -> list[V]:
+        """
+        :return: All values, the cache is empty afterwards
+        """
+        values = [entry.value for entry in self._entries.values()]
+        self._entries.clear()
+        self.bytes = 0
+        return values
@@ -7,3 +7,4 @@ class CommandNames(Enum):
     SHUFFLE = "shuffle"
     PICK = "A"
     START = "start"
+    MEMORY = "memory"
@@ -0,0 +1,261 @@
+from __future__ import annotations
+
+import collections
+import contextlib
+import dataclasses
+import math
+import threading
+from array import array
+from collections.abc import Iterable
+from collections.abc import Iterator
+from typing import TYPE_CHECKING
+
+from image_pool import Box
+from image_pool import CanvasPool
+from PIL import Image
+from PIL import ImageDraw
+from schemas import Settings
+from template_record import iter_text_boxes
+
+try:
+    import numpy as np
+except ImportError:  # Only needed for the numpy compositing backend
+    np = None
+
+if TYPE_CHECKING:
+    from meme_creator import ImageGenerator
+
+
+def blend(region: np.ndarray, overlay: np.ndarray) -> None:
+    """
+    Alpha blends an RGBA overlay onto an RGB region of the canvas
+    :param region: View of the canvas, changed in place
+    :param overlay: RGBA array with the same height and width as the region
+    """
+    alpha = overlay[..., 3:].astype(np.uint16)
+    # At most 255 * 255 + 127, so the sum does not overflow 16 bits
+    blended = overlay[..., :3] * alpha + region * (255 - alpha) + 127
+    region[...] = blended // 255
+
+
+class ArrayPool(CanvasPool["np.ndarray"]):
+    """
+    Pool of arrays of shape (height, width, 4) that hold the pixels of RGBX
+    images, PIL images can share their memory (see NumpyCompositor.render)
+    """
+
+    def _allocate(self, mode: str, size: tuple[int, int]) -> np.ndarray:
+        assert mode == "RGBX", "The arrays hold RGBX pixels"
+        width, height = size
+        return np.zeros((height, width, 4), dtype=np.uint8)
+
+    def _key(self, canvas: np.ndarray) -> tuple[str, tuple[int, int]]:
+        height, width = canvas.shape[:2]
+        return "RGBX", (width, height)
+
+    def _clear(self, canvas: np.ndarray, box: Box) -> None:
+        left, top, right, bottom = box
+        canvas[top:bottom, left:right] = 0
+
+    def _num_bytes(self, canvas: np.ndarray) -> int:
+        return canvas.nbytes
+
+
+class NumpyCompositor:
+    """
+    Compositing backend that writes the scaled templates into a pooled array
+    and blends precomputed overlays onto it. The labels are rasterized
+    once, the guide texts once per text and box size, instead of laying out
+    and drawing them on every shuffle
+    """
+
+    def __init__(
+        self,
+        settings: Settings,
+        text_renderer: type[ImageGenerator],
+        max_overlays: int = 256,
+    ):
+        """
+        :param settings: the configuration dictionary
+        :param text_renderer: Lays out and draws the texts (ImageGenerator)
+        :param max_overlays: Maximum number of cached guide text overlays
+        :raises ImportError: if numpy is not installed
+        """
+        if np is None:
+            raise ImportError(
+                "The numpy compositing backend requires numpy, "
+                "install it or set compositing_backend to pil"
+            )
+
+        self.settings = settings
+        self.text_renderer = text_renderer
+        self.max_overlays = max_overlays
+
+        self._lock = threading.Lock()
+        # Only used to measure texts
+        self._measure = ImageDraw.Draw(Image.new("RGBA", (1, 1)))
+        self._labels = {opt: self._rasterize_label(opt) for opt in settings.options}
+        # key: (text, width, height), value: (x offset, y offset, overlay)
+        self._overlays: collections.OrderedDict[
+            tuple[str, int, int], tuple[int, int, np.ndarray | None]
+        ] = collections.OrderedDict()
+        self.canvas_pool = ArrayPool(settings.canvas_pool_max_bytes)
+
+    def _rasterize_label(self, option: str) -> np.ndarray:
+        """
+        :param option: The letter of the option
+        :return: RGBA array of the rectangle with the letter
+        """
+        size = self.settings.rectangle_size
+        # The rectangle includes its end coordinates, as in ImageDraw
+        with Image.new("RGBA", (size + 1, size + 1)) as label:
+            draw = ImageDraw.Draw(label)
+            draw.rectangle(
+                (0, 0, size, size),
+                fill=tuple(self.settings.rectangle_fill_color),
+                outline=tuple(self.settings.rectangle_outline_color),
+            )
+            self.text_renderer.add_text(
+                draw, option, 0, 0, size, size, settings=self.settings
+            )
+            return np.asarray(label)
+
+    def _rasterize_text(
+        self, text: str, width: int, height: int
+    ) -> tuple[int, int, np.ndarray | None]:
+        """
+        :return: The offset of the overlay relative to the text box and the RGBA
+        array of the text fitted to the box, None if it does not fit
+        """
+        key = (text, width, height)
+        with self._lock:
+            cached = self._overlays.get(key)
+            if cached is not None:
+                self._overlays.move_to_end(key)
+                return cached
+
+        # Shuffles rendered at the same time may rasterize the same text twice
+        layout = self.text_renderer.fit_text(
+            self._measure, text, 0, 0, width, height, self.settings
+        )
+        overlay = (0, 0, None)
+        if layout is not None:
+            left, top, right, bottom = self._measure.multiline_textbbox(
+                layout.position,
+                layout.text,
+                font=layout.font,
+                align="center",
+                stroke_width=self.settings.font_stroke_width,
+            )
+            # Shift the text by whole pixels to a non-negative position, so it keeps
+            # its sub pixel offset and is rasterized exactly as on the canvas
+            left = min(math.floor(left), math.floor(layout.position[0])) - 1
+            top = min(math.floor(top), math.floor(layout.position[1])) - 1
+
+            with Image.new(
+                "RGBA", (math.ceil(right) + 1 - left, math.ceil(bottom) + 1 - top)
+            ) as patch:
+                self.text_renderer.draw_text(
+                    ImageDraw.Draw(patch),
+                    dataclasses.replace(
+                        layout,
+                        position=(layout.position[0] - left, layout.position[1] - top),
+                    ),
+                    self.settings,
+                )
+                # Only keep the pixels the text covers
+                bbox = patch.getbbox()
+                if bbox is not None:
+                    with patch.crop(bbox) as cropped:
+                        overlay = (left + bbox[0], top + bbox[1], np.asarray(cropped))
+
+        with self._lock:
+            self._overlays[key] = overlay
+            if len(self._overlays) > self.max_overlays:
+                self._overlays.popitem(last=False)
+        return overlay
+
+    @staticmethod
+    def _blend_at(canvas: np.ndarray, overlay: np.ndarray, x: int, y: int) -> None:
+        """
+        Blend the overlay onto the canvas at x, y, clipped to the canvas
+        """
+        height, width = canvas.shape[:2]
+        left, top = max(x, 0), max(y, 0)
+        right = min(x + overlay.shape[1], width)
+        bottom = min(y + overlay.shape[0], height)
+        if left >= right or top >= bottom:
+            return
+
+        blend(
+            canvas[top:bottom, left:right],
+            overlay[top - y : bottom - y, left - x : right - x],  # noqa: E203
+        )
+
+    @contextlib.contextmanager
+    def render(
+        self,
+        size: tuple[int, int],
+        covered: Iterable[Box],
+        images: list[Image.Image],
+        image_coordinates: list[tuple],
+        text_boxes: list[array],
+    ) -> Iterator[Image.Image]:
+        """
+        Composites into a pooled array (see composite)
+        :param size: The width and height of the stitched image
+        :param covered: The boxes the images are written to
+        :return: Context manager of the stitched RGBX image, it shares the memory
+        of the pooled array and is only valid within the context
+        """
+        width, height = size
+        with self.canvas_pool.borrow("RGBX", size, covered) as pixels:
+            self.composite(
+                pixels[:height, :width, :3], images, image_coordinates, text_boxes
+            )
+            # Maps the top left corner of the array, no pixels are copied
+            with Image.frombuffer(
+                "RGBX", size, pixels, "raw", "RGBX", pixels.strides[0], 1
+            ) as stitched_image:
+                yield stitched_image
+
+    def composite(
+        self,
+        canvas: np.ndarray,
+        images: list[Image.Image],
+        image_coordinates: list[tuple],
+        text_boxes: list[array],
+    ) -> None:
+        """
+        Same result as ImageShuffler._composite (up to rounding of the blending)
+        :param canvas: RGB array of shape (height, width, 3), may be a view.
+        Every template is written into it once, the pixels no template covers
+        are not changed
+        :param images: The scaled images, not closed
+        :param image_coordinates: The start coordinates of the images
+        :param text_boxes: The scaled text boxes of every image
+        :return: None (Changed canvas in place)
+        """
+        # Every template is written once into its slice of the canvas
+        for image, (x, y) in zip(images, image_coordinates):
+            region = canvas[y : y + image.height, x : x + image.width]  # noqa: E203
+            if image.mode == "RGB":
+                pixels = np.asarray(image)
+            else:
+                with image.convert("RGB") as converted:
+                    pixels = np.asarray(converted)
+            # Clipped to the canvas, as Image.paste does
+            region[...] = pixels[: region.shape[0], : region.shape[1]]
+
+        for option, (x, y) in zip(self.settings.options, image_coordinates):
+            self._blend_at(canvas, self._labels[option], x, y)
+
+        for boxes, (image_x, image_y) in zip(text_boxes, image_coordinates):
+            for ind, (x, y, box_width, box_height) in enumerate(iter_text_boxes(boxes)):
+                left, top, overlay = self._rasterize_text(
+                    f"{self.settings.placeholder_text}{ind + 1}", box_width, box_height
+                )
+                if overlay is not None:
+                    self._blend_at(
+                        canvas, overlay, image_x + x + left, image_y + y + top
+                    )
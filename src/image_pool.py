@@ -0,0 +1,220 @@
+from __future__ import annotations
+
+import contextlib
+import threading
+from collections.abc import Iterable
+from collections.abc import Iterator
+from typing import Generic
+from typing import TypeVar
+
+from bounded_cache import BoundedCache
+from memory_diagnostics import close_image
+from memory_diagnostics import image_bytes
+from memory_diagnostics import image_tracker
+from PIL import Image
+
+# The stitched size is the sum of the scaled template sizes and hardly ever
+# repeats, the canvases are rounded up to multiples of this many pixels
+SIZE_STEP = 256
+
+Box = tuple[int, int, int, int]
+T = TypeVar("T")
+
+
+def uncovered_boxes(size: tuple[int, int], covered: Iterable[Box]) -> Iterator[Box]:
+    """
+    :param size: The width and height of the area
+    :param covered: Boxes (left, top, right, bottom), may reach outside the area
+    :return: Boxes that together cover the part of the area outside all covered boxes
+    """
+    width, height = size
+    covered = [
+        (max(left, 0), max(top, 0), min(right, width), min(bottom, height))
+        for left, top, right, bottom in covered
+    ]
+    covered = [box for box in covered if box[0] < box[2] and box[1] < box[3]]
+
+    # Within a band between two box edges, every box covers the band or misses it
+    edges = sorted({0, height, *(y for box in covered for y in (box[1], box[3]))})
+    for top, bottom in zip(edges, edges[1:]):
+        x = 0
+        for left, _, right, _ in sorted(
+            box for box in covered if box[1] <= top and bottom <= box[3]
+        ):
+            if left > x:
+                yield x, top, left, bottom
+            x = max(x, right)
+        if x < width:
+            yield x, top, width, bottom
+
+
+class CanvasPool(Generic[T]):
+    """
+    Pool of blank canvases that are reused instead of allocating
+    a new canvas for every render. Canvases are keyed by mode and size class,
+    a canvas can be used for every size up to its own (see size_class).
+    The pool never holds more than max_bytes of idle canvases. Subclasses
+    allocate, clear and free the canvases of their type
+    """
+
+    def __init__(self, max_bytes: int, size_step: int = SIZE_STEP):
+        """
+        :param max_bytes: Maximum number of bytes of the idle canvases in the pool
+        :param size_step: The width and height of the canvases are rounded up
+        to multiples of this
+        """
+        self.size_step = size_step
+
+        self._lock = threading.Lock()
+        # key: (mode, size), value: idle canvases, least recently returned first
+        self._idle: dict[tuple[str, tuple[int, int]], list[T]] = {}
+        # key: id of the canvas, value: idle canvas, least recently returned first
+        self._lru: BoundedCache[int, T] = BoundedCache(max_bytes)
+
+        self.allocations = 0
+        self.reuses = 0
+
+    @property
+    def max_bytes(self) -> int:
+        return self._lru.max_bytes
+
+    def size_class(self, size: tuple[int, int]) -> tuple[int, int]:
+        """
+        :return: The size of the pooled canvases used for the given size
+        """
+        width, height = size
+        step = self.size_step
+        return -(-width // step) * step, -(-height // step) * step
+
+    def _allocate(self, mode: str, size: tuple[int, int]) -> T:
+        """
+        :return: A new blank canvas
+        """
+        raise NotImplementedError
+
+    def _key(self, canvas: T) -> tuple[str, tuple[int, int]]:
+        """
+        :return: The mode and size of the canvas
+        """
+        raise NotImplementedError
+
+    def _clear(self, canvas: T, box: Box) -> None:
+        raise NotImplementedError
+
+    def _num_bytes(self, canvas: T) -> int:
+        raise NotImplementedError
+
+    def _free(self, canvas: T) -> None:
+        pass
+
+    def acquire(
+        self, mode: str, size: tuple[int, int], covered: Iterable[Box] = ()
+    ) -> T:
+        """
+        :param mode: The mode of the canvas
+        :param size: The width and height the caller draws on
+        :param covered: Boxes the caller overwrites completely, they are not cleared
+        :return: A canvas of the size class of size, either taken from the pool or
+        newly allocated. Blank within size, except for the covered boxes,
+        only use the part of that size
+        """
+        key = (mode, self.size_class(size))
+        with self._lock:
+            idle = self._idle.get(key)
+            canvas = idle.pop() if idle else None
+            if canvas is not None:
+                if not idle:
+                    del self._idle[key]
+                self._lru.pop(id(canvas))
+                self.reuses += 1
+            else:
+                self.allocations += 1
+
+        if canvas is None:
+            return self._allocate(*key)
+
+        # Clear what the previous render left behind where the caller does not draw
+        for box in uncovered_boxes(size, covered):
+            self._clear(canvas, box)
+        return canvas
+
+    def release(self, canvas: T) -> None:
+        """
+        Return a canvas to the pool. Evicts the least recently used
+        canvases if the pool gets too big
+        :param canvas: Canvas that was acquired from this pool
+        """
+        with self._lock:
+            self._idle.setdefault(self._key(canvas), []).append(canvas)
+            self._lru.put(id(canvas), canvas, self._num_bytes(canvas))
+
+            evicted = self._lru.evict()
+            for evicted_canvas in evicted:
+                key = self._key(evicted_canvas)
+                # Both keep the canvases in the order they were returned,
+                # the least recently returned canvas of its size comes first
+                idle = self._idle[key]
+                idle.pop(0)
+                if not idle:
+                    del self._idle[key]
+
+        for evicted_canvas in evicted:
+            self._free(evicted_canvas)
+
+    @contextlib.contextmanager
+    def borrow(
+        self, mode: str, size: tuple[int, int], covered: Iterable[Box] = ()
+    ) -> Iterator[T]:
+        """
+        Context manager that acquires a canvas and returns it to the pool afterwards
+        """
+        canvas = self.acquire(mode, size, covered)
+        try:
+            yield canvas
+        finally:
+            self.release(canvas)
+
+    def clear(self) -> None:
+        """
+        Free all idle canvases
+        """
+        with self._lock:
+            idle = self._lru.clear()
+            self._idle.clear()
+
+        for canvas in idle:
+            self._free(canvas)
+
+    def stats(self) -> dict:
+        """
+        :return: Allocation counters and current size of the pool
+        """
+        with self._lock:
+            return {
+                "allocations": self.allocations,
+                "reuses": self.reuses,
+                "evictions": self._lru.evictions,
+                "idle_images": len(self._lru),
+                "idle_bytes": self._lru.bytes,
+            }
+
+
+class ImagePool(CanvasPool[Image.Image]):
+    """
+    Pool of blank PIL images, crop them to the drawn size before saving them
+    """
+
+    def _allocate(self, mode: str, size: tuple[int, int]) -> Image.Image:
+        return image_tracker.track(Image.new(mode, size))
+
+    def _key(self, canvas: Image.Image) -> tuple[str, tuple[int, int]]:
+        return canvas.mode, canvas.size
+
+    def _clear(self, canvas: Image.Image, box: Box) -> None:
+        canvas.paste(0, box)
+
+    def _num_bytes(self, canvas: Image.Image) -> int:
+        return image_bytes(canvas)
+
+    def _free(self, canvas: Image.Image) -> None:
+        close_image(canvas)
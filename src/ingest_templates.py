@@ -0,0 +1,314 @@
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+from array import array
+from typing import Any
+
+from dotenv import load_dotenv
+from jsonschema import Draft4Validator
+from jsonschema import ValidationError
+from meme_creator import ImageGenerator
+from PIL import Image
+from PIL import ImageOps
+from pymongo import MongoClient
+from pymongo.collection import Collection
+from schemas import Settings
+from template_record import iter_text_boxes
+from template_record import scale_text_boxes
+from template_record import text_boxes_from_locations
+from template_record import TemplateRecord
+from template_sampler import RandomKeySampler
+
+# Increase when the normalization changes, so every template gets processed again
+INGEST_VERSION = 1
+
+# Fields that are copied from the template document, removed when they are missing
+OPTIONAL_FIELDS = ("tags", "language")
+
+
+def load_validator(settings: Settings) -> Draft4Validator:
+    """
+    :return: Validator for the template documents
+    """
+    with open(
+        os.path.join(settings.configs_directory, "schema", "template.json")
+    ) as file:
+        return Draft4Validator(json.load(file))
+
+
+def file_hash(path: str) -> str:
+    """
+    :param path: Path to the file
+    :return: sha256 hex digest of the content of the file
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(1 << 16), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def source_fingerprint(
+    document: dict[str, Any], source_hash: str, settings: Settings
+) -> str:
+    """
+    :return: Hash of everything the normalized image and the scaled text boxes
+    depend on. If it did not change since the last ingestion,
+    the image does not have to be processed again
+    """
+    inputs = {
+        "version": INGEST_VERSION,
+        "source": source_hash,
+        "text-locations": document["text-locations"],
+        "max-resolution": settings.template_max_resolution,
+        "quality": settings.template_jpeg_quality,
+        "font": [
+            settings.font_path,
+            settings.font_min_size,
+            settings.font_max_size,
+            settings.font_stroke_width,
+            settings.text_box_height_ratio,
+        ],
+    }
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode()).hexdigest()
+
+
+def normalize_image(
+    source_path: str, destination_stem: str, settings: Settings
+) -> tuple[str, float, tuple[int, int]]:
+    """
+    Downscales the template to the configured maximum resolution, strips the
+    metadata and re-encodes it as baseline JPEG, which is fast to decode.
+    Animated templates are copied unchanged
+    :param source_path: Path to the template as uploaded
+    :param destination_stem: Path of the normalized template without extension
+    :return: The path of the normalized template, the factor by which
+    it was scaled and its size
+    """
+    with Image.open(source_path) as image:
+        if getattr(image, "is_animated", False):
+            destination = destination_stem + os.path.splitext(source_path)[1]
+            shutil.copyfile(source_path, destination)
+            return destination, 1.0, image.size
+
+        # Apply the orientation before the EXIF data gets dropped
+        with ImageOps.exif_transpose(image) as transposed:
+            normalized = transposed.convert(settings.file_mode)
+
+    max_width, max_height = settings.template_max_resolution
+    scale_ratio = min(1.0, max_width / normalized.width, max_height / normalized.height)
+    if scale_ratio < 1:
+        size = (
+            max(1, round(normalized.width * scale_ratio)),
+            max(1, round(normalized.height * scale_ratio)),
+        )
+        scale_ratio = size[0] / normalized.width
+        # Closes the full size image once the resized one exists
+        with normalized:
+            normalized = normalized.resize(size, Image.Resampling.LANCZOS)
+
+    destination = destination_stem + ".jpeg"
+    with normalized:
+        # Nothing from image.info is passed, so EXIF, ICC profile etc. are stripped
+        normalized.save(
+            destination,
+            "JPEG",
+            quality=settings.template_jpeg_quality,
+            optimize=True,
+            progressive=False,
+        )
+        return destination, scale_ratio, normalized.size
+
+
+def ingest_template(
+    document: dict[str, Any],
+    source_directory: str,
+    collection: Collection,
+    settings: Settings,
+    validator: Draft4Validator,
+    force: bool = False,
+) -> bool:
+    """
+    Validates, normalizes and stores a template. The image is only normalized
+    again if it or the text locations changed since the last ingestion,
+    the other fields of the document are always written
+    :param document: The template document, template-location is relative
+    to the source directory and the text locations are in source pixels
+    :param source_directory: Directory of the uploaded templates
+    :param collection: The template collection
+    :param validator: Validator for the template documents
+    :param force: Normalize the image even if it did not change
+    :return: True if the image was normalized, False if it was skipped
+    :raises ValidationError: if the document does not match the schema
+    """
+    validator.validate(document)
+
+    source_path = os.path.join(source_directory, document["template-location"])
+    fingerprint = source_fingerprint(document, file_hash(source_path), settings)
+
+    # Tags or a language that were dropped from the document are removed
+    update: dict[str, dict] = {}
+    missing = {field: "" for field in OPTIONAL_FIELDS if field not in document}
+    if missing:
+        update["$unset"] = missing
+
+    existing = collection.find_one(
+        {"id": document["id"]}, {"source-hash": 1, "template-location": 1}
+    )
+    if (
+        not force
+        and existing is not None
+        and existing.get("source-hash") == fingerprint
+        and os.path.exists(
+            os.path.join(
+                settings.get_template_directory(), existing["template-location"]
+            )
+        )
+    ):
+        update["$set"] = {"name": document["name"]}
+        for field in OPTIONAL_FIELDS:
+            if field in document:
+                update["$set"][field] = document[field]
+        collection.update_one({"id": document["id"]}, update)
+        return False
+
+    stem = os.path.splitext(os.path.basename(document["template-location"]))[0]
+    destination, scale_ratio, (width, height) = normalize_image(
+        source_path, os.path.join(settings.get_template_directory(), stem), settings
+    )
+
+    text_boxes = scale_text_boxes(
+        text_boxes_from_locations(document["text-locations"]), scale_ratio
+    )
+    record = TemplateRecord(
+        id=document["id"],
+        name=document["name"],
+        template_location="./" + os.path.basename(destination),
+        text_boxes=text_boxes,
+        width=width,
+        height=height,
+        font_bounds=compute_font_bounds(text_boxes, settings),
+    )
+
+    ingested = record.to_document()
+    for field in OPTIONAL_FIELDS:
+        if field in document:
+            ingested[field] = document[field]
+    ingested["source-hash"] = fingerprint
+    validator.validate(ingested)
+
+    update["$set"] = ingested
+    collection.update_one({"id": record.id}, update, upsert=True)
+    return True
+
+
+def compute_font_bounds(text_boxes: array, settings: Settings) -> array:
+    """
+    :param text_boxes: Flat text box array
+    :return: Flat array with the min and max font size of every text box
+    """
+    return array(
+        "i",
+        (
+            size
+            for _, _, _, height in iter_text_boxes(text_boxes)
+            for size in ImageGenerator.font_size_bounds(height, settings)
+        ),
+    )
+
+
+def ingest_all(
+    documents: list[dict[str, Any]],
+    source_directory: str,
+    collection: Collection,
+    settings: Settings,
+    force: bool = False,
+) -> dict[str, int]:
+    """
+    Ingest all templates, templates that fail are reported and skipped
+    :return: Number of ingested, skipped and failed templates. The fields
+    of skipped templates are updated, only their images are not processed
+    """
+    if os.path.realpath(source_directory) == os.path.realpath(
+        settings.get_template_directory()
+    ):
+        raise ValueError(
+            "The source directory has to be different from the template directory"
+        )
+    os.makedirs(settings.get_template_directory(), exist_ok=True)
+
+    validator = load_validator(settings)
+    counts = {"ingested": 0, "skipped": 0, "failed": 0}
+    for document in documents:
+        try:
+            if ingest_template(
+                document, source_directory, collection, settings, validator, force
+            ):
+                counts["ingested"] += 1
+            else:
+                counts["skipped"] += 1
+        except (ValidationError, OSError) as error:
+            print(f"Could not ingest template {document.get('id')}: {error}")
+            counts["failed"] += 1
+
+    if settings.sampling_strategy == "random_key":
+        RandomKeySampler(collection).prepare()
+
+    return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Normalize new templates and add them to the database"
+    )
+    parser.add_argument(
+        "-c",
+        "--config",
+        help="The path to the config file",
+        default="./configs/dev.settings.json",
+    )
+    parser.add_argument(
+        "-t",
+        "--templates",
+        help="JSON file with the list of template documents to ingest",
+        required=True,
+    )
+    parser.add_argument(
+        "-s",
+        "--source",
+        help="Directory containing the uploaded template images",
+        required=True,
+    )
+    parser.add_argument(
+        "-f",
+        "--force",
+        help="Process all templates, also the ones that did not change",
+        action="store_true",
+    )
+    args = parser.parse_args()
+
+    load_dotenv()
+
+    with open(args.config, "r") as file:
+        settings: Settings = Settings.from_dict(json.load(file))
+
+    with open(args.templates, "r") as file:
+        templates = json.load(file)
+
+    with MongoClient(os.getenv("MONGO_SERVER_URL")) as client:
+        result = ingest_all(
+            templates,
+            args.source,
+            client[settings.database_name][settings.collection_name],
+            settings,
+            args.force,
+        )
+
+    print(
+        f"Ingested {result['ingested']}, updated {result['skipped']} unchanged "
+        f"and failed {result['failed']} templates"
+    )
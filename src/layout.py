@@ -0,0 +1,212 @@
+from __future__ import annotations
+
+import itertools
+from collections.abc import Iterator
+from dataclasses import dataclass
+
+# Up to this many templates every split into rows is tried, above only even grids
+MAX_EXHAUSTIVE_TEMPLATES = 8
+
+
+@dataclass(frozen=True)
+class Placement:
+    """
+    Where and how big a template is drawn on the canvas
+    """
+
+    x: int
+    y: int
+    width: int
+    height: int
+
+
+@dataclass(frozen=True)
+class Layout:
+    """
+    Arrangement of the templates on the canvas. The templates are split, in
+    order, into rows of the same width (by_rows) or columns of the same height
+    """
+
+    by_rows: bool
+    groups: tuple[int, ...]  # Number of templates per row or column
+    placements: tuple[Placement, ...]
+    size: tuple[int, int]
+    upscaled_pixels: int  # Pixels added by scaling templates up
+    fits: bool  # False if a template is below the minimum size
+
+    @property
+    def area(self) -> int:
+        return self.size[0] * self.size[1]
+
+    @property
+    def cost(self) -> int:
+        return self.area + self.upscaled_pixels
+
+    @property
+    def smallest_side(self) -> int:
+        """
+        :return: The smallest width or height of a template on the canvas
+        """
+        return min(min(p.width, p.height) for p in self.placements)
+
+    @property
+    def name(self) -> str:
+        if len(self.groups) == 1:
+            return "row" if self.by_rows else "column"
+        if all(count == 1 for count in self.groups):
+            return "column" if self.by_rows else "row"
+        kind = "rows" if self.by_rows else "columns"
+        return f"{kind} {'+'.join(map(str, self.groups))}"
+
+
+def split_into_groups(num_templates: int) -> Iterator[tuple[int, ...]]:
+    """
+    :param num_templates: Number of templates
+    :return: The number of templates per row of every split that is searched,
+    all splits for few templates, the even grids for many
+    """
+    if num_templates <= MAX_EXHAUSTIVE_TEMPLATES:
+        # Every subset of the gaps between the templates starts a new row
+        for cuts in itertools.product((False, True), repeat=num_templates - 1):
+            groups, count = [], 1
+            for cut in cuts:
+                if cut:
+                    groups.append(count)
+                    count = 1
+                else:
+                    count += 1
+            groups.append(count)
+            yield tuple(groups)
+        return
+
+    for num_groups in range(1, num_templates + 1):
+        size, extra = divmod(num_templates, num_groups)
+        yield tuple(size + (i < extra) for i in range(num_groups))
+
+
+def _arrange_rows(
+    sizes: list[tuple[int, int]],
+    groups: tuple[int, ...],
+    min_size: int,
+    max_size: tuple[int, int] | None,
+    scale: float,
+) -> tuple[list[Placement], tuple[int, int], bool]:
+    """
+    Scales the templates of every row to the same height, so that all rows have
+    the same width. That width is as big as possible without scaling any
+    template up, unless a bigger one is needed to keep every template at least
+    min_size pixels wide and high
+    :return: The placements, the size of the canvas and if the minimum size
+    is kept (up to rounding to whole pixels)
+    """
+    rows = []
+    start = 0
+    for count in groups:
+        rows.append(range(start, start + count))
+        start += count
+
+    # Width of every row if its templates are scaled to a height of 1
+    row_aspects = [sum(sizes[i][0] / sizes[i][1] for i in row) for row in rows]
+    # Height of the canvas at a width of 1
+    unit_height = sum(1 / aspect for aspect in row_aspects)
+
+    no_upscale_width = min(
+        aspect * sizes[i][1] for row, aspect in zip(rows, row_aspects) for i in row
+    )
+    min_width = max(
+        min_size * aspect / min(sizes[i][0] / sizes[i][1], 1)
+        for row, aspect in zip(rows, row_aspects)
+        for i in row
+    )
+    width = max(no_upscale_width, min_width)
+
+    fits = True
+    if max_size is not None:
+        max_width = min(max_size[0], max_size[1] / unit_height)
+        if width > max_width:
+            width = max_width
+            fits = width >= min_width
+    width *= scale
+
+    placements = []
+    y = 0
+    canvas_width = 0
+    for row, aspect in zip(rows, row_aspects):
+        height = max(1, int(width / aspect))
+        x = 0
+        for i in row:
+            template_width = max(1, int(height * sizes[i][0] / sizes[i][1]))
+            placements.append(Placement(x, y, template_width, height))
+            x += template_width
+        canvas_width = max(canvas_width, x)
+        y += height
+
+    return placements, (canvas_width, y), fits
+
+
+def arrange(
+    sizes: list[tuple[int, int]],
+    by_rows: bool,
+    groups: tuple[int, ...],
+    min_size: int,
+    max_size: tuple[int, int] | None = None,
+    scale: float = 1.0,
+) -> Layout:
+    """
+    :param sizes: The width and height of every template
+    :param by_rows: Split the templates into rows, otherwise into columns
+    :param groups: Number of templates per row or column
+    :param min_size: Minimum width and height of every template on the canvas
+    :param max_size: Maximum width and height of the canvas
+    :param scale: Factor applied to the canvas at the end (see RenderTier)
+    :return: The layout
+    """
+    if by_rows:
+        placements, size, fits = _arrange_rows(sizes, groups, min_size, max_size, scale)
+    else:
+        # Columns are rows of the transposed templates
+        placements, (height, width), fits = _arrange_rows(
+            [(h, w) for w, h in sizes],
+            groups,
+            min_size,
+            max_size[::-1] if max_size is not None else None,
+            scale,
+        )
+        placements = [Placement(p.y, p.x, p.height, p.width) for p in placements]
+        size = (width, height)
+
+    upscaled_pixels = sum(
+        max(0, p.width * p.height - w * h) for p, (w, h) in zip(placements, sizes)
+    )
+    return Layout(by_rows, groups, tuple(placements), size, upscaled_pixels, fits)
+
+
+def plan_layout(
+    sizes: list[tuple[int, int]],
+    min_size: int,
+    max_size: tuple[int, int] | None = None,
+    scale: float = 1.0,
+) -> Layout:
+    """
+    Searches rows, columns and grids for the layout with the smallest canvas
+    and the fewest upscaled pixels that keeps every template at least min_size
+    pixels wide and high
+    :param sizes: The width and height of every template, in the order they are shown
+    :param min_size: Minimum width and height of every template on the canvas
+    :param max_size: Maximum width and height of the canvas
+    :param scale: Factor applied to the canvas at the end (see RenderTier)
+    :return: The best layout. If no layout can keep the minimum size within
+    max_size, the one that shows the smallest template the biggest
+    """
+    assert len(sizes) > 0, "Please provide at least one image"
+    layouts = (
+        arrange(sizes, by_rows, groups, min_size, max_size, scale)
+        for by_rows in (True, False)
+        for groups in split_into_groups(len(sizes))
+    )
+    return min(
+        layouts,
+        key=lambda layout: (0, layout.cost)
+        if layout.fits
+        else (1, -layout.smallest_side),
+    )
@@ -2,8 +2,8 @@ from __future__ import annotations
 
 import argparse
 import asyncio
-import copy
 import json
+import logging
 import os
 import shlex
 
@@ -12,18 +12,39 @@ from command_names import CommandNames
 from dotenv import load_dotenv
 from meme_creator import ImageGenerator
 from meme_creator import ImageShuffler
+from memory_diagnostics import image_tracker
+from memory_diagnostics import MemoryDiagnostics
+from render_load import RenderLoadPolicy
+from render_state import RenderStateCache
 from schemas import Command
 from schemas import Settings
 from schemas import TranslationText
 from telegram import Update
+from telegram.constants import MessageLimit
 from telegram.ext import ApplicationBuilder
 from telegram.ext import CommandHandler
 from telegram.ext import ContextTypes
 from telegram.ext import filters
 from telegram.ext import MessageHandler
+from template_prefetch import TemplatePrefetcher
+from template_record import TemplateRecord
 
 # from command_names import CommandNamesLiteral
 
+logger = logging.getLogger(__name__)
+
+
+def configure_logging() -> None:
+    """
+    Write the log records of the bot to stderr, e.g. the render tier
+    of every shuffle
+    """
+    logging.basicConfig(
+        format="%(asctime)s %(name)s %(levelname)s %(message)s", level=logging.INFO
+    )
+    # httpx logs every request to the telegram API
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
 
 def format_instruction(
     command_name: CommandNames, commands_dict: dict[CommandNames, Command]
@@ -62,7 +83,11 @@ def get_num_help_text(i: int) -> str:
 
 
 async def shuffle(
-    update: Update, shuffler_obj: ImageShuffler, current_shuffle: dict
+    update: Update,
+    shuffler_obj: ImageShuffler,
+    current_shuffle: dict[int, dict[str, TemplateRecord]],
+    render_load: RenderLoadPolicy,
+    prefetcher: TemplatePrefetcher,
 ) -> None:
     # According to Google style guide, should not count on
     # atomicity of build in function:
@@ -70,9 +95,22 @@ async def shuffle(
     async with asyncio.Lock():
         current_shuffle[update.effective_user.id] = shuffler_obj.shuffle()
 
-    image_path = shuffler_obj.generate_shuffle_image(
-        update.effective_user.id,
-        copy.deepcopy(current_shuffle[update.effective_user.id]),
+    # The user picks one of the templates next, prepare them in the background
+    prefetcher.prefetch(
+        update.effective_user.id, current_shuffle[update.effective_user.id].values()
+    )
+
+    # The records are immutable, so they can be shared with the renderer
+    with render_load.render() as tier:
+        # Render in a worker thread, so other updates are handled in the meantime
+        image_path = await asyncio.to_thread(
+            shuffler_obj.generate_shuffle_image,
+            update.effective_user.id,
+            current_shuffle[update.effective_user.id],
+            tier,
+        )
+    logger.info(
+        "Shuffle of user %s rendered with tier %s", update.effective_user.id, tier.name
     )
 
     with open(image_path, "rb") as f:
@@ -82,12 +120,20 @@ async def shuffle(
     os.remove(image_path)
 
 
-async def select(update: Update, cur_shuffle: dict) -> None:
+async def select(
+    update: Update,
+    cur_shuffle: dict[int, dict[str, TemplateRecord]],
+    prefetcher: TemplatePrefetcher,
+    render_states: RenderStateCache,
+) -> None:
     """
     Format /A "Text One" "Text Two"
 
     :param update: The telegram update object
     :param cur_shuffle: The list of the 3 templates the user shuffles
+    :param prefetcher: Holds the templates prepared when the user shuffled
+    :param render_states: Holds the last render of the user, an edited
+    message only redraws the texts that changed
     :return:
     """
 
@@ -117,25 +163,26 @@ async def select(update: Update, cur_shuffle: dict) -> None:
     # Get the template the user selected
     item = cur_shuffle[update.effective_user.id][cmd]
     # make sure right number of texts were entered
-    if not texts or texts[0] == "" or len(texts) != len(item["text-locations"]):
-        await incoming_message.reply_text(
-            get_num_help_text(len(item["text-locations"]))
-        )
+    if not texts or texts[0] == "" or len(texts) != item.num_text_boxes:
+        await incoming_message.reply_text(get_num_help_text(item.num_text_boxes))
         return
 
-    # Generate the image
-    gen = ImageGenerator(
-        item["id"],
-        item["name"],
-        item["text-locations"],
-        item["template-location"],
-        str(update.effective_user.id),
-        settings,
-    )
+    # Generate the image, from the last render of the template or
+    # the prefetched template if it is ready
+    prefetched = None
+    if not render_states.holds(update.effective_user.id, item):
+        prefetched = prefetcher.get(update.effective_user.id, item)
+    with ImageGenerator.from_record(
+        item, str(update.effective_user.id), settings, prefetched
+    ) as gen:
+        image_path = render_states.render(update.effective_user.id, gen, texts)
+        is_animated = gen.is_animated
 
-    image_path = gen.add_all_text(texts)
     with open(image_path, "rb") as f:
-        await incoming_message.reply_photo(photo=f)
+        if is_animated:
+            await incoming_message.reply_animation(animation=f)
+        else:
+            await incoming_message.reply_photo(photo=f)
 
     # Remove the created image after it was sent
     os.remove(image_path)
@@ -148,6 +195,24 @@ async def start(update: Update, _: ContextTypes.DEFAULT_TYPE) -> None:
     await update.message.reply_html(instr)
 
 
+async def memory_report(
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
+    diagnostics: MemoryDiagnostics,
+    admin_ids: set[int],
+) -> None:
+    """
+    Admin only: reply with the current memory diagnostics report
+    """
+    if update.effective_user.id not in admin_ids:
+        await unknown(update, context)
+        return
+
+    # Taking a snapshot walks the heap, don't block the updates of other users
+    report = await asyncio.to_thread(diagnostics.report)
+    await update.message.reply_text(report[: MessageLimit.MAX_TEXT_LENGTH])
+
+
 async def unknown(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await context.bot.send_message(
         chat_id=update.effective_chat.id,
@@ -167,8 +232,15 @@ if __name__ == "__main__":
 
     args = parser.parse_args()
 
+    configure_logging()
     load_dotenv()
     TOKEN = os.getenv("TELEGRAM_TOKEN")
+    # Comma separated ids of the users that can use the admin commands
+    ADMIN_USER_IDS = {
+        int(user_id)
+        for user_id in os.getenv("ADMIN_USER_IDS", "").split(",")
+        if user_id.strip()
+    }
 
     # Load settings
     with open(args.config, "r") as file:
@@ -183,25 +255,36 @@ if __name__ == "__main__":
         text_data: TranslationText = TranslationText.from_dict(json.load(file))
 
     user_shuffle: dict[
-        str, dict
-    ] = {}  # key: username, value: current shuffle dict (db)
+        int, dict[str, TemplateRecord]
+    ] = {}  # key: user id, value: current shuffle (template records)
 
     # get all env variables and settings
     shuffler = ImageShuffler(
         settings
     )  # Everyone uses the same shuffler (is stateless).
+    # Lowers the quality of the shuffle images when many users shuffle at once
+    render_load = RenderLoadPolicy(settings)
+    template_prefetcher = TemplatePrefetcher(
+        settings, settings.prefetch_max_bytes, settings.prefetch_ttl
+    )
+    # The last render of every user, for edits of the pick message
+    render_states = RenderStateCache(
+        settings, settings.render_state_max_bytes, settings.render_state_ttl
+    )
 
     commands = {
         CommandNames.SHUFFLE: Command(
             description=text_data.shuffle_help_text,
             callback=lambda update, _: shuffle(
-                update, shuffler, user_shuffle
+                update, shuffler, user_shuffle, render_load, template_prefetcher
             ),  # function
             aliases=[CommandNames.SHUFFLE.value.lower()],
         ),
         CommandNames.PICK: Command(
             description=text_data.pick_help_text,
-            callback=lambda update, _: select(update, user_shuffle),
+            callback=lambda update, _: select(
+                update, user_shuffle, template_prefetcher, render_states
+            ),
             aliases=[
                 x for x in shuffler.settings.options if x != CommandNames.PICK.value
             ],
@@ -214,7 +297,8 @@ if __name__ == "__main__":
     }
 
     # Start the telegram bot
-    app = ApplicationBuilder().token(TOKEN).build()
+    # Handle updates concurrently, so the renders of different users can overlap
+    app = ApplicationBuilder().token(TOKEN).concurrent_updates(True).build()
 
     # register all commands
     for cmd_name, command in commands.items():
@@ -222,6 +306,30 @@ if __name__ == "__main__":
             CommandHandler([cmd_name.value] + command.aliases, command.callback)
         )
 
+    if settings.memory_diagnostics:
+        memory_diagnostics = MemoryDiagnostics(
+            image_tracker, settings.memory_snapshot_interval
+        )
+        memory_diagnostics.register_metrics("Canvas pool", shuffler.canvas_pool.stats)
+        if shuffler.compositor is not None:
+            memory_diagnostics.register_metrics(
+                "Array pool", shuffler.compositor.canvas_pool.stats
+            )
+        memory_diagnostics.register_metrics("Render load", render_load.stats)
+        memory_diagnostics.register_metrics(
+            "Template prefetch", template_prefetcher.stats
+        )
+        memory_diagnostics.register_metrics("Render state", render_states.stats)
+        memory_diagnostics.start()
+        app.add_handler(
+            CommandHandler(
+                CommandNames.MEMORY.value,
+                lambda update, context: memory_report(
+                    update, context, memory_diagnostics, ADMIN_USER_IDS
+                ),
+            )
+        )
+
     app.add_handler(MessageHandler(filters.COMMAND, unknown))
 
     print("Started telegram bot")
@@ -232,3 +340,6 @@ if __name__ == "__main__":
             "More than one instance of the telegram bot is running. "
             "Make sure only one is running"
         )
+    finally:
+        template_prefetcher.close()
+        render_states.close()
@@ -1,14 +1,39 @@
 from __future__ import annotations
 
+import functools
+import itertools
 import os.path
-import typing
-
+import uuid
+from array import array
+from collections.abc import Iterator
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
+
+from animation import GifStreamWriter
+from animation import iter_overlaid_frames
+from compositing import NumpyCompositor
 from dotenv import load_dotenv
+from image_pool import ImagePool
+from layout import Layout
+from layout import plan_layout
+from memory_diagnostics import close_image
+from memory_diagnostics import image_tracker
 from PIL import Image
 from PIL import ImageDraw
 from PIL import ImageFont
 from pymongo import MongoClient
+from schemas import RenderTier
 from schemas import Settings
+from template_record import iter_font_bounds
+from template_record import iter_text_boxes
+from template_record import scale_text_boxes
+from template_record import TemplateRecord
+from template_sampler import build_filter
+from template_sampler import RandomKeySampler
+from template_sampler import RENDER_PROJECTION
+
+if TYPE_CHECKING:
+    from template_prefetch import PrefetchedTemplate
 
 
 def singleton(class_):
@@ -41,26 +66,67 @@ class ImageShuffler:
 
         load_dotenv()
 
-        client = MongoClient(mongo_server_url)
+        self.client = MongoClient(mongo_server_url)
 
-        db = client[database_name]
+        db = self.client[database_name]
         self.collection = db[collection_name]
 
         self.num_items = self.collection.count_documents({})
 
-    def shuffle(self) -> dict[str, typing.Any]:
+        # $sample gets slow for big collections, sample by indexed random key instead
+        self.sampler = None
+        if self.settings.sampling_strategy == "random_key":
+            self.sampler = RandomKeySampler(self.collection)
+            self.sampler.prepare()
+
+        # Canvases are reused for stitched images of similar size (see size_class)
+        self.canvas_pool = ImagePool(self.settings.canvas_pool_max_bytes)
+
+        # None composites with PIL, the numpy backend pools its own arrays
+        self.compositor = None
+        if self.settings.compositing_backend == "numpy":
+            self.compositor = NumpyCompositor(self.settings, ImageGenerator)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self) -> None:
+        """
+        Close the connection to the database and free the pooled canvases
+        """
+        self.client.close()
+        self.canvas_pool.clear()
+        if self.compositor is not None:
+            self.compositor.canvas_pool.clear()
+
+    def shuffle(
+        self, tags: list[str] | None = None, language: str | None = None
+    ) -> dict[str, TemplateRecord]:
         """
         return 3 image paths with their associated id,
         name and template_location
+        :param tags: Only pick templates that have all of these tags
+        :param language: Only pick templates in this language
         """
-        res = {}  # key: "A","B" or "C" value: template element
+        res = {}  # key: "A","B" or "C" value: template record
 
-        for ind, sample in enumerate(
-            self.collection.aggregate(
-                [{"$sample": {"size": len(self.settings.options)}}]
-            )
-        ):
-            res[self.settings.options[ind]] = sample
+        if self.sampler is not None:
+            samples = self.sampler.sample(len(self.settings.options), tags, language)
+        else:
+            pipeline: list[dict] = [
+                {"$sample": {"size": len(self.settings.options)}},
+                {"$project": RENDER_PROJECTION},
+            ]
+            query = build_filter(tags, language)
+            if query:
+                pipeline.insert(0, {"$match": query})
+            samples = self.collection.aggregate(pipeline)
+
+        for ind, sample in enumerate(samples):
+            res[self.settings.options[ind]] = TemplateRecord.from_document(sample)
 
         return res
 
@@ -78,10 +144,18 @@ class ImageShuffler:
                 votes += 1
         return votes > 0
 
-    def _determine_dimensions(self, images: list[Image.Image], in_row) -> dict:
+    def _determine_dimensions(
+        self,
+        images: list[Image.Image],
+        in_row,
+        max_size: tuple[int, int] | None = None,
+    ) -> dict:
         """
         :param images: List of images
         :param in_row: Determine of the images should be stitched in a row
+        :param max_size: The maximum width and height of the final image.
+        If the images do not fit, max_width and max_height are reduced, so
+        _scale_images scales them directly to their size in the final image
         :return: Dict containing the dimensions of the final image
         and the start location of each image
         """
@@ -105,6 +179,20 @@ class ImageShuffler:
                 max_width = max(max_width, images[ind].width)
             image_coordinates.append((x, y))
 
+        if max_size is not None:
+            # Size of the final image if the images were scaled to the max height
+            # in a row or the max width in a column
+            if in_row:
+                width = sum(image.width * max_height / image.height for image in images)
+                height = max_height
+            else:
+                width = max_width
+                height = sum(image.height * max_width / image.width for image in images)
+
+            fit_ratio = min(1.0, max_size[0] / width, max_size[1] / height)
+            max_width = max(1, int(max_width * fit_ratio))
+            max_height = max(1, int(max_height * fit_ratio))
+
         return {
             "max_width": max_width,
             "max_height": max_height,
@@ -118,16 +206,19 @@ class ImageShuffler:
         in_row: bool,
         max_height: int,
         max_width: int,
-        cur_rotation,
-    ):
+        cur_rotation: dict[str, TemplateRecord],
+        resample: Image.Resampling = Image.Resampling.BICUBIC,
+    ) -> list[array]:
         """
-        Updates the parameter cur_rotation in place
+        Updates the parameters images and image_coordinates in place
         :param images: List of images
-        :param image_coordinates: List of image coordinates and text coordinates
+        :param image_coordinates: List of image coordinates
         :param in_row: Are images in a row or column
         :param max_height: Biggest image height
         :param max_width: Biggest image width
-        :return: Scaled image coordinates
+        :param cur_rotation: The selected templates, are not changed
+        :param resample: The resampling filter used to scale the images
+        :return: The scaled text boxes of every image
         """
         # Resize the image
         # In row => Set height
@@ -135,13 +226,17 @@ class ImageShuffler:
         # Cur x coordinate = prev width * prev scale_ratio
 
         prev_scale_ratio = [1] * (len(self.settings.options) + 1)
+        scaled_text_boxes = []
         for i in range(0, len(self.settings.options)):
             img = images[i]
 
             scale_ratio = max_height / img.height if in_row else max_width / img.width
 
             new_size = (int(img.width * scale_ratio), int(img.height * scale_ratio))
-            images[i] = img.resize(new_size)
+            # Let the JPEG decoder already reduce big downscales while decoding
+            img.draft(img.mode, new_size)
+            images[i] = image_tracker.track(img.resize(new_size, resample))
+            close_image(img)
 
             # Adjust the coordinates and text box location
             if i > 0:
@@ -158,74 +253,264 @@ class ImageShuffler:
                 )
 
             # Adjust the help text
-            for ctr, j in enumerate(
-                range(len(cur_rotation[self.settings.options[i]]["text-locations"]))
-            ):
-                x_co, y_co, w, h = cur_rotation[self.settings.options[i]][
-                    "text-locations"
-                ][j].values()
-                cur_rotation[self.settings.options[i]]["text-locations"][ctr][
-                    "x"
-                ] = int(x_co * scale_ratio)
-                cur_rotation[self.settings.options[i]]["text-locations"][ctr][
-                    "y"
-                ] = int(y_co * scale_ratio)
-
-                cur_rotation[self.settings.options[i]]["text-locations"][ctr][
-                    "width"
-                ] = int(w * scale_ratio)
-                cur_rotation[self.settings.options[i]]["text-locations"][ctr][
-                    "height"
-                ] = int(h * scale_ratio)
-
-    def generate_shuffle_image(self, user_id, cur_rotation) -> str:
+            scaled_text_boxes.append(
+                scale_text_boxes(
+                    cur_rotation[self.settings.options[i]].text_boxes, scale_ratio
+                )
+            )
+
+        return scaled_text_boxes
+
+    def generate_shuffle_image(
+        self,
+        user_id,
+        cur_rotation: dict[str, TemplateRecord],
+        tier: RenderTier | None = None,
+        max_size: tuple[int, int] | None = None,
+    ) -> str:
         """
         From the 3 selected shuffle images, create one composition
         where the letter "A"/"B"/"C" are added
+        :param tier: The quality to render with, the highest tier of the settings
+        if None (see RenderLoadPolicy)
+        :param max_size: The maximum width and height of the composition,
+        shuffle_max_size of the settings if None. The templates are scaled
+        once, directly to their final size, and the labels and guide texts are
+        drawn at the final size
         :return: Path to generated shuffle image
 
         """
         assert len(cur_rotation) != 0, "Call shuffle first to generate the images"
-        images = []
+        if max_size is None and self.settings.shuffle_max_size is not None:
+            max_size = tuple(self.settings.shuffle_max_size)
+
+        images: list[Image.Image] = []
+        try:
+            return self._generate_shuffle_image(
+                user_id,
+                cur_rotation,
+                images,
+                tier or self.settings.render_tiers[0],
+                max_size,
+            )
+        finally:
+            # Close all images, also the ones opened before an error occurred
+            for img in images:
+                close_image(img)
+
+    def _generate_shuffle_image(
+        self,
+        user_id,
+        cur_rotation: dict[str, TemplateRecord],
+        images: list[Image.Image],
+        tier: RenderTier,
+        max_size: tuple[int, int] | None,
+    ) -> str:
+        """
+        :param images: Empty list that is filled with all opened images,
+        so the caller can close them
+        :param tier: The quality to render with
+        :param max_size: The maximum width and height of the composition
+        """
         for opt in self.settings.options:
             images.append(
-                Image.open(
-                    os.path.join(
-                        self.settings.get_template_directory(),
-                        cur_rotation[opt]["template-location"],
+                image_tracker.track(
+                    Image.open(
+                        os.path.join(
+                            self.settings.get_template_directory(),
+                            cur_rotation[opt].template_location,
+                        )
                     )
                 )
             )
 
+        if self.settings.layout_strategy == "search":
+            image_coordinates, text_boxes, size = self._searched_layout(
+                images, cur_rotation, tier, max_size
+            )
+        else:
+            image_coordinates, text_boxes, size = self._row_or_column_layout(
+                images, cur_rotation, tier, max_size
+            )
+
+        # The templates overwrite their part of the pooled canvas,
+        # only the rest has to be cleared
+        covered = [
+            (x, y, x + image.width, y + image.height)
+            for image, (x, y) in zip(images, image_coordinates)
+        ]
+
+        if self.compositor is not None:
+            with self.compositor.render(
+                size, covered, images, image_coordinates, text_boxes
+            ) as stitched_image:
+                extension = os.path.splitext(self.settings.stitch_file_format)[1]
+                # Pillow encodes RGBX images as RGB JPEGs,
+                # the other formats need a converted copy
+                if (
+                    self.settings.file_mode == "RGB"
+                    and Image.registered_extensions().get(extension.lower()) == "JPEG"
+                ):
+                    return self._save_stitched_image(user_id, stitched_image, tier)
+                with stitched_image.convert(self.settings.file_mode) as converted:
+                    return self._save_stitched_image(user_id, converted, tier)
+
+        with self.canvas_pool.borrow(self.settings.file_mode, size, covered) as canvas:
+            self._composite(canvas, images, image_coordinates, text_boxes)
+            # The canvas is of the size class of the stitched image
+            with canvas.crop((0, 0) + size) as stitched_image:
+                return self._save_stitched_image(user_id, stitched_image, tier)
+
+    def _row_or_column_layout(
+        self,
+        images: list[Image.Image],
+        cur_rotation: dict[str, TemplateRecord],
+        tier: RenderTier,
+        max_size: tuple[int, int] | None,
+    ) -> tuple[list[tuple], list[array], tuple[int, int]]:
+        """
+        Stitches the images in a single row or column, scales the images in place
+        :return: The start coordinates of the images, their scaled text boxes
+        and the size of the stitched image
+        """
         in_row = self._images_in_row(images)
 
         # Determine the width, height and start coordinates
         # of the images of the stitched image
         max_width, max_height, image_coordinates = self._determine_dimensions(
-            images, in_row
+            images, in_row, max_size
         ).values()
 
         assert len(image_coordinates) > 0, "There are no coordinates for the image"
 
+        # Lower tiers render a smaller stitched image
+        max_width = max(1, int(max_width * tier.scale))
+        max_height = max(1, int(max_height * tier.scale))
+
         # Scale images to avoid black space
-        self._scale_images(
-            images, image_coordinates, in_row, max_height, max_width, cur_rotation
+        text_boxes = self._scale_images(
+            images,
+            image_coordinates,
+            in_row,
+            max_height,
+            max_width,
+            cur_rotation,
+            Image.Resampling[tier.resampling.upper()],
         )
 
-        # Create a new blank image with the calculated dimensions
+        # The dimensions of the stitched image
         if in_row:
             width = image_coordinates[-1][0] + images[-1].width
-            stitched_image = Image.new(self.settings.file_mode, (width, max_height))
+            size = (width, max_height)
         else:
             height = image_coordinates[-1][1] + images[-1].height
-            stitched_image = Image.new(
-                self.settings.file_mode,
-                (max_width, height),
+            size = (max_width, height)
+
+        return image_coordinates, text_boxes, size
+
+    def _searched_layout(
+        self,
+        images: list[Image.Image],
+        cur_rotation: dict[str, TemplateRecord],
+        tier: RenderTier,
+        max_size: tuple[int, int] | None,
+    ) -> tuple[list[tuple], list[array], tuple[int, int]]:
+        """
+        Searches rows, columns and grids for the smallest canvas (see plan_layout),
+        scales the images in place
+        :return: The start coordinates of the images, their scaled text boxes
+        and the size of the stitched image
+        """
+        layout = plan_layout(
+            [image.size for image in images],
+            self.settings.layout_min_template_size,
+            max_size,
+            tier.scale,
+        )
+        text_boxes = self._scale_to_layout(
+            images,
+            layout,
+            cur_rotation,
+            Image.Resampling[tier.resampling.upper()],
+        )
+        return [(p.x, p.y) for p in layout.placements], text_boxes, layout.size
+
+    def _scale_to_layout(
+        self,
+        images: list[Image.Image],
+        layout: Layout,
+        cur_rotation: dict[str, TemplateRecord],
+        resample: Image.Resampling = Image.Resampling.BICUBIC,
+    ) -> list[array]:
+        """
+        Scales every image once, directly to its size in the layout.
+        Updates the parameter images in place
+        :param images: List of images
+        :param layout: The planned layout
+        :param cur_rotation: The selected templates, are not changed
+        :param resample: The resampling filter used to scale the images
+        :return: The scaled text boxes of every image
+        """
+        scaled_text_boxes = []
+        for i, placement in enumerate(layout.placements):
+            img = images[i]
+            new_size = (placement.width, placement.height)
+            scale_ratio = placement.width / img.width
+
+            # Let the JPEG decoder already reduce big downscales while decoding
+            img.draft(img.mode, new_size)
+            images[i] = image_tracker.track(img.resize(new_size, resample))
+            close_image(img)
+
+            scaled_text_boxes.append(
+                scale_text_boxes(
+                    cur_rotation[self.settings.options[i]].text_boxes, scale_ratio
+                )
+            )
+
+        return scaled_text_boxes
+
+    def _save_stitched_image(
+        self, user_id, stitched_image: Image.Image, tier: RenderTier
+    ) -> str:
+        """
+        :param tier: Determines the encoder quality
+        :return: Path to the saved stitched image
+        """
+        # create the directory if needed
+        while not os.path.exists(self.settings.get_stitch_directory()):
+            os.makedirs(self.settings.get_stitch_directory())
+
+        image_path = str(
+            os.path.join(
+                self.settings.get_stitch_directory(),
+                # Renders of the same user can overlap, each gets its own file
+                self.settings.stitch_file_format % f"{user_id}_{uuid.uuid4().hex}",
             )
+        )
+        # Ignored by formats without a quality setting
+        stitched_image.save(image_path, quality=tier.jpeg_quality)
+        return image_path
 
+    def _composite(
+        self,
+        stitched_image: Image.Image,
+        images: list[Image.Image],
+        image_coordinates: list[tuple],
+        text_boxes: list[array],
+    ) -> None:
+        """
+        Paste the scaled images onto the canvas and add the labels and guide texts
+        :param stitched_image: The blank canvas, changed in place
+        :param images: The scaled images, get closed once they are pasted
+        :param image_coordinates: The start coordinates of the images
+        :param text_boxes: The scaled text boxes of every image
+        """
         # Paste the individual images onto the stitched image
         for ind in range(len(self.settings.options)):
             stitched_image.paste(images[ind], image_coordinates[ind])
+            # The scaled copy is not needed anymore, free it before drawing
+            close_image(images[ind])
 
         # Add "A"/"B"/"C" to the image
         draw = ImageDraw.Draw(stitched_image)
@@ -256,10 +541,8 @@ class ImageShuffler:
 
         # Add the guide text to the image
         for i in range(len(self.settings.options)):
-            for ind, elem in enumerate(
-                cur_rotation[self.settings.options[i]]["text-locations"]
-            ):
-                elem_x, elem_y, elem_with, elem_height = elem.values()
+            for ind, elem in enumerate(iter_text_boxes(text_boxes[i])):
+                elem_x, elem_y, elem_with, elem_height = elem
                 ImageGenerator.add_text(
                     draw,
                     f"{self.settings.placeholder_text}{ind + 1}",
@@ -270,24 +553,38 @@ class ImageShuffler:
                     self.settings,
                 )
 
-        # Save the stitched image
-        # create the directory if needed
-        while not os.path.exists(self.settings.get_stitch_directory()):
-            os.makedirs(self.settings.get_stitch_directory())
 
-        image_path = str(
-            os.path.join(
-                self.settings.get_stitch_directory(),
-                self.settings.stitch_file_format % user_id,
-            )
-        )
-        stitched_image.save(image_path)
+def load_font(settings: Settings, size: int) -> ImageFont.FreeTypeFont:
+    """
+    :param settings: the configuration dictionary
+    :param size: The font size
+    :return: The font of the settings in the given size, shared between calls
+    """
+    return _load_font_file(
+        os.path.join(
+            settings.assets_directory,
+            settings.fonts_directory,
+            settings.font_path,
+        ),
+        size,
+    )
 
-        # Close all images
-        for img in images:
-            img.close()
 
-        return image_path
+# The font sizes are searched for every text box, keep the fonts loaded
+@functools.lru_cache(maxsize=128)
+def _load_font_file(path: str, size: int) -> ImageFont.FreeTypeFont:
+    return ImageFont.truetype(path, size, layout_engine=ImageFont.Layout.BASIC)
+
+
+@dataclass(frozen=True)
+class TextLayout:
+    """
+    Where and how big a text is drawn, computed once by ImageGenerator.fit_text
+    """
+
+    position: tuple[float, float]
+    text: str
+    font: ImageFont.FreeTypeFont
 
 
 class ImageGenerator:
@@ -300,44 +597,117 @@ class ImageGenerator:
         self,
         _id,
         name,
-        text_locations: list,
+        text_boxes: array,
         template_name,
         username: str,
         settings: Settings,
+        font_bounds: array | None = None,
+        image: Image.Image | None = None,
     ):
         """
         :param _id: meme template id
         :param name: The name of the meme
-        :param text_locations: List of all locations of the text (x, y, width, height)
+        :param text_boxes: Flat array with the x, y, width, height of every text box
         :param template_name: The file name of the template
         :param username: id of user creating the meme
+        :param font_bounds: Precomputed min and max font size of every text box
+        :param image: The already decoded template, the generator closes it.
+        Opened from the template directory if None
         """
         self.id = _id
         self.name = name
-        self.text_locations = text_locations
+        self.text_boxes = text_boxes
+        self.font_bounds = font_bounds
         self.template_name = template_name
         self.username = username
+        # Renders of the same user can overlap (e.g. a pick and its quick edit),
+        # so every generator writes its own file
+        self.file_id = f"{username}_{uuid.uuid4().hex}"
 
         self.settings = settings
+        self.image: Image.Image | None = image
+
+        if self.image is None:
+            try:
+                self.image = image_tracker.track(
+                    Image.open(
+                        os.path.join(
+                            self.settings.get_template_directory(), self.template_name
+                        )
+                    )
+                )
+            except FileNotFoundError:
+                print("Could not find the file at location: ", self.template_name)
 
-        try:
-            self.image = Image.open(
-                os.path.join(self.settings.get_template_directory(), self.template_name)
+    @classmethod
+    def from_record(
+        cls,
+        record: TemplateRecord,
+        username: str,
+        settings: Settings,
+        prefetched: PrefetchedTemplate | None = None,
+    ) -> ImageGenerator:
+        """
+        :param record: The template for which text should be added
+        :param username: id of user creating the meme
+        :param prefetched: The template prepared by the TemplatePrefetcher,
+        its image is closed by the generator
+        :return: Generator for the template
+        """
+        if prefetched is None:
+            return cls(
+                record.id,
+                record.name,
+                record.text_boxes,
+                record.template_location,
+                username,
+                settings,
+                record.font_bounds,
             )
-        except FileNotFoundError:
-            print("Could not find the file at location: ", self.template_name)
+        return cls(
+            record.id,
+            record.name,
+            record.text_boxes,
+            record.template_location,
+            username,
+            settings,
+            prefetched.font_bounds,
+            prefetched.image,
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self) -> None:
+        """
+        Close the template image
+        """
+        close_image(self.image)
+        self.image = None
+
+    @property
+    def is_animated(self) -> bool:
+        return getattr(self.image, "is_animated", False)
 
     def get_file_path(self):
         """
-        :return: Path to where the finished image should be saved
+        :return: Path to where the finished image or animation should be saved
         """
         # create the directory if needed
         while not os.path.exists(self.settings.get_created_directory()):
             os.makedirs(self.settings.get_created_directory())
 
+        file_format = (
+            self.settings.created_animation_format
+            if self.is_animated
+            else self.settings.created_file_format
+        )
         return os.path.join(
             self.settings.get_created_directory(),
-            self.settings.created_file_format % self.username,
+            file_format % self.file_id,
         )
 
     def add_all_text(self, texts: list[str]) -> str:
@@ -346,24 +716,75 @@ class ImageGenerator:
         :return: image location
         :raises AssertionError if the length of texts does not match the number of boxes
         """
+        boxes = list(iter_text_boxes(self.text_boxes))
         assert len(texts) == len(
-            self.text_locations
+            boxes
         ), "The number of texts has to match the number of boxes"
 
-        draw = ImageDraw.Draw(self.image)
+        if self.is_animated:
+            return self._add_all_text_animated(texts, boxes)
 
-        for i in range(len(texts)):
-            text = texts[i]
-            x, y, width, height = self.text_locations[i].values()
+        draw = ImageDraw.Draw(self.image)
 
-            self.add_text(draw, text, x, y, width, height, self.settings)
+        for text, (x, y, width, height), font_bounds in zip(
+            texts, boxes, self._iter_font_bounds()
+        ):
+            self.add_text(draw, text, x, y, width, height, self.settings, font_bounds)
 
-        # Convert to rgb to prevent RGBA mode errors
-        if self.image.format == "PNG":
-            self.image = self.image.convert(self.settings.file_mode)
+        # Convert to rgb to prevent RGBA mode errors (e.g. of PNG templates)
+        if self.image.mode != self.settings.file_mode:
+            converted = image_tracker.track(self.image.convert(self.settings.file_mode))
+            close_image(self.image)
+            self.image = converted
         self.image.save(self.get_file_path())
         return self.get_file_path()
 
+    def _iter_font_bounds(self) -> Iterator[tuple[int, int] | None]:
+        """
+        :return: The precomputed font bounds of every box, None if there are none
+        """
+        if self.font_bounds is None:
+            return itertools.repeat(None)
+        return iter_font_bounds(self.font_bounds)
+
+    def _add_all_text_animated(
+        self, texts: list[str], boxes: list[tuple[int, int, int, int]]
+    ) -> str:
+        """
+        Lays out and rasterizes the texts once onto a transparent overlay,
+        then streams the frames one at a time: each frame is decoded, the
+        overlay is composited onto it and it is encoded right away. Memory stays
+        bounded by a few frames instead of the whole animation
+        :param texts: List of texts to insert in the boxes
+        :param boxes: The text boxes
+        :return: animation location
+        """
+        with Image.new("RGBA", self.image.size) as overlay:
+            draw = ImageDraw.Draw(overlay)
+            for text, (x, y, width, height), font_bounds in zip(
+                texts, boxes, self._iter_font_bounds()
+            ):
+                self.add_text(
+                    draw, text, x, y, width, height, self.settings, font_bounds
+                )
+
+            file_path = self.get_file_path()
+            try:
+                with open(file_path, "wb") as fp:
+                    # Play-once GIFs have no loop extension, they must not loop forever
+                    writer = GifStreamWriter(fp, loop=self.image.info.get("loop"))
+                    for frame, duration in iter_overlaid_frames(self.image, overlay):
+                        with frame:
+                            writer.write_frame(frame, duration)
+                    writer.close()
+            except BaseException:
+                # Do not leave a truncated animation behind
+                if os.path.exists(file_path):
+                    os.remove(file_path)
+                raise
+
+        return file_path
+
     @staticmethod
     def add_text(
         draw: ImageDraw.ImageDraw,
@@ -373,10 +794,10 @@ class ImageGenerator:
         width: int,
         height: int,
         settings: Settings | None,
+        font_bounds: tuple[int, int] | None = None,
     ) -> None:
         """
         Adds text to the ImageDraw object that fits the text box
-        Uses binary search to quickly find the biggest font size that fits the box
         :param draw: Draw object
         :param quote: The text that should be added
         :param x: x-coordinate of text location
@@ -384,8 +805,40 @@ class ImageGenerator:
         :param width: width of the text block
         :param height: height of the text block
         :param settings: the configuration dictionary
+        :param font_bounds: Precomputed min and max font size of the text box
         :return: None (Changed draw object in place)
         """
+        layout = ImageGenerator.fit_text(
+            draw, quote, x, y, width, height, settings, font_bounds
+        )
+        if layout is not None:
+            ImageGenerator.draw_text(draw, layout, settings)
+
+    @staticmethod
+    def fit_text(
+        draw: ImageDraw.ImageDraw,
+        quote: str,
+        x: int,
+        y: int,
+        width: int,
+        height: int,
+        settings: Settings | None,
+        font_bounds: tuple[int, int] | None = None,
+    ) -> TextLayout | None:
+        """
+        Finds the biggest font size for which the text fits the text box
+        Uses binary search to quickly find the biggest font size that fits the box
+        :param draw: Draw object used to measure the text
+        :param quote: The text that should be added
+        :param x: x-coordinate of text location
+        :param y: y-coordinate of text location
+        :param width: width of the text block
+        :param height: height of the text block
+        :param settings: the configuration dictionary
+        :param font_bounds: Precomputed min and max font size of the text box,
+        narrows down the search
+        :return: The layout of the text, None if it does not fit at any font size
+        """
 
         if settings is None:
             raise ValueError("Please provide a valid configuration dictionary")
@@ -394,20 +847,12 @@ class ImageGenerator:
         text_max_height = height * settings.text_box_height_ratio
 
         # Binary search for the maximum font size
-        low, high = settings.font_min_size, settings.font_max_size
-        font = None
+        low, high = font_bounds or (settings.font_min_size, settings.font_max_size)
+        layout = None
 
         while low <= high:
             mid = (low + high) // 2
-            candidate_font = ImageFont.truetype(
-                os.path.join(
-                    settings.assets_directory,
-                    settings.fonts_directory,
-                    settings.font_path,
-                ),
-                mid,
-                layout_engine=ImageFont.Layout.BASIC,
-            )
+            candidate_font = load_font(settings, mid)
 
             lines = []
             line = ""
@@ -435,19 +880,61 @@ class ImageGenerator:
             w, h = x2 - x1, y2 - y1
 
             if h <= text_max_height:
-                # The text fits comfortably
-                font = candidate_font
+                # The text fits comfortably, center it in the box
+                layout = TextLayout(
+                    (x + (width / 2 - w / 2 - x1), y + (height / 2 - h / 2 - y1)),
+                    formatted_text,
+                    candidate_font,
+                )
                 low = mid + 1
             else:
                 # The text does not fit comfortably, try a smaller font size
                 high = mid - 1
 
-        if font is not None:
-            draw.multiline_text(
-                (x + (width / 2 - w / 2 - x1), y + (height / 2 - h / 2 - y1)),
-                formatted_text,
-                font=font,
-                align="center",
-                stroke_width=settings.font_stroke_width,
-                stroke_fill=settings.font_stroke_fill,
+        return layout
+
+    @staticmethod
+    def font_size_bounds(height: int, settings: Settings) -> tuple[int, int]:
+        """
+        Bounds for the font size of a text box. Above the max size not even a
+        single lowercase letter fits the height of the box, so no text
+        containing a letter or digit can be drawn larger
+        :param height: height of the text block
+        :param settings: the configuration dictionary
+        :return: The min and max font size, max is smaller than min
+        if no font size fits
+        """
+        text_max_height = height * settings.text_box_height_ratio
+
+        low, high = settings.font_min_size, settings.font_max_size
+        while low <= high:
+            mid = (low + high) // 2
+            _, top, _, bottom = load_font(settings, mid).getbbox(
+                "x", stroke_width=settings.font_stroke_width
             )
+            if bottom - top <= text_max_height:
+                low = mid + 1
+            else:
+                high = mid - 1
+
+        return settings.font_min_size, high
+
+    @staticmethod
+    def draw_text(
+        draw: ImageDraw.ImageDraw, layout: TextLayout, settings: Settings
+    ) -> None:
+        """
+        Draws text that was laid out with fit_text
+        :param draw: Draw object
+        :param layout: The layout of the text
+        :param settings: the configuration dictionary
+        :return: None (Changed draw object in place)
+        """
+        draw.multiline_text(
+            layout.position,
+            layout.text,
+            font=layout.font,
+            align="center",
+            stroke_width=settings.font_stroke_width,
+            stroke_fill=settings.font_stroke_fill,
+        )
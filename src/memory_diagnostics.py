@@ -0,0 +1,221 @@
+from __future__ import annotations
+
+import collections
+import itertools
+import threading
+import time
+import tracemalloc
+import weakref
+from dataclasses import dataclass
+from typing import Callable
+
+from PIL import Image
+
+
+def image_bytes(image: Image.Image) -> int:
+    """
+    :param image: The PIL image
+    :return: Number of bytes the decoded pixel data of the image takes up
+    """
+    return image.width * image.height * len(image.getbands())
+
+
+class ImageTracker:
+    """
+    Keeps track of all PIL images that are currently open,
+    so that leaked image handles show up in the memory report
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tokens = itertools.count()
+        # key: id(image), value: (token, bytes)
+        self._live: dict[int, tuple[int, int]] = {}
+
+    def track(self, image: Image.Image) -> Image.Image:
+        """
+        Start tracking an image. The image is forgotten when it is
+        released or garbage collected
+        :param image: The image to track
+        :return: The same image, so the call can be chained
+        """
+        key = id(image)
+        token = next(self._tokens)
+        with self._lock:
+            self._live[key] = (token, image_bytes(image))
+
+        weakref.finalize(image, self._forget, key, token)
+        return image
+
+    def release(self, image: Image.Image) -> None:
+        """
+        Stop tracking an image (called when the image gets closed)
+        :param image: The image that was closed
+        """
+        with self._lock:
+            self._live.pop(id(image), None)
+
+    def _forget(self, key: int, token: int) -> None:
+        # Ids can be reused, only remove the entry of the image that was collected
+        with self._lock:
+            if self._live.get(key, (None,))[0] == token:
+                del self._live[key]
+
+    @property
+    def count(self) -> int:
+        return len(self._live)
+
+    @property
+    def total_bytes(self) -> int:
+        with self._lock:
+            return sum(size for _, size in self._live.values())
+
+
+def close_image(image: Image.Image | None) -> None:
+    """
+    Close an image and stop tracking it
+    :param image: The image to close, None is ignored
+    """
+    if image is None:
+        return
+    image_tracker.release(image)
+    image.close()
+
+
+@dataclass
+class MemorySnapshot:
+    timestamp: float
+    traced_current: int
+    traced_peak: int
+    live_images: int
+    live_image_bytes: int
+
+
+class MemoryDiagnostics:
+    """
+    Opt-in memory diagnostics. Periodically takes tracemalloc snapshots in a
+    background thread and compares them to the first snapshot, so allocations
+    that keep growing can be found
+    """
+
+    def __init__(
+        self,
+        tracker: ImageTracker,
+        interval: float,
+        history_size: int = 60,
+        top_n: int = 10,
+    ):
+        """
+        :param tracker: The tracker of the live images
+        :param interval: Seconds between two snapshots
+        :param history_size: How many snapshot summaries are kept
+        :param top_n: How many of the biggest allocation growths are reported
+        """
+        self.tracker = tracker
+        self.interval = interval
+        self.top_n = top_n
+        self.history: collections.deque[MemorySnapshot] = collections.deque(
+            maxlen=history_size
+        )
+        self.metrics: dict[str, Callable[[], dict]] = {}
+
+        self._baseline: tracemalloc.Snapshot | None = None
+        self._latest: tracemalloc.Snapshot | None = None
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        # Only stop tracing if it was not already started, e.g. with PYTHONTRACEMALLOC
+        self._started_tracing = False
+
+    def register_metrics(self, name: str, metrics: Callable[[], dict]) -> None:
+        """
+        Add additional metrics that are shown in the report
+        :param name: The name of the metrics section
+        :param metrics: Function returning the current metric values
+        """
+        self.metrics[name] = metrics
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+
+        self._stop.clear()
+        self.take_snapshot()
+        self._thread = threading.Thread(
+            target=self._run, name="memory-diagnostics", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.take_snapshot()
+
+    def take_snapshot(self) -> MemorySnapshot:
+        """
+        Take a tracemalloc snapshot and record the current memory usage
+        :return: The summary of the snapshot
+        """
+        snapshot = tracemalloc.take_snapshot().filter_traces(
+            (tracemalloc.Filter(False, tracemalloc.__file__),)
+        )
+        if self._baseline is None:
+            self._baseline = snapshot
+        self._latest = snapshot
+
+        current, peak = tracemalloc.get_traced_memory()
+        summary = MemorySnapshot(
+            timestamp=time.time(),
+            traced_current=current,
+            traced_peak=peak,
+            live_images=self.tracker.count,
+            live_image_bytes=self.tracker.total_bytes,
+        )
+        self.history.append(summary)
+        return summary
+
+    def report(self) -> str:
+        """
+        :return: Human-readable report of the current memory usage
+        and the allocations that grew the most since the first snapshot
+        """
+        summary = self.take_snapshot()
+        lines = [
+            f"Traced memory: {summary.traced_current / 1024:.1f} KiB "
+            f"(peak {summary.traced_peak / 1024:.1f} KiB)",
+            f"Live images: {summary.live_images} "
+            f"({summary.live_image_bytes / 1024:.1f} KiB)",
+            f"PIL allocator: {Image.core.get_stats()}",
+        ]
+
+        if len(self.history) > 1:
+            first = self.history[0]
+            lines.append(
+                f"Growth over {summary.timestamp - first.timestamp:.0f}s: "
+                f"{(summary.traced_current - first.traced_current) / 1024:+.1f} KiB"
+            )
+
+        for name, metrics in self.metrics.items():
+            lines.append(f"{name}: {metrics()}")
+
+        if self._baseline is not None and self._latest is not None:
+            lines.append(f"Top {self.top_n} allocation growths:")
+            stats = self._latest.compare_to(self._baseline, "lineno")
+            lines.extend(str(stat) for stat in stats[: self.top_n])
+
+        return "\n".join(lines)
+
+
+# Shared by all renderers, so the report covers every open image
+image_tracker = ImageTracker()
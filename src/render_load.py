@@ -0,0 +1,121 @@
+from __future__ import annotations
+
+import collections
+import contextlib
+import math
+import threading
+import time
+from collections.abc import Iterator
+from typing import Callable
+
+from schemas import RenderTier
+from schemas import Settings
+
+
+class RenderLoadPolicy:
+    """
+    Picks the render tier of the shuffle images based on the load.
+    If the number of renders in flight or the p95 latency of the recent renders
+    reaches the high threshold, the quality is stepped down one tier. Once both
+    are below the low threshold again, it is stepped back up one tier.
+    Between two steps at least load_tier_cooldown seconds pass,
+    so the tier does not flap with every request
+    """
+
+    def __init__(self, settings: Settings, clock: Callable[[], float] = time.monotonic):
+        """
+        :param settings: the configuration dictionary
+        :param clock: Returns the current time in seconds, replaced in tests
+        """
+        assert settings.render_tiers, "At least one render tier is needed"
+        self.settings = settings
+        self.clock = clock
+
+        self._lock = threading.Lock()
+        self._tier = 0
+        self._last_change = -math.inf
+        self._in_flight = 0
+        self._latencies: collections.deque[float] = collections.deque(
+            maxlen=settings.load_latency_window
+        )
+        # key: tier name, value: number of renders served with that tier
+        self._served: collections.Counter[str] = collections.Counter()
+
+    @property
+    def tier(self) -> RenderTier:
+        return self.settings.render_tiers[self._tier]
+
+    def p95_latency(self) -> float | None:
+        """
+        :return: The 95th percentile of the recent render latencies in seconds,
+        None if nothing was rendered yet
+        """
+        with self._lock:
+            return self._p95_latency()
+
+    def _p95_latency(self) -> float | None:
+        if not self._latencies:
+            return None
+        latencies = sorted(self._latencies)
+        return latencies[math.ceil(0.95 * len(latencies)) - 1]
+
+    def _update_tier(self, queue_depth: int) -> None:
+        """
+        Step the tier down or up by one if the load requires it
+        :param queue_depth: Number of renders in flight before the new one
+        """
+        now = self.clock()
+        if now - self._last_change < self.settings.load_tier_cooldown:
+            return
+
+        p95 = self._p95_latency()
+        overloaded = queue_depth >= self.settings.load_queue_depth_high or (
+            p95 is not None and p95 >= self.settings.load_p95_latency_high
+        )
+        relaxed = queue_depth <= self.settings.load_queue_depth_low and (
+            p95 is None or p95 <= self.settings.load_p95_latency_low
+        )
+
+        if overloaded and self._tier < len(self.settings.render_tiers) - 1:
+            self._tier += 1
+        elif relaxed and not overloaded and self._tier > 0:
+            self._tier -= 1
+        else:
+            return
+
+        self._last_change = now
+        # The latencies were measured at the old tier
+        self._latencies.clear()
+
+    @contextlib.contextmanager
+    def render(self) -> Iterator[RenderTier]:
+        """
+        Context manager around one render, from the moment the request
+        is received until the response is ready
+        :return: The tier the render has to use
+        """
+        with self._lock:
+            self._update_tier(self._in_flight)
+            self._in_flight += 1
+            tier = self.tier
+
+        start = self.clock()
+        try:
+            yield tier
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+                self._latencies.append(self.clock() - start)
+                self._served[tier.name] += 1
+
+    def stats(self) -> dict:
+        """
+        :return: The current tier, load and number of renders served per tier
+        """
+        with self._lock:
+            return {
+                "tier": self.tier.name,
+                "in_flight": self._in_flight,
+                "p95_latency": self._p95_latency(),
+                "served": dict(self._served),
+            }
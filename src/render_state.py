@@ -0,0 +1,331 @@
+from __future__ import annotations
+
+import itertools
+import math
+import threading
+import time
+from array import array
+from dataclasses import dataclass
+from typing import Callable
+
+from bounded_cache import BoundedCache
+from meme_creator import ImageGenerator
+from meme_creator import TextLayout
+from memory_diagnostics import close_image
+from memory_diagnostics import image_bytes
+from memory_diagnostics import image_tracker
+from PIL import Image
+from PIL import ImageDraw
+from schemas import Settings
+from template_record import iter_font_bounds
+from template_record import iter_text_boxes
+from template_record import TemplateRecord
+
+# Modes in which a patch can be drawn on its own and pasted back unchanged,
+# drawing on a palette image would add colors to the palette of the patch
+PATCHABLE_MODES = ("RGB", "RGBA")
+
+
+@dataclass
+class TextPatch:
+    """
+    The region of the template a text was drawn on
+    """
+
+    text: str
+    left: int
+    top: int
+    # None if the text does not fit the box at any font size
+    image: Image.Image | None
+
+    @property
+    def num_bytes(self) -> int:
+        return 0 if self.image is None else image_bytes(self.image)
+
+    @property
+    def box(self) -> tuple[int, int, int, int] | None:
+        if self.image is None:
+            return None
+        return (
+            self.left,
+            self.top,
+            self.left + self.image.width,
+            self.top + self.image.height,
+        )
+
+    def close(self) -> None:
+        close_image(self.image)
+        self.image = None
+
+
+@dataclass
+class _RenderState:
+    """
+    The last render of one user: the template without texts
+    and the patch of every text box
+    """
+
+    template_location: str
+    text_boxes: array
+    base: Image.Image
+    patches: list[TextPatch]
+
+    @property
+    def num_bytes(self) -> int:
+        return image_bytes(self.base) + sum(patch.num_bytes for patch in self.patches)
+
+    def close(self) -> None:
+        close_image(self.base)
+        for patch in self.patches:
+            patch.close()
+        self.patches.clear()
+
+
+def _overlaps(boxes: list[tuple[int, int, int, int]]) -> bool:
+    """
+    :return: True if any two of the boxes share a pixel
+    """
+    return any(
+        a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]
+        for a, b in itertools.combinations(boxes, 2)
+    )
+
+
+class RenderStateCache:
+    """
+    Keeps the last render of every user for a short time, so that an edited
+    pick message only redraws the text boxes whose text changed. Every text is
+    drawn onto its own patch of the template, the image is the template with
+    all patches pasted on top, which is the same as drawing the texts onto it.
+    States expire ttl seconds after they were last used and the least recently
+    used ones are dropped when they take up more than max_bytes
+    """
+
+    def __init__(
+        self,
+        settings: Settings,
+        max_bytes: int,
+        ttl: float,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        """
+        :param settings: the configuration dictionary
+        :param max_bytes: Maximum number of bytes of the templates and patches
+        :param ttl: Seconds after the last use at which a state is dropped
+        :param clock: Returns the current time in seconds, replaced in tests
+        """
+        self.settings = settings
+
+        self._lock = threading.Lock()
+        # key: user id, value: render state, least recently used first
+        self._states: BoundedCache[int, _RenderState] = BoundedCache(
+            max_bytes, ttl, clock
+        )
+
+        self.hits = 0
+        self.misses = 0
+        self.redrawn_boxes = 0
+        self.reused_boxes = 0
+
+    @property
+    def max_bytes(self) -> int:
+        return self._states.max_bytes
+
+    @max_bytes.setter
+    def max_bytes(self, max_bytes: int) -> None:
+        with self._lock:
+            self._states.max_bytes = max_bytes
+
+    def holds(self, user_id: int, record: TemplateRecord) -> bool:
+        """
+        :return: True if the last render of the user was of this template,
+        the template does not have to be decoded again then
+        """
+        with self._lock:
+            state = self._states.get(user_id)
+            return state is not None and self._matches(
+                state, record.template_location, record.text_boxes
+            )
+
+    @staticmethod
+    def _matches(state: _RenderState, template_location: str, text_boxes) -> bool:
+        return (
+            state.template_location == template_location
+            and state.text_boxes == text_boxes
+        )
+
+    def render(self, user_id: int, generator: ImageGenerator, texts: list[str]) -> str:
+        """
+        Adds the texts to the template of the generator, reuses the patches of
+        the unchanged texts if the user rendered the same template before
+        :param user_id: The user that picked the template
+        :param generator: Generator of the picked template, its image is only
+        decoded if there is no state for the template yet
+        :param texts: List of texts to insert in the boxes
+        :return: image location
+        """
+        with self._lock:
+            evicted = self._states.evict()
+            state = self._states.pop(user_id)
+        for evicted_state in evicted:
+            evicted_state.close()
+
+        if state is not None and not self._matches(
+            state, generator.template_name, generator.text_boxes
+        ):
+            state.close()
+            state = None
+
+        if state is None:
+            if generator.image is None:
+                # The template could not be found, the generator reports it
+                return generator.add_all_text(texts)
+            if generator.is_animated or generator.image.mode not in PATCHABLE_MODES:
+                return generator.add_all_text(texts)
+            state = _RenderState(
+                generator.template_name,
+                generator.text_boxes,
+                image_tracker.track(generator.image.copy()),
+                [],
+            )
+            with self._lock:
+                self.misses += 1
+        else:
+            with self._lock:
+                self.hits += 1
+
+        if not self._update_patches(state, generator, texts):
+            # Texts that overlap depend on the order they are drawn in
+            state.close()
+            return generator.add_all_text(texts)
+
+        file_path = generator.get_file_path()
+        with self._compose(state) as image:
+            image.save(file_path)
+
+        with self._lock:
+            self._states.put(user_id, state, state.num_bytes)
+            evicted = self._states.evict()
+        for evicted_state in evicted:
+            evicted_state.close()
+        return file_path
+
+    def _update_patches(
+        self, state: _RenderState, generator: ImageGenerator, texts: list[str]
+    ) -> bool:
+        """
+        Redraws the patches of the texts that changed
+        :return: False if the patches overlap, they can not be drawn on their own
+        """
+        boxes = list(iter_text_boxes(state.text_boxes))
+        assert len(texts) == len(
+            boxes
+        ), "The number of texts has to match the number of boxes"
+
+        if generator.font_bounds is None:
+            all_font_bounds = itertools.repeat(None)
+        else:
+            all_font_bounds = iter_font_bounds(generator.font_bounds)
+
+        # Only used to measure the texts, nothing is drawn on the template
+        draw = ImageDraw.Draw(state.base)
+        patches = []
+        reused = 0
+        for i, (text, box, font_bounds) in enumerate(
+            zip(texts, boxes, all_font_bounds)
+        ):
+            if i < len(state.patches) and state.patches[i].text == text:
+                patches.append(state.patches[i])
+                reused += 1
+                continue
+            if i < len(state.patches):
+                state.patches[i].close()
+            patches.append(self._draw_patch(state.base, draw, text, box, font_bounds))
+        state.patches = patches
+
+        with self._lock:
+            self.reused_boxes += reused
+            self.redrawn_boxes += len(patches) - reused
+
+        return not _overlaps([patch.box for patch in patches if patch.box is not None])
+
+    def _draw_patch(
+        self,
+        base: Image.Image,
+        draw: ImageDraw.ImageDraw,
+        text: str,
+        box: tuple[int, int, int, int],
+        font_bounds: tuple[int, int] | None,
+    ) -> TextPatch:
+        """
+        Fits the text into the box and draws it onto a copy of the part
+        of the template that it covers
+        """
+        layout = ImageGenerator.fit_text(draw, text, *box, self.settings, font_bounds)
+        if layout is None:
+            return TextPatch(text, 0, 0, None)
+
+        x, y = layout.position
+        left, top, right, bottom = draw.multiline_textbbox(
+            layout.position,
+            layout.text,
+            layout.font,
+            align="center",
+            stroke_width=self.settings.font_stroke_width,
+        )
+        # The patch starts at or before the whole pixel of the text position,
+        # so the text is drawn at the same sub-pixel offset as on the template
+        left = max(0, min(math.floor(left), math.floor(x)))
+        top = max(0, min(math.floor(top), math.floor(y)))
+        right = min(base.width, math.ceil(right) + 1)
+        bottom = min(base.height, math.ceil(bottom) + 1)
+        if right <= left or bottom <= top:
+            # The text is outside the template
+            return TextPatch(text, 0, 0, None)
+
+        patch = image_tracker.track(base.crop((left, top, right, bottom)))
+        ImageGenerator.draw_text(
+            ImageDraw.Draw(patch),
+            TextLayout((x - left, y - top), layout.text, layout.font),
+            self.settings,
+        )
+        return TextPatch(text, left, top, patch)
+
+    def _compose(self, state: _RenderState) -> Image.Image:
+        """
+        :return: The template with all patches pasted on top,
+        in the mode of the created images
+        """
+        image = state.base.copy()
+        for patch in state.patches:
+            if patch.image is not None:
+                image.paste(patch.image, (patch.left, patch.top))
+        if image.mode != self.settings.file_mode:
+            converted = image.convert(self.settings.file_mode)
+            image.close()
+            return converted
+        return image
+
+    def close(self) -> None:
+        """
+        Free all states
+        """
+        with self._lock:
+            states = self._states.clear()
+        for state in states:
+            state.close()
+
+    def stats(self) -> dict:
+        """
+        :return: Hit, redraw and eviction counters and the current size of the states
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "redrawn_boxes": self.redrawn_boxes,
+                "reused_boxes": self.reused_boxes,
+                "evictions": self._states.evictions,
+                "states": len(self._states),
+                "bytes": self._states.bytes,
+            }
@@ -2,8 +2,10 @@ from __future__ import annotations
 
 import os.path
 from dataclasses import dataclass
+from dataclasses import field
 from typing import Callable
 from typing import List
+from typing import Optional
 
 from dataclasses_json import dataclass_json
 
@@ -22,6 +24,27 @@ class TranslationText:
     placeholder_text: str
 
 
+@dataclass_json
+@dataclass
+class RenderTier:
+    """
+    Quality of the shuffle images, lower tiers are cheaper to render
+    """
+
+    name: str
+    scale: float  # Factor applied to the size of the stitched image
+    resampling: str  # Name of the PIL resampling filter used to scale the templates
+    jpeg_quality: int
+
+
+def default_render_tiers() -> list[RenderTier]:
+    return [
+        RenderTier("full", 1.0, "bicubic", 75),
+        RenderTier("reduced", 0.75, "bilinear", 65),
+        RenderTier("minimal", 0.5, "nearest", 50),
+    ]
+
+
 @dataclass_json
 @dataclass
 class Settings:
@@ -52,6 +75,30 @@ class Settings:
     created_file_format: str
     text_box_width_ratio: float
     text_box_height_ratio: float
+    memory_diagnostics: bool = False
+    memory_snapshot_interval: float = 60
+    canvas_pool_max_bytes: int = 64 * 1024 * 1024
+    sampling_strategy: str = "sample"
+    created_animation_format: str = "created_%s.gif"
+    template_max_resolution: List[int] = field(default_factory=lambda: [1024, 1024])
+    template_jpeg_quality: int = 90
+    compositing_backend: str = "pil"
+    # Highest quality first, see RenderLoadPolicy
+    render_tiers: List[RenderTier] = field(default_factory=default_render_tiers)
+    load_queue_depth_high: int = 8
+    load_queue_depth_low: int = 2
+    load_p95_latency_high: float = 3.0
+    load_p95_latency_low: float = 1.0
+    load_latency_window: int = 50
+    load_tier_cooldown: float = 10.0
+    # Telegram downscales bigger photos anyway, None does not limit the size
+    shuffle_max_size: Optional[List[int]] = None
+    prefetch_max_bytes: int = 64 * 1024 * 1024
+    prefetch_ttl: float = 300
+    layout_strategy: str = "row_or_column"
+    layout_min_template_size: int = 240
+    render_state_max_bytes: int = 32 * 1024 * 1024
+    render_state_ttl: float = 120
 
     def get_stitch_directory(self):
         return os.path.join(self.assets_directory, self.stitch_directory)
@@ -0,0 +1,295 @@
+from __future__ import annotations
+
+import os
+import threading
+import time
+from array import array
+from collections.abc import Iterable
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable
+
+from bounded_cache import BoundedCache
+from meme_creator import ImageGenerator
+from meme_creator import load_font
+from memory_diagnostics import close_image
+from memory_diagnostics import image_bytes
+from memory_diagnostics import image_tracker
+from PIL import Image
+from schemas import Settings
+from template_record import iter_font_bounds
+from template_record import iter_text_boxes
+from template_record import TemplateRecord
+
+
+@dataclass
+class PrefetchedTemplate:
+    """
+    A template that was decoded before the user picked it
+    """
+
+    template_location: str
+    # None for animated templates, their frames are decoded while streaming
+    image: Image.Image | None
+    font_bounds: array  # min, max font size of every text box
+
+    @property
+    def num_bytes(self) -> int:
+        return 0 if self.image is None else image_bytes(self.image)
+
+
+@dataclass
+class _Prefetch:
+    """
+    The prefetched templates of one shuffle
+    """
+
+    cancelled: threading.Event
+    templates: dict[str, PrefetchedTemplate]
+    future: Future | None = None
+
+    def cancel(self) -> None:
+        """
+        Stop the background thread from adding more templates
+        """
+        self.cancelled.set()
+        if self.future is not None:
+            self.future.cancel()
+
+    def close(self) -> None:
+        for template in self.templates.values():
+            close_image(template.image)
+        self.templates.clear()
+
+
+class TemplatePrefetcher:
+    """
+    Speculatively prepares the templates of a shuffle in a background thread,
+    since the user picks one of them next: decodes the images, computes
+    the font size bounds of the text boxes and loads the fonts of those sizes.
+    A new shuffle of the same user cancels the previous prefetch. Prefetches
+    expire after ttl seconds and the least recently used ones are dropped
+    when the decoded images take up more than max_bytes
+    """
+
+    def __init__(
+        self,
+        settings: Settings,
+        max_bytes: int,
+        ttl: float,
+        max_workers: int = 2,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        """
+        :param settings: the configuration dictionary
+        :param max_bytes: Maximum number of bytes of the decoded templates
+        :param ttl: Seconds after which a prefetch is dropped
+        :param max_workers: Number of background threads
+        :param clock: Returns the current time in seconds, replaced in tests
+        """
+        self.settings = settings
+
+        self._executor = ThreadPoolExecutor(max_workers, "template-prefetch")
+        self._lock = threading.Lock()
+        # key: user id, value: prefetch, least recently used first
+        self._prefetches: BoundedCache[int, _Prefetch] = BoundedCache(
+            max_bytes, ttl, clock
+        )
+
+        self.hits = 0
+        self.misses = 0
+
+    def prefetch(self, user_id: int, records: Iterable[TemplateRecord]) -> Future:
+        """
+        Start preparing the templates of a shuffle,
+        replaces the previous prefetch of the user
+        :param user_id: The user that shuffled
+        :param records: The templates of the shuffle
+        :return: Future that is done once the templates are prepared
+        """
+        prefetch = _Prefetch(threading.Event(), {})
+        with self._lock:
+            previous = self._remove(user_id)
+            # Drop the expired prefetches of users that did not pick a template
+            evicted = self._evict()
+            self._prefetches.put(user_id, prefetch)
+            prefetch.future = self._executor.submit(
+                self._run, user_id, prefetch, list(records)
+            )
+
+        if previous is not None:
+            previous.close()
+        for evicted_prefetch in evicted:
+            evicted_prefetch.close()
+        return prefetch.future
+
+    def cancel(self, user_id: int) -> None:
+        """
+        Stop the prefetch of the user and free its templates
+        """
+        with self._lock:
+            prefetch = self._remove(user_id)
+        if prefetch is not None:
+            prefetch.close()
+
+    def _remove(self, user_id: int) -> _Prefetch | None:
+        """
+        Must be called with the lock held, the caller closes the prefetch
+        """
+        prefetch = self._prefetches.pop(user_id)
+        if prefetch is not None:
+            prefetch.cancel()
+        return prefetch
+
+    def _run(
+        self, user_id: int, prefetch: _Prefetch, records: list[TemplateRecord]
+    ) -> None:
+        for record in records:
+            if prefetch.cancelled.is_set():
+                return
+            template = self._prepare(record)
+
+            with self._lock:
+                if prefetch.cancelled.is_set():
+                    close_image(template.image)
+                    return
+                prefetch.templates[record.template_location] = template
+                self._prefetches.add_bytes(user_id, template.num_bytes)
+                evicted = self._evict()
+
+            for evicted_prefetch in evicted:
+                evicted_prefetch.close()
+
+    def _prepare(self, record: TemplateRecord) -> PrefetchedTemplate:
+        """
+        :return: The decoded template with the font bounds of its text boxes,
+        the fonts of those sizes are loaded as well
+        """
+        font_bounds = record.font_bounds
+        if font_bounds is None:
+            font_bounds = array(
+                "i",
+                (
+                    size
+                    for _, _, _, height in iter_text_boxes(record.text_boxes)
+                    for size in ImageGenerator.font_size_bounds(height, self.settings)
+                ),
+            )
+        for low, high in iter_font_bounds(font_bounds):
+            for size in range(low, high + 1):
+                load_font(self.settings, size)
+
+        image = None
+        try:
+            with Image.open(
+                os.path.join(
+                    self.settings.get_template_directory(), record.template_location
+                )
+            ) as template:
+                if not getattr(template, "is_animated", False):
+                    # Copies the decoded pixels, so the file can be closed
+                    image = image_tracker.track(template.copy())
+        except FileNotFoundError:
+            print("Could not find the file at location: ", record.template_location)
+
+        return PrefetchedTemplate(record.template_location, image, font_bounds)
+
+    def _evict(self) -> list[_Prefetch]:
+        """
+        Must be called with the lock held, the caller closes the evicted prefetches
+        :return: The expired prefetches and the least recently used ones
+        above max_bytes
+        """
+        evicted = self._prefetches.evict()
+        for prefetch in evicted:
+            prefetch.cancel()
+        return evicted
+
+    def get(self, user_id: int, record: TemplateRecord) -> PrefetchedTemplate | None:
+        """
+        :param user_id: The user that picked the template
+        :param record: The picked template
+        :return: The prefetched template with a copy of the decoded image the
+        caller has to close, None if it was not prefetched (yet)
+        """
+        with self._lock:
+            evicted = self._evict()
+            prefetch = self._prefetches.get(user_id)
+            template = (
+                prefetch.templates.get(record.template_location)
+                if prefetch is not None
+                else None
+            )
+            if template is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._prefetches.touch(user_id)
+                if template.image is not None:
+                    # Taken out while it is copied, so it is not closed meanwhile
+                    del prefetch.templates[record.template_location]
+                    self._prefetches.add_bytes(user_id, -template.num_bytes)
+
+        for evicted_prefetch in evicted:
+            evicted_prefetch.close()
+        if prefetch is None or template is None or template.image is None:
+            return template
+
+        # Copy outside the lock, it would block the prefetches of all users
+        copy = PrefetchedTemplate(
+            template.template_location,
+            image_tracker.track(template.image.copy()),
+            template.font_bounds,
+        )
+        self._put_back(user_id, prefetch, template)
+        return copy
+
+    def _put_back(
+        self, user_id: int, prefetch: _Prefetch, template: PrefetchedTemplate
+    ) -> None:
+        """
+        Return a template taken out by get, the same template can be picked
+        again, e.g. by editing the message
+        """
+        evicted = []
+        with self._lock:
+            # Cancelled prefetches are no longer in the cache
+            kept = (
+                not prefetch.cancelled.is_set()
+                and template.template_location not in prefetch.templates
+            )
+            if kept:
+                prefetch.templates[template.template_location] = template
+                self._prefetches.add_bytes(user_id, template.num_bytes)
+                evicted = self._evict()
+
+        if not kept:
+            close_image(template.image)
+        for evicted_prefetch in evicted:
+            evicted_prefetch.close()
+
+    def close(self) -> None:
+        """
+        Stop the background threads and free all templates
+        """
+        with self._lock:
+            prefetches = self._prefetches.clear()
+            for prefetch in prefetches:
+                prefetch.cancel()
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        for prefetch in prefetches:
+            prefetch.close()
+
+    def stats(self) -> dict:
+        """
+        :return: Hit and eviction counters and the current size of the prefetches
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self._prefetches.evictions,
+                "prefetches": len(self._prefetches),
+                "bytes": self._prefetches.bytes,
+            }
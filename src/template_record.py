@@ -0,0 +1,118 @@
+from __future__ import annotations
+
+from array import array
+from collections.abc import Iterator
+from dataclasses import dataclass
+from typing import Any
+
+# Order of the values of one text box in the flat text box array
+TEXT_BOX_FIELDS = ("x", "y", "width", "height")
+
+
+def text_boxes_from_locations(text_locations: list[dict[str, int]]) -> array:
+    """
+    :param text_locations: The "text-locations" of a template document
+    :return: Flat array with x, y, width, height of every text box
+    """
+    return array(
+        "i",
+        (
+            int(location[field])
+            for location in text_locations
+            for field in TEXT_BOX_FIELDS
+        ),
+    )
+
+
+def iter_text_boxes(text_boxes: array) -> Iterator[tuple[int, int, int, int]]:
+    """
+    :param text_boxes: Flat text box array
+    :return: Iterator over the (x, y, width, height) of every text box
+    """
+    # Zipping the same iterator four times groups the values per box
+    values = iter(text_boxes)
+    return zip(values, values, values, values)
+
+
+def iter_font_bounds(font_bounds: array) -> Iterator[tuple[int, int]]:
+    """
+    :param font_bounds: Flat array with the min and max font size of every text box
+    :return: Iterator over the (min, max) font size of every text box
+    """
+    sizes = iter(font_bounds)
+    return zip(sizes, sizes)
+
+
+def scale_text_boxes(text_boxes: array, scale_ratio: float) -> array:
+    """
+    :param text_boxes: Flat text box array
+    :param scale_ratio: Factor by which the template image got scaled
+    :return: New array with the scaled text boxes, the input is not changed
+    """
+    return array("i", (int(value * scale_ratio) for value in text_boxes))
+
+
+@dataclass(frozen=True, slots=True)
+class TemplateRecord:
+    """
+    Immutable view of a template document of the database
+    that only keeps what is needed to render the template
+    """
+
+    id: str
+    name: str
+    template_location: str
+    text_boxes: array  # x, y, width, height of every text box, see TEXT_BOX_FIELDS
+    # Set by the template ingestion, None for templates that were added by hand
+    width: int | None = None
+    height: int | None = None
+    font_bounds: array | None = None  # min, max font size of every text box
+
+    @classmethod
+    def from_document(cls, document: dict[str, Any]) -> TemplateRecord:
+        """
+        :param document: Template document as stored in the database
+        :return: The record of the template
+        """
+        return cls(
+            id=document["id"],
+            name=document["name"],
+            template_location=document["template-location"],
+            text_boxes=text_boxes_from_locations(document["text-locations"]),
+            width=document.get("width"),
+            height=document.get("height"),
+            font_bounds=(
+                array(
+                    "i", (size for bounds in document["font-bounds"] for size in bounds)
+                )
+                if "font-bounds" in document
+                else None
+            ),
+        )
+
+    def to_document(self) -> dict[str, Any]:
+        """
+        :return: The record in the format of the database documents
+        """
+        document: dict[str, Any] = {
+            "id": self.id,
+            "name": self.name,
+            "text-locations": [
+                dict(zip(TEXT_BOX_FIELDS, box))
+                for box in iter_text_boxes(self.text_boxes)
+            ],
+            "template-location": self.template_location,
+        }
+        if self.width is not None:
+            document["width"] = self.width
+        if self.height is not None:
+            document["height"] = self.height
+        if self.font_bounds is not None:
+            document["font-bounds"] = [
+                list(bounds) for bounds in iter_font_bounds(self.font_bounds)
+            ]
+        return document
+
+    @property
+    def num_text_boxes(self) -> int:
+        return len(self.text_boxes) // len(TEXT_BOX_FIELDS)
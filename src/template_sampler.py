@@ -0,0 +1,144 @@
+from __future__ import annotations
+
+import random
+from typing import Any
+
+from pymongo import ASCENDING
+from pymongo import UpdateOne
+from pymongo.collection import Collection
+
+# Indexed field holding a uniformly distributed random number in [0, 1)
+RANDOM_KEY_FIELD = "random-key"
+
+# Only the fields the renderer needs (see TemplateRecord.from_document)
+RENDER_PROJECTION = {
+    "id": 1,
+    "name": 1,
+    "text-locations": 1,
+    "template-location": 1,
+    "width": 1,
+    "height": 1,
+    "font-bounds": 1,
+}
+
+
+def build_filter(tags: list[str] | None = None, language: str | None = None) -> dict:
+    """
+    :param tags: Only templates that have all of these tags
+    :param language: Only templates in this language
+    :return: The mongo filter
+    """
+    query: dict[str, Any] = {}
+    if tags:
+        query["tags"] = {"$all": tags}
+    if language is not None:
+        query["language"] = language
+    return query
+
+
+class RandomKeySampler:
+    """
+    Samples distinct templates with index range lookups on a random key
+    instead of $sample, which gets slow for big collections.
+    Every lookup picks a random number and takes the first template
+    whose key is greater or equal, wrapping around at the end. That picks a
+    template with the probability of the gap before its key, so picked
+    templates get a new key to keep the picks uniform over time
+    """
+
+    def __init__(self, collection: Collection, rng: random.Random | None = None):
+        """
+        :param collection: The template collection
+        :param rng: The random number generator, seeded in tests
+        """
+        self.collection = collection
+        self.rng = rng or random.Random()
+
+    def ensure_indexes(self) -> None:
+        """
+        Create the indexes for the lookups, also when filtering by tags or language
+        """
+        self.collection.create_index([(RANDOM_KEY_FIELD, ASCENDING)])
+        self.collection.create_index(
+            [("tags", ASCENDING), (RANDOM_KEY_FIELD, ASCENDING)]
+        )
+        self.collection.create_index(
+            [("language", ASCENDING), (RANDOM_KEY_FIELD, ASCENDING)]
+        )
+
+    def assign_random_keys(self, batch_size: int = 1000) -> int:
+        """
+        Give every template without a random key one
+        :param batch_size: Number of updates sent to the database at once
+        :return: Number of updated templates
+        """
+        updated = 0
+        updates = []
+        for document in self.collection.find(
+            {RANDOM_KEY_FIELD: {"$exists": False}}, {"_id": 1}
+        ):
+            updates.append(
+                UpdateOne(
+                    {"_id": document["_id"]},
+                    {"$set": {RANDOM_KEY_FIELD: self.rng.random()}},
+                )
+            )
+            if len(updates) >= batch_size:
+                updated += self.collection.bulk_write(updates).modified_count
+                updates = []
+
+        if updates:
+            updated += self.collection.bulk_write(updates).modified_count
+        return updated
+
+    def prepare(self) -> None:
+        """
+        Make sure the collection can be sampled
+        """
+        self.ensure_indexes()
+        self.assign_random_keys()
+
+    def _first_from(self, query: dict, key_range: dict) -> dict | None:
+        return self.collection.find_one(
+            {**query, RANDOM_KEY_FIELD: key_range},
+            RENDER_PROJECTION,
+            sort=[(RANDOM_KEY_FIELD, ASCENDING)],
+        )
+
+    def sample(
+        self, k: int, tags: list[str] | None = None, language: str | None = None
+    ) -> list[dict]:
+        """
+        :param k: Number of templates
+        :param tags: Only templates that have all of these tags
+        :param language: Only templates in this language
+        :return: Up to k distinct templates, fewer if not enough templates match
+        """
+        query = build_filter(tags, language)
+        picked: list[dict] = []
+
+        for _ in range(k):
+            if picked:
+                query["_id"] = {"$nin": [doc["_id"] for doc in picked]}
+
+            key = self.rng.random()
+            document = self._first_from(query, {"$gte": key})
+            if document is None:
+                # Wrap around to the start of the key range
+                document = self._first_from(query, {"$lt": key})
+            if document is None:
+                break
+            picked.append(document)
+
+        if picked:
+            self.collection.bulk_write(
+                [
+                    UpdateOne(
+                        {"_id": doc["_id"]},
+                        {"$set": {RANDOM_KEY_FIELD: self.rng.random()}},
+                    )
+                    for doc in picked
+                ],
+                ordered=False,
+            )
+        return picked
@@ -0,0 +1,198 @@
+from __future__ import annotations
+
+import io
+import os
+from unittest.mock import patch
+
+import pytest
+from PIL import Image
+from PIL import ImageSequence
+
+from src.animation import GifStreamWriter
+from src.meme_creator import ImageGenerator
+from src.schemas import Settings
+from src.template_record import text_boxes_from_locations
+
+FRAME_COLORS = [(200, 30, 30), (30, 200, 30), (30, 30, 200), (200, 200, 30)]
+TEXT_BOXES = [
+    {"x": 10, "y": 10, "width": 140, "height": 40},
+    {"x": 10, "y": 70, "width": 140, "height": 40},
+]
+
+
+@pytest.fixture()
+def animated_settings(tmp_settings, tmp_path) -> Settings:
+    frames = [Image.new("RGB", (160, 120), color) for color in FRAME_COLORS]
+    frames[0].save(
+        tmp_path / "animated.gif",
+        save_all=True,
+        append_images=frames[1:],
+        duration=[100, 200, 300, 400],
+        loop=0,
+    )
+    return tmp_settings
+
+
+@pytest.fixture()
+def animated_gen(animated_settings):
+    with ImageGenerator(
+        "0",
+        "animated",
+        text_boxes_from_locations(TEXT_BOXES),
+        "animated.gif",
+        "test_user",
+        animated_settings,
+    ) as gen:
+        yield gen
+
+
+class TestAnimatedTemplate:
+    def test_all_frames_get_text(self, animated_gen):
+        assert animated_gen.is_animated
+
+        path = animated_gen.add_all_text(["Hello", "World"])
+
+        assert path.endswith(".gif")
+        with Image.open(path) as result:
+            assert result.n_frames == len(FRAME_COLORS)
+            assert result.info["loop"] == 0
+            for frame, color in zip(ImageSequence.Iterator(result), FRAME_COLORS):
+                rgb = frame.convert("RGB")
+                # Background keeps the frame color, the text is white
+                assert _close(rgb.getpixel((155, 115)), color)
+                assert (255, 255, 255) in {c for _, c in rgb.getcolors(1 << 16)}
+
+    def test_durations(self, animated_gen):
+        path = animated_gen.add_all_text(["Hello", "World"])
+
+        with Image.open(path) as result:
+            durations = [f.info["duration"] for f in ImageSequence.Iterator(result)]
+        assert durations == [100, 200, 300, 400]
+
+    def test_play_once(self, animated_settings, tmp_path):
+        frames = [Image.new("RGB", (160, 120), color) for color in FRAME_COLORS]
+        # Saved without a loop, the animation is played once
+        frames[0].save(
+            tmp_path / "once.gif", save_all=True, append_images=frames[1:], duration=100
+        )
+        with Image.open(tmp_path / "once.gif") as template:
+            assert "loop" not in template.info
+
+        with ImageGenerator(
+            "0",
+            "once",
+            text_boxes_from_locations(TEXT_BOXES),
+            "once.gif",
+            "test_user",
+            animated_settings,
+        ) as gen:
+            path = gen.add_all_text(["Hello", "World"])
+
+        with Image.open(path) as result:
+            assert result.n_frames == len(FRAME_COLORS)
+            assert "loop" not in result.info
+
+    def test_transparency(self, animated_settings, tmp_path):
+        frames = []
+        for color in FRAME_COLORS:
+            frame = Image.new("RGBA", (160, 120), color + (255,))
+            frame.paste((0, 0, 0, 0), (0, 0, 5, 120))
+            frames.append(frame)
+        frames[0].save(
+            tmp_path / "transparent.gif",
+            save_all=True,
+            append_images=frames[1:],
+            duration=100,
+            disposal=2,
+        )
+
+        with ImageGenerator(
+            "0",
+            "transparent",
+            text_boxes_from_locations(TEXT_BOXES),
+            "transparent.gif",
+            "test_user",
+            animated_settings,
+        ) as gen:
+            path = gen.add_all_text(["Hello", "World"])
+
+        with Image.open(path) as result:
+            assert result.n_frames == len(FRAME_COLORS)
+            for frame, color in zip(ImageSequence.Iterator(result), FRAME_COLORS):
+                rgba = frame.convert("RGBA")
+                assert rgba.getpixel((2, 60))[3] == 0
+                assert _close(rgba.getpixel((155, 115)), color + (255,))
+
+    def test_failed_encoding_leaves_no_file(self, animated_gen, monkeypatch):
+        class FailingWriter(GifStreamWriter):
+            def write_frame(self, frame: Image.Image, duration: int) -> None:
+                if self.frames == 2:
+                    raise OSError("Disk full")
+                super().write_frame(frame, duration)
+
+        monkeypatch.setattr("src.meme_creator.GifStreamWriter", FailingWriter)
+
+        with pytest.raises(OSError):
+            animated_gen.add_all_text(["Hello", "World"])
+        assert not os.path.exists(animated_gen.get_file_path())
+
+    def test_layout_computed_once(self, animated_gen):
+        with patch.object(
+            ImageGenerator, "fit_text", wraps=ImageGenerator.fit_text
+        ) as fit_text:
+            animated_gen.add_all_text(["Hello", "World"])
+
+        assert fit_text.call_count == len(TEXT_BOXES)
+
+
+class TestGifStreamWriter:
+    def test_write_frames(self):
+        fp = io.BytesIO()
+        writer = GifStreamWriter(fp, loop=2)
+        for color in FRAME_COLORS:
+            writer.write_frame(Image.new("RGB", (20, 10), color), 50)
+        writer.close()
+
+        fp.seek(0)
+        with Image.open(fp) as result:
+            assert result.n_frames == len(FRAME_COLORS)
+            assert result.info["loop"] == 2
+            for frame, color in zip(ImageSequence.Iterator(result), FRAME_COLORS):
+                assert _close(frame.convert("RGB").getpixel((5, 5)), color)
+
+    def test_transparent_pixels(self):
+        fp = io.BytesIO()
+        writer = GifStreamWriter(fp)
+        for color in FRAME_COLORS[:2]:
+            frame = Image.new("RGBA", (20, 10), color + (255,))
+            # Half transparent pixels are opaque, less than that transparent
+            frame.paste(color + (128,), (10, 0, 15, 10))
+            frame.paste(color + (127,), (15, 0, 20, 10))
+            writer.write_frame(frame, 50)
+        # Opaque frames have no transparent palette entry
+        writer.write_frame(Image.new("RGBA", (20, 10), (0, 0, 0, 255)), 50)
+        writer.close()
+
+        fp.seek(0)
+        with Image.open(fp) as result:
+            frames = [frame.convert("RGBA") for frame in ImageSequence.Iterator(result)]
+        for frame, color in zip(frames, FRAME_COLORS[:2]):
+            assert _close(frame.getpixel((12, 5)), color + (255,))
+            assert frame.getpixel((17, 5))[3] == 0
+        assert frames[2].getpixel((17, 5)) == (0, 0, 0, 255)
+
+    def test_without_loop(self):
+        fp = io.BytesIO()
+        writer = GifStreamWriter(fp, loop=None)
+        for color in FRAME_COLORS[:2]:
+            writer.write_frame(Image.new("RGB", (20, 10), color), 50)
+        writer.close()
+
+        fp.seek(0)
+        with Image.open(fp) as result:
+            assert result.n_frames == 2
+            assert "loop" not in result.info
+
+
+def _close(pixel: tuple, color: tuple, tolerance: int = 8) -> bool:
+    return all(abs(a - b) <= tolerance for a, b in zip(pixel, color))
@@ -0,0 +1,53 @@
+from __future__ import annotations
+
+from src.bounded_cache import BoundedCache
+
+
+class TestBoundedCache:
+    def test_put_and_pop(self):
+        cache: BoundedCache[str, str] = BoundedCache(max_bytes=100)
+
+        assert cache.put("a", "first", 10) is None
+        assert cache.put("a", "second", 20) == "first"
+        assert cache.get("a") == "second"
+        assert cache.bytes == 20
+
+        cache.add_bytes("a", 5)
+        assert cache.bytes == 25
+        assert cache.pop("a") == "second"
+        assert cache.pop("a") is None
+        assert cache.bytes == 0 and len(cache) == 0
+
+    def test_evicts_least_recently_used(self):
+        cache: BoundedCache[str, str] = BoundedCache(max_bytes=20)
+        for key in "abc":
+            cache.put(key, key.upper(), 10)
+        # Touching keeps "a", the next least recently used one goes
+        cache.touch("a")
+
+        assert cache.evict() == ["B"]
+        assert "a" in cache and "c" in cache
+        assert cache.bytes == 20
+        assert cache.evictions == 1
+
+    def test_expires_after_ttl(self, clock):
+        cache: BoundedCache[str, str] = BoundedCache(max_bytes=100, ttl=60, clock=clock)
+        cache.put("a", "A", 10)
+        clock.now += 30
+        cache.put("b", "B", 10)
+        # Touching does not extend the lifetime
+        cache.touch("a")
+
+        clock.now += 31
+        assert cache.evict() == ["A"]
+        assert cache.get("b") == "B"
+        assert cache.evictions == 1
+
+    def test_clear(self):
+        cache: BoundedCache[str, str] = BoundedCache(max_bytes=100)
+        cache.put("a", "A", 10)
+        cache.put("b", "B", 10)
+
+        assert cache.clear() == ["A", "B"]
+        assert len(cache) == 0 and cache.bytes == 0
+        assert cache.evictions == 0
@@ -0,0 +1,188 @@
+from __future__ import annotations
+
+import dataclasses
+import json
+import os
+from unittest.mock import patch
+
+import numpy as np
+import pytest
+from PIL import Image
+from PIL import ImageDraw
+
+from src.compositing import blend
+from src.compositing import NumpyCompositor
+from src.meme_creator import ImageGenerator
+from src.meme_creator import ImageShuffler
+from src.template_record import TemplateRecord
+
+with open("./tests/mock_data.json") as f:
+    TEST_CONF = json.load(f)
+
+
+@pytest.fixture()
+def records() -> dict[str, TemplateRecord]:
+    return {
+        opt: TemplateRecord.from_document(doc)
+        for opt, doc in TEST_CONF["TEST_DATA_SHUFFLE"].items()
+    }
+
+
+@pytest.fixture()
+@patch("pymongo.collection.Collection.count_documents")
+def image_shuffler(mock_count, settings):
+    mock_count.return_value = 3
+    return ImageShuffler(settings)
+
+
+def scaled_layout(image_shuffler, settings, records, in_row):
+    """
+    :return: The scaled images, their coordinates, text boxes and the canvas size
+    """
+    images = [
+        Image.open(
+            os.path.join(
+                settings.get_template_directory(), records[opt].template_location
+            )
+        )
+        for opt in settings.options
+    ]
+    max_width, max_height, coordinates = image_shuffler._determine_dimensions(
+        images, in_row
+    ).values()
+    text_boxes = image_shuffler._scale_images(
+        images, coordinates, in_row, max_height, max_width, records
+    )
+    if in_row:
+        size = (coordinates[-1][0] + images[-1].width, max_height)
+    else:
+        size = (max_width, coordinates[-1][1] + images[-1].height)
+    return images, coordinates, text_boxes, size
+
+
+class TestNumpyCompositor:
+    def test_blend(self):
+        region = np.full((1, 3, 3), 100, dtype=np.uint8)
+        overlay = np.array(
+            [[[255, 0, 0, 255], [255, 0, 0, 0], [255, 0, 0, 128]]], dtype=np.uint8
+        )
+
+        blend(region, overlay)
+
+        assert region.tolist() == [[[255, 0, 0], [100, 100, 100], [178, 50, 50]]]
+
+    def test_text_overlay_matches_drawing(self, settings):
+        compositor = NumpyCompositor(settings, ImageGenerator)
+        with Image.new("RGB", (200, 120), (120, 60, 200)) as background:
+            canvas = np.array(background)
+            left, top, overlay = compositor._rasterize_text("Text1", 150, 100)
+            compositor._blend_at(canvas, overlay, 20 + left, 10 + top)
+
+            ImageGenerator.add_text(
+                ImageDraw.Draw(background), "Text1", 20, 10, 150, 100, settings
+            )
+            difference = np.abs(canvas.astype(int) - np.asarray(background))
+
+        assert difference.max() <= 1
+
+    def test_overlays_are_cached_and_bounded(self, settings):
+        compositor = NumpyCompositor(settings, ImageGenerator, max_overlays=2)
+
+        first = compositor._rasterize_text("Text1", 150, 100)
+        assert compositor._rasterize_text("Text1", 150, 100) is first
+
+        compositor._rasterize_text("Text2", 150, 100)
+        compositor._rasterize_text("Text3", 150, 100)
+        assert len(compositor._overlays) == 2
+        assert ("Text1", 150, 100) not in compositor._overlays
+
+    def test_overlay_clipped_to_canvas(self, settings):
+        compositor = NumpyCompositor(settings, ImageGenerator)
+        canvas = np.zeros((10, 10, 3), dtype=np.uint8)
+
+        compositor._blend_at(canvas, compositor._labels["A"], 5, -3)
+
+        # Only the left outline is white, the top one is outside of the canvas
+        assert (canvas[:, 5] == 255).all()
+        assert not canvas[:, 6:].any()
+        assert not canvas[:, :5].any()
+
+    @pytest.mark.parametrize("in_row", [True, False])
+    def test_parity_with_pil(self, image_shuffler, settings, records, in_row):
+        compositor = NumpyCompositor(settings, ImageGenerator)
+
+        images, coordinates, text_boxes, size = scaled_layout(
+            image_shuffler, settings, records, in_row
+        )
+        canvas = np.zeros((size[1], size[0], 3), dtype=np.uint8)
+        compositor.composite(canvas, images, coordinates, text_boxes)
+        result = canvas.astype(int)
+        for image in images:
+            image.close()
+
+        images, coordinates, text_boxes, size = scaled_layout(
+            image_shuffler, settings, records, in_row
+        )
+        with Image.new(settings.file_mode, size) as expected_image:
+            image_shuffler._composite(expected_image, images, coordinates, text_boxes)
+            expected = np.asarray(expected_image).astype(int)
+
+        assert result.shape == expected.shape
+        # Only the rounding of the blended anti aliased pixels may differ
+        assert np.abs(result - expected).max() <= 1
+
+    # JPEG is encoded from the pooled array, PNG from a converted copy
+    @pytest.mark.parametrize("file_format", ["stitch_%s.jpeg", "stitch_%s.png"])
+    def test_generate_shuffle_image(
+        self, image_shuffler, settings, records, file_format, tmp_path, monkeypatch
+    ):
+        settings = dataclasses.replace(
+            settings,
+            stitch_directory=str(tmp_path),
+            stitch_file_format=file_format,
+            compositing_backend="numpy",
+        )
+        monkeypatch.setattr(image_shuffler, "settings", settings)
+        monkeypatch.setattr(
+            image_shuffler, "compositor", NumpyCompositor(settings, ImageGenerator)
+        )
+
+        allocations = image_shuffler.canvas_pool.stats()["allocations"]
+
+        for _ in range(2):
+            image_path = image_shuffler.generate_shuffle_image("test_user", records)
+            with Image.open(image_path) as img:
+                assert img.mode == "RGB"
+                assert img.size == (452, 1275)
+
+        # Both shuffles wrote into the same pooled array, no PIL canvas was used
+        stats = image_shuffler.compositor.canvas_pool.stats()
+        assert stats["allocations"] == 1
+        assert stats["reuses"] == 1
+        assert image_shuffler.canvas_pool.stats()["allocations"] == allocations
+
+    def test_render_shares_pooled_array(
+        self, image_shuffler, settings, records, monkeypatch
+    ):
+        compositor = NumpyCompositor(settings, ImageGenerator)
+        arrays = []
+        acquire = compositor.canvas_pool.acquire
+
+        def record_acquire(*args):
+            arrays.append(acquire(*args))
+            return arrays[-1]
+
+        monkeypatch.setattr(compositor.canvas_pool, "acquire", record_acquire)
+
+        images, coordinates, text_boxes, size = scaled_layout(
+            image_shuffler, settings, records, True
+        )
+        with compositor.render(size, [], images, coordinates, text_boxes) as image:
+            assert image.size == size
+            width, height = compositor.canvas_pool.size_class(size)
+            assert arrays[0].shape == (height, width, 4)
+            # The image maps the top left corner of the array
+            arrays[0][size[1] - 1, size[0] - 1, :3] = (1, 2, 3)
+            assert image.getpixel((size[0] - 1, size[1] - 1))[:3] == (1, 2, 3)
+        for image in images:
+            image.close()
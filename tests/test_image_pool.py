@@ -0,0 +1,121 @@
+from __future__ import annotations
+
+import random
+
+from PIL import Image
+
+from src.image_pool import ImagePool
+from src.image_pool import uncovered_boxes
+from src.layout import plan_layout
+
+
+class TestImagePool:
+    def test_reuse_same_size(self):
+        pool = ImagePool(max_bytes=1024 * 1024)
+
+        with pool.borrow("RGB", (20, 10)) as first:
+            assert first.size == (256, 256)
+            first.paste((255, 0, 0), (0, 0, 20, 10))
+
+        with pool.borrow("RGB", (20, 10)) as second:
+            assert second is first
+            # The reused canvas is blank again
+            assert second.crop((0, 0, 20, 10)).getextrema() == ((0, 0),) * 3
+
+        stats = pool.stats()
+        assert stats["allocations"] == 1
+        assert stats["reuses"] == 1
+        assert stats["idle_images"] == 1
+        assert stats["idle_bytes"] == 256 * 256 * 3
+
+    def test_sizes_share_their_class(self):
+        pool = ImagePool(max_bytes=1024 * 1024, size_step=64)
+
+        with pool.borrow("RGB", (100, 30)) as first:
+            pass
+        with pool.borrow("RGB", (128, 64)) as second:
+            assert second is first
+        with pool.borrow("RGB", (129, 64)) as third:
+            assert third.size == (192, 64)
+
+        assert pool.stats()["allocations"] == 2
+        assert pool.stats()["reuses"] == 1
+
+    def test_covered_boxes_are_not_cleared(self):
+        pool = ImagePool(max_bytes=1024 * 1024, size_step=16)
+        with pool.borrow("L", (16, 16)) as canvas:
+            canvas.paste(255, (0, 0, 16, 16))
+
+        with pool.borrow("L", (16, 16), [(0, 0, 8, 16)]) as canvas:
+            # The caller overwrites the covered half, only the rest is cleared
+            assert canvas.crop((0, 0, 8, 16)).getextrema() == (255, 255)
+            assert canvas.crop((8, 0, 16, 16)).getextrema() == (0, 0)
+
+    def test_different_keys(self):
+        pool = ImagePool(max_bytes=1024 * 1024, size_step=16)
+
+        with pool.borrow("RGB", (20, 10)):
+            pass
+        with pool.borrow("RGB", (10, 20)) as img:
+            assert img.size == (16, 32)
+        with pool.borrow("L", (20, 10)) as img:
+            assert img.mode == "L"
+
+        assert pool.stats()["allocations"] == 3
+        assert pool.stats()["reuses"] == 0
+
+    def test_bounded_by_bytes(self):
+        pool = ImagePool(max_bytes=2 * 10 * 10 * 3, size_step=1)
+
+        images = [pool.acquire("RGB", (10, 10 + i)) for i in range(3)]
+        for img in images:
+            pool.release(img)
+
+        stats = pool.stats()
+        assert stats["idle_bytes"] <= pool.max_bytes
+        # The least recently returned images got evicted
+        assert stats["evictions"] == 2
+        assert pool.acquire("RGB", (10, 12)) is images[2]
+
+    def test_clear(self):
+        pool = ImagePool(max_bytes=1024 * 1024)
+        pool.release(pool.acquire("RGB", (10, 10)))
+        pool.clear()
+
+        assert pool.stats()["idle_images"] == 0
+        assert pool.stats()["idle_bytes"] == 0
+        assert isinstance(pool.acquire("RGB", (10, 10)), Image.Image)
+
+    def test_reuse_with_large_catalog(self):
+        # Thousands of templates, hardly any two shuffles have the same size
+        rng = random.Random(0)
+        catalog = []
+        for _ in range(5000):
+            width = rng.randint(300, 1600)
+            catalog.append((width, int(width * rng.uniform(1 / 3, 3))))
+        sizes = [
+            plan_layout(rng.sample(catalog, 3), 240, (1280, 1280)).size
+            for _ in range(500)
+        ]
+        assert len(set(sizes)) > 300
+
+        pool = ImagePool(max_bytes=64 * 1024 * 1024)
+        for size in sizes:
+            pool.release(pool.acquire("RGB", size))
+        pool.clear()
+
+        stats = pool.stats()
+        assert stats["reuses"] / len(sizes) > 0.9
+
+
+def test_uncovered_boxes():
+    assert list(uncovered_boxes((10, 10), [])) == [(0, 0, 10, 10)]
+    assert list(uncovered_boxes((10, 10), [(-5, -5, 15, 15)])) == []
+
+    # Two templates in a row, the lower one leaves a gap below it
+    boxes = list(uncovered_boxes((10, 10), [(0, 0, 4, 10), (4, 0, 10, 6)]))
+    assert boxes == [(4, 6, 10, 10)]
+
+    # A gap between and around the boxes
+    boxes = list(uncovered_boxes((10, 4), [(2, 0, 4, 4), (6, 0, 8, 4)]))
+    assert boxes == [(0, 0, 2, 4), (4, 0, 6, 4), (8, 0, 10, 4)]
@@ -1,16 +1,22 @@
 from __future__ import annotations
 
 import copy
+import dataclasses
 import json
 import os
 from unittest.mock import patch
 
+import mongomock
 import pytest
 from PIL import Image
 
+from src.layout import plan_layout
 from src.meme_creator import ImageGenerator
 from src.meme_creator import ImageShuffler
 from src.schemas import Settings
+from src.template_record import iter_text_boxes
+from src.template_record import TemplateRecord
+from src.template_sampler import RandomKeySampler
 
 DEV_CONFIG_LOCATION = "./configs/dev.settings.json"
 TEST_CONFIG_LOCATION = "./tests/mock_data.json"
@@ -37,6 +43,13 @@ def test_data_shuffle():
     return TEST_CONF["TEST_DATA_SHUFFLE"]
 
 
+@pytest.fixture()
+def test_records_shuffle(test_data_shuffle):
+    return {
+        opt: TemplateRecord.from_document(doc) for opt, doc in test_data_shuffle.items()
+    }
+
+
 @pytest.fixture()
 def test_images(settings):
     img_1 = TEST_CONF["TEST_IMAGE_ONE"]
@@ -69,13 +82,8 @@ def images(test_images):
 
 @pytest.fixture()
 def image_gen(test_data, settings):
-    return ImageGenerator(
-        test_data["id"],
-        test_data["name"],
-        test_data["text-locations"],
-        test_data["template-location"],
-        "test_user",
-        settings,
+    return ImageGenerator.from_record(
+        TemplateRecord.from_document(test_data[0]), "test_user", settings
     )
 
 
@@ -99,12 +107,24 @@ class TestImageShuffler:
         rotation = image_shuffler.shuffle()
 
         assert len(rotation) == 3
-        for k, v in rotation.items():
+        for (k, v), doc in zip(rotation.items(), test_data):
             assert k in "ABC"
-            assert "id" in v
-            assert "name" in v
-            assert "text-locations" in v
-            assert "template-location" in v
+            assert v.to_document() == doc
+
+    def test_shuffle_random_key(self, image_shuffler, test_data, monkeypatch):
+        """
+        Test that the random key strategy returns 3 distinct templates
+        """
+        collection = mongomock.MongoClient().db.templates
+        collection.insert_many(copy.deepcopy(test_data))
+        sampler = RandomKeySampler(collection)
+        sampler.prepare()
+        monkeypatch.setattr(image_shuffler, "sampler", sampler)
+
+        rotation = image_shuffler.shuffle()
+
+        assert list(rotation) == ["A", "B", "C"]
+        assert {v.id for v in rotation.values()} == {"0", "1", "2"}
 
     def test_images_in_row(self, image_shuffler, images):
         assert not image_shuffler._images_in_row(images)
@@ -127,31 +147,197 @@ class TestImageShuffler:
         assert len(coo) == 3
         assert coo == [(0, 0), (0, 616), (0, 1115)]
 
-    def test_scale_image_in_row(self, image_shuffler, images, test_data_shuffle):
+    def test_determine_dimensions_max_size(self, image_shuffler, images):
+        # Scaled to a height of 616, the row would be this wide
+        row_width = 500 + 524 * 616 / 499 + 700 * 616 / 449
+        w, h, coo = image_shuffler._determine_dimensions(
+            images, True, (1000, 1000)
+        ).values()
+        assert (w, h) == (int(500 * 1000 / row_width), int(616 * 1000 / row_width))
+        # The start coordinates are set by _scale_images
+        assert coo == [(0, 0), (500, 0), (1024, 0)]
+
+        # Small enough already
+        w, h, _ = image_shuffler._determine_dimensions(
+            images, False, (5000, 5000)
+        ).values()
+        assert (w, h) == (700, 616)
+
+    def test_generate_shuffle_image_max_size(
+        self, image_shuffler, test_records_shuffle, settings, tmp_path, monkeypatch
+    ):
+        monkeypatch.setattr(
+            image_shuffler,
+            "settings",
+            dataclasses.replace(settings, stitch_directory=str(tmp_path)),
+        )
+
+        # The templates are stitched in a column
+        for max_size, width, min_height in (
+            ((300, 2000), 300, 840),
+            ((2000, 500), 176, 494),
+            ((10000, 10000), 700, 1977),
+        ):
+            image_path = image_shuffler.generate_shuffle_image(
+                "test_user", test_records_shuffle, max_size=max_size
+            )
+            with Image.open(image_path) as img:
+                assert img.width == width
+                assert min_height <= img.height <= max_size[1]
+
+    def test_scale_image_max_size(self, image_shuffler, images, test_records_shuffle):
+        max_width, max_height, image_coordinates = image_shuffler._determine_dimensions(
+            images, False, (350, 2000)
+        ).values()
+
+        text_boxes = image_shuffler._scale_images(
+            images,
+            image_coordinates,
+            False,
+            max_height,
+            max_width,
+            test_records_shuffle,
+        )
+
+        # Every template is scaled once, directly to the final width
+        assert [image.width for image in images] == [350, 350, 350]
+        for image, (_, y), next_coordinates in zip(
+            images, image_coordinates, image_coordinates[1:]
+        ):
+            assert next_coordinates[1] == y + image.height
+        # The text boxes are scaled by the same ratio as their template
+        assert list(iter_text_boxes(text_boxes[1]))[0] == (
+            int(130 * 350 / 524),
+            int(64 * 350 / 524),
+            int(76 * 350 / 524),
+            int(104 * 350 / 524),
+        )
+
+    def test_scale_image_in_row(self, image_shuffler, images, test_records_shuffle):
         image_coordinates = [(0, 0), (0, 616), (0, 1115)]
         max_height = 616
         max_width = 700
 
-        cur_shuffle = copy.deepcopy(test_data_shuffle)
+        cur_shuffle = copy.copy(test_records_shuffle)
 
-        image_shuffler._scale_images(
+        text_boxes = image_shuffler._scale_images(
             images, image_coordinates, True, max_height, max_width, cur_shuffle
         )
 
-        # Test that the attribute self.cur_rotation gets changed correctly
+        # Test that the scaled text boxes are returned
         assert image_coordinates == [(0, 0), (500, 616), (1146, 1115)]
-        assert cur_shuffle["A"]["text-locations"] == [
-            {"x": 280, "y": 30, "width": 210, "height": 100},
-            {"x": 290, "y": 228, "width": 200, "height": 90},
+        assert list(iter_text_boxes(text_boxes[0])) == [
+            (280, 30, 210, 100),
+            (290, 228, 200, 90),
         ]
-        assert cur_shuffle["B"]["text-locations"] == [
-            {"x": 160, "y": 79, "width": 93, "height": 128},
-            {"x": 345, "y": 74, "width": 123, "height": 137},
-            {"x": 209, "y": 424, "width": 246, "height": 88},
+        assert list(iter_text_boxes(text_boxes[1])) == [
+            (160, 79, 93, 128),
+            (345, 74, 123, 137),
+            (209, 424, 246, 88),
         ]
-        assert cur_shuffle["C"]["text-locations"] == [
-            {"x": 296, "y": 83, "width": 168, "height": 233},
-            {"x": 775, "y": 80, "width": 156, "height": 220},
-            {"x": 296, "y": 395, "width": 157, "height": 205},
-            {"x": 768, "y": 382, "width": 168, "height": 233},
+        assert list(iter_text_boxes(text_boxes[2])) == [
+            (296, 83, 168, 233),
+            (775, 80, 156, 220),
+            (296, 395, 157, 205),
+            (768, 382, 168, 233),
         ]
+
+        # The records are not changed
+        assert cur_shuffle == test_records_shuffle
+        assert cur_shuffle["B"].to_document()["text-locations"][0] == {
+            "x": 130,
+            "y": 64,
+            "width": 76,
+            "height": 104,
+        }
+
+    def test_generate_shuffle_image_reuses_canvas(
+        self, image_shuffler, test_records_shuffle, settings, tmp_path, monkeypatch
+    ):
+        monkeypatch.setattr(
+            image_shuffler,
+            "settings",
+            dataclasses.replace(settings, stitch_directory=str(tmp_path)),
+        )
+        image_shuffler.canvas_pool.clear()
+        allocations = image_shuffler.canvas_pool.stats()["allocations"]
+
+        for _ in range(2):
+            image_path = image_shuffler.generate_shuffle_image(
+                "test_user", test_records_shuffle
+            )
+            with Image.open(image_path) as img:
+                assert img.size == (452, 1275)
+
+        stats = image_shuffler.canvas_pool.stats()
+        assert stats["allocations"] == allocations + 1
+        assert stats["reuses"] >= 1
+        assert stats["idle_images"] == 1
+
+    def test_generate_shuffle_image_on_used_canvas(
+        self, image_shuffler, test_records_shuffle, settings, tmp_path, monkeypatch
+    ):
+        settings = dataclasses.replace(
+            settings, stitch_directory=str(tmp_path), layout_strategy="search"
+        )
+        monkeypatch.setattr(image_shuffler, "settings", settings)
+        # A layout that leaves a border below and right of the templates uncovered
+        layout = plan_layout([(500, 616), (524, 499), (700, 449)], 240, (1280, 1280))
+        monkeypatch.setattr(
+            "src.meme_creator.plan_layout",
+            lambda *args: dataclasses.replace(
+                layout, size=(layout.size[0] + 40, layout.size[1] + 40)
+            ),
+        )
+
+        def render() -> Image.Image:
+            image_path = image_shuffler.generate_shuffle_image(
+                "test_user", test_records_shuffle
+            )
+            with Image.open(image_path) as img:
+                return img.copy()
+
+        image_shuffler.canvas_pool.clear()
+        on_new_canvas = render()
+        # Leave something on the pooled canvas
+        with image_shuffler.canvas_pool.borrow(
+            settings.file_mode, on_new_canvas.size
+        ) as canvas:
+            canvas.paste((255, 0, 255), (0, 0) + canvas.size)
+
+        assert image_shuffler.canvas_pool.stats()["reuses"] >= 1
+        assert render().tobytes() == on_new_canvas.tobytes()
+
+    def test_generate_shuffle_image_lower_tier(
+        self, image_shuffler, test_records_shuffle, settings, tmp_path, monkeypatch
+    ):
+        monkeypatch.setattr(
+            image_shuffler,
+            "settings",
+            dataclasses.replace(settings, stitch_directory=str(tmp_path)),
+        )
+        full, _, minimal = settings.render_tiers
+
+        full_path = image_shuffler.generate_shuffle_image(
+            "full", test_records_shuffle, full
+        )
+        minimal_path = image_shuffler.generate_shuffle_image(
+            "minimal", test_records_shuffle, minimal
+        )
+
+        with Image.open(minimal_path) as img:
+            assert img.size == (226, 637)
+        assert os.path.getsize(minimal_path) < os.path.getsize(full_path) / 2
+
+
+class TestImageGenerator:
+    def test_file_path_per_render(self, image_gen, test_data, settings):
+        """
+        A pick and its quick edit of the same user must not share the output file
+        """
+        with ImageGenerator.from_record(
+            TemplateRecord.from_document(test_data[0]), "test_user", settings
+        ) as other:
+            assert other.get_file_path() != image_gen.get_file_path()
+        assert image_gen.get_file_path() == image_gen.get_file_path()
+        image_gen.close()
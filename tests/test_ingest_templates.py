@@ -0,0 +1,185 @@
+from __future__ import annotations
+
+import dataclasses
+
+import mongomock
+import pytest
+from jsonschema import ValidationError
+from PIL import Image
+from PIL import ImageDraw
+
+from src.ingest_templates import ingest_all
+from src.ingest_templates import ingest_template
+from src.ingest_templates import load_validator
+from src.meme_creator import ImageGenerator
+from src.schemas import Settings
+from src.template_record import TemplateRecord
+
+
+@pytest.fixture()
+def settings(settings, tmp_path) -> Settings:
+    return dataclasses.replace(
+        settings,
+        template_directory=str(tmp_path / "templates"),
+        template_max_resolution=[800, 800],
+    )
+
+
+@pytest.fixture()
+def source_directory(tmp_path):
+    source = tmp_path / "uploads"
+    source.mkdir()
+
+    exif = Image.Exif()
+    exif[0x010E] = "A description that should be stripped"
+    Image.new("RGBA", (2000, 1000), (10, 20, 30, 255)).save(
+        source / "huge.png", exif=exif, dpi=(300, 300)
+    )
+    Image.new("RGB", (400, 300), (200, 100, 50)).save(source / "small.jpeg")
+    return source
+
+
+@pytest.fixture()
+def documents():
+    return [
+        {
+            "id": "100",
+            "name": "Huge",
+            "text-locations": [
+                {"x": 100, "y": 50, "width": 800, "height": 200},
+                {"x": 1000, "y": 600, "width": 900, "height": 20},
+            ],
+            "template-location": "huge.png",
+            "tags": ["big"],
+        },
+        {
+            "id": "101",
+            "name": "Small",
+            "text-locations": [{"x": 10, "y": 20, "width": 100, "height": 50}],
+            "template-location": "small.jpeg",
+        },
+    ]
+
+
+@pytest.fixture()
+def collection():
+    return mongomock.MongoClient().db.templates
+
+
+class TestIngestTemplates:
+    def test_normalize(self, documents, source_directory, collection, settings):
+        counts = ingest_all(documents, str(source_directory), collection, settings)
+        assert counts == {"ingested": 2, "skipped": 0, "failed": 0}
+
+        huge = collection.find_one({"id": "100"}, {"_id": 0})
+        assert huge["template-location"] == "./huge.jpeg"
+        assert (huge["width"], huge["height"]) == (800, 400)
+        assert huge["tags"] == ["big"]
+        # Text locations are scaled with the image
+        assert huge["text-locations"] == [
+            {"x": 40, "y": 20, "width": 320, "height": 80},
+            {"x": 400, "y": 240, "width": 360, "height": 8},
+        ]
+
+        with Image.open(f"{settings.get_template_directory()}/huge.jpeg") as image:
+            assert image.format == "JPEG"
+            assert image.mode == "RGB"
+            assert image.size == (800, 400)
+            assert "progressive" not in image.info
+            assert "exif" not in image.info
+            assert "dpi" not in image.info
+
+        small = collection.find_one({"id": "101"}, {"_id": 0})
+        assert (small["width"], small["height"]) == (400, 300)
+        assert small["text-locations"] == documents[1]["text-locations"]
+
+    def test_font_bounds(self, documents, source_directory, collection, settings):
+        ingest_all(documents, str(source_directory), collection, settings)
+
+        record = TemplateRecord.from_document(collection.find_one({"id": "100"}))
+        font_bounds = record.to_document()["font-bounds"]
+
+        assert font_bounds[0] == [settings.font_min_size, settings.font_max_size]
+        # Not even the smallest font fits a box with a height of 8 pixels
+        assert font_bounds[1][1] < font_bounds[1][0]
+        assert font_bounds[1] == list(ImageGenerator.font_size_bounds(8, settings))
+
+    @pytest.mark.parametrize("height", [20, 35, 60, 200])
+    def test_font_bounds_keep_layout(self, settings, height):
+        draw = ImageDraw.Draw(Image.new("RGB", (400, 400)))
+        bounds = ImageGenerator.font_size_bounds(height, settings)
+
+        for text in ("Hello World", "when the code works", "ok"):
+            bounded = ImageGenerator.fit_text(
+                draw, text, 0, 0, 300, height, settings, bounds
+            )
+            unbounded = ImageGenerator.fit_text(draw, text, 0, 0, 300, height, settings)
+            assert bounded.position == unbounded.position
+            assert bounded.text == unbounded.text
+            assert bounded.font.size == unbounded.font.size
+
+    def test_incremental(self, documents, source_directory, collection, settings):
+        ingest_all(documents, str(source_directory), collection, settings)
+
+        counts = ingest_all(documents, str(source_directory), collection, settings)
+        assert counts == {"ingested": 0, "skipped": 2, "failed": 0}
+
+        # Changed source file and changed text locations are processed again
+        Image.new("RGB", (400, 300), (0, 0, 0)).save(source_directory / "small.jpeg")
+        documents[0]["text-locations"][0]["x"] = 0
+        counts = ingest_all(documents, str(source_directory), collection, settings)
+        assert counts == {"ingested": 2, "skipped": 0, "failed": 0}
+
+        counts = ingest_all(
+            documents, str(source_directory), collection, settings, force=True
+        )
+        assert counts["ingested"] == 2
+
+    def test_metadata_change(self, documents, source_directory, collection, settings):
+        documents[1]["tags"] = ["x"]
+        documents[1]["language"] = "en"
+        ingest_all(documents, str(source_directory), collection, settings)
+
+        # Only the name and the optional fields change, the image is not processed
+        documents[0]["name"] = "New"
+        documents[0]["tags"] = ["y"]
+        del documents[1]["tags"]
+        del documents[1]["language"]
+        counts = ingest_all(documents, str(source_directory), collection, settings)
+        assert counts == {"ingested": 0, "skipped": 2, "failed": 0}
+
+        huge = collection.find_one({"id": "100"}, {"_id": 0})
+        assert huge["name"] == "New"
+        assert huge["tags"] == ["y"]
+        assert (huge["width"], huge["height"]) == (800, 400)
+        small = collection.find_one({"id": "101"}, {"_id": 0})
+        assert "tags" not in small
+        assert "language" not in small
+
+        # Also when the image is processed again
+        documents[0]["name"] = "Newer"
+        del documents[0]["tags"]
+        counts = ingest_all(
+            documents, str(source_directory), collection, settings, force=True
+        )
+        huge = collection.find_one({"id": "100"}, {"_id": 0})
+        assert huge["name"] == "Newer"
+        assert "tags" not in huge
+
+    def test_invalid_document(self, documents, source_directory, collection, settings):
+        del documents[1]["name"]
+        validator = load_validator(settings)
+
+        with pytest.raises(ValidationError):
+            ingest_template(
+                documents[1], str(source_directory), collection, settings, validator
+            )
+
+        counts = ingest_all(documents, str(source_directory), collection, settings)
+        assert counts == {"ingested": 1, "skipped": 0, "failed": 1}
+
+    def test_source_is_template_directory(self, documents, collection, settings):
+        with pytest.raises(ValueError):
+            ingest_all(
+                documents, settings.get_template_directory(), collection, settings
+            )
@@ -0,0 +1,231 @@
+from __future__ import annotations
+
+import dataclasses
+import json
+from unittest.mock import patch
+
+import pytest
+from PIL import Image
+
+from src.layout import arrange
+from src.layout import plan_layout
+from src.layout import split_into_groups
+from src.meme_creator import ImageShuffler
+from src.template_record import text_boxes_from_locations
+from src.template_record import TemplateRecord
+
+# The templates of TEST_DATA_SHUFFLE in tests/mock_data.json
+SHUFFLE_SIZES = [(500, 616), (524, 499), (700, 449)]
+TALL_SIZES = [(300, 1500), (320, 1400), (280, 1600)]
+WIDE_SIZES = [(1600, 300), (1500, 280), (1400, 320)]
+
+
+def assert_no_overlap(layout) -> None:
+    width, height = layout.size
+    for i, p in enumerate(layout.placements):
+        assert p.x >= 0 and p.y >= 0
+        assert p.x + p.width <= width and p.y + p.height <= height
+        for q in layout.placements[:i]:
+            assert (
+                p.x >= q.x + q.width
+                or q.x >= p.x + p.width
+                or p.y >= q.y + q.height
+                or q.y >= p.y + p.height
+            )
+
+
+class TestLayout:
+    def test_split_into_groups(self):
+        assert list(split_into_groups(1)) == [(1,)]
+        assert sorted(split_into_groups(3)) == [(1, 1, 1), (1, 2), (2, 1), (3,)]
+        # Every split of the gaps between the templates
+        assert len(list(split_into_groups(8))) == 2**7
+
+        grids = list(split_into_groups(10))
+        assert len(grids) == 10
+        assert (4, 3, 3) in grids and (5, 5) in grids
+        assert all(sum(groups) == 10 for groups in grids)
+
+    def test_arrange_row_and_column(self):
+        row = arrange(SHUFFLE_SIZES, True, (3,), 0)
+        # The lowest template keeps its size, the others are scaled to its height
+        assert row.name == "row"
+        assert row.size == (1535, 449)
+        assert [p.height for p in row.placements] == [449] * 3
+        assert [p.x for p in row.placements] == [0, 364, 364 + 471]
+
+        column = arrange(SHUFFLE_SIZES, False, (3,), 0)
+        assert column.name == "column"
+        assert column.size[0] == 500
+        assert [p.width for p in column.placements] == [500] * 3
+        assert arrange(SHUFFLE_SIZES, True, (1, 1, 1), 0).name == "column"
+
+        for layout in (row, column):
+            assert_no_overlap(layout)
+            assert layout.fits
+            assert layout.upscaled_pixels == 0
+
+    def test_arrange_grid(self):
+        layout = arrange([(500, 500)] * 4, True, (2, 2), 0)
+
+        assert layout.name == "rows 2+2"
+        assert layout.size == (1000, 1000)
+        assert [(p.x, p.y) for p in layout.placements] == [
+            (0, 0),
+            (500, 0),
+            (0, 500),
+            (500, 500),
+        ]
+        assert layout.upscaled_pixels == 0
+
+    def test_arrange_max_size(self):
+        layout = arrange(TALL_SIZES, True, (3,), 200, (1280, 1280))
+
+        assert layout.size[0] <= 1280 and layout.size[1] <= 1280
+        assert layout.upscaled_pixels == 0
+        assert layout.fits
+        # The narrowest template is below the minimum size at this canvas height
+        assert not arrange(TALL_SIZES, True, (3,), 240, (1280, 1280)).fits
+
+    def test_arrange_min_size_upscales(self):
+        layout = arrange([(100, 100), (400, 400)], True, (2,), 240)
+
+        assert layout.fits
+        assert layout.smallest_side == 240
+        assert layout.upscaled_pixels > 0
+
+    def test_arrange_scale(self):
+        full = arrange(SHUFFLE_SIZES, False, (3,), 0)
+        half = arrange(SHUFFLE_SIZES, False, (3,), 0, scale=0.5)
+
+        assert half.size[0] == full.size[0] // 2
+        assert abs(half.size[1] - full.size[1] / 2) <= 3
+
+    def test_plan_layout(self):
+        # Few upscaled pixels, the row is smaller than the column
+        layout = plan_layout(SHUFFLE_SIZES, 240, (1280, 1280))
+        assert layout.name == "row"
+        assert layout.size == (1278, 373)
+
+        # Tall templates side by side, wide ones on top of each other
+        assert plan_layout(TALL_SIZES, 200, (1280, 1280)).name == "row"
+        assert plan_layout(WIDE_SIZES, 200, (1280, 1280)).name == "column"
+
+        # Many templates are arranged in a grid
+        layout = plan_layout([(500, 500)] * 9, 240, (1280, 1280))
+        assert layout.by_rows and len(layout.groups) > 1
+        assert layout.fits
+        assert_no_overlap(layout)
+
+    def test_plan_layout_keeps_min_size(self):
+        for sizes in (SHUFFLE_SIZES, TALL_SIZES, WIDE_SIZES, [(500, 500)] * 6):
+            layout = plan_layout(sizes, 200, (1280, 1280))
+            assert layout.fits
+            # Up to rounding to whole pixels
+            assert layout.smallest_side >= 199
+            assert layout.size[0] <= 1280 and layout.size[1] <= 1280
+
+    def test_plan_layout_infeasible(self):
+        # No layout keeps 240 pixels, the smallest template is shown the biggest
+        layout = plan_layout(TALL_SIZES, 240, (1280, 1280))
+        assert not layout.fits
+        assert layout.name == "row"
+        assert layout.smallest_side == max(
+            arrange(TALL_SIZES, by_rows, groups, 240, (1280, 1280)).smallest_side
+            for by_rows in (True, False)
+            for groups in split_into_groups(3)
+        )
+
+    def test_plan_layout_minimizes_cost(self):
+        for sizes in (SHUFFLE_SIZES, TALL_SIZES, WIDE_SIZES, [(500, 500)] * 5):
+            best = plan_layout(sizes, 200, (1280, 1280))
+            for by_rows in (True, False):
+                for groups in split_into_groups(len(sizes)):
+                    layout = arrange(sizes, by_rows, groups, 200, (1280, 1280))
+                    if layout.fits:
+                        assert best.cost <= layout.cost
+
+
+@pytest.fixture()
+@patch("pymongo.collection.Collection.count_documents")
+def image_shuffler(mock_count, settings):
+    mock_count.return_value = 3
+    return ImageShuffler(settings)
+
+
+def shuffle_image_size(image_shuffler, monkeypatch, settings, records, **changes):
+    monkeypatch.setattr(
+        image_shuffler, "settings", dataclasses.replace(settings, **changes)
+    )
+    image_path = image_shuffler.generate_shuffle_image("test_user", records)
+    with Image.open(image_path) as img:
+        return img.size
+
+
+def test_generate_shuffle_image_search(image_shuffler, settings, tmp_path, monkeypatch):
+    with open("./tests/mock_data.json") as f:
+        documents = json.load(f)["TEST_DATA_SHUFFLE"]
+    records = {opt: TemplateRecord.from_document(doc) for opt, doc in documents.items()}
+
+    column = shuffle_image_size(
+        image_shuffler, monkeypatch, settings, records, stitch_directory=str(tmp_path)
+    )
+    searched = shuffle_image_size(
+        image_shuffler,
+        monkeypatch,
+        settings,
+        records,
+        stitch_directory=str(tmp_path),
+        layout_strategy="search",
+    )
+
+    assert column == (452, 1275)
+    assert searched == plan_layout(SHUFFLE_SIZES, 240, (1280, 1280)).size
+    assert searched[0] * searched[1] < column[0] * column[1]
+
+
+def test_generate_shuffle_image_search_options(
+    image_shuffler, settings, tmp_path, monkeypatch
+):
+    sizes = [(300, 1500), (1600, 300), (500, 500), (400, 800)]
+    options = ["A", "B", "C", "D"]
+    records = {}
+    for opt, size in zip(options, sizes):
+        Image.new("RGB", size, (200, 40, 40)).save(tmp_path / f"{opt}.jpeg")
+        records[opt] = TemplateRecord(
+            opt,
+            opt,
+            f"{opt}.jpeg",
+            text_boxes_from_locations(
+                [{"x": 10, "y": 10, "width": size[0] - 20, "height": 60}]
+            ),
+        )
+    changes = dict(
+        options=options,
+        template_directory=str(tmp_path),
+        stitch_directory=str(tmp_path),
+        layout_min_template_size=120,
+    )
+
+    # A single row squeezes the tall template to a sliver
+    assert shuffle_image_size(
+        image_shuffler, monkeypatch, settings, records, **changes
+    ) == (
+        1272,
+        181,
+    )
+
+    layout = plan_layout(sizes, 120, (1280, 1280))
+    assert layout.name == "columns 1+2+1"
+    assert layout.smallest_side == 120
+    assert (
+        shuffle_image_size(
+            image_shuffler,
+            monkeypatch,
+            settings,
+            records,
+            layout_strategy="search",
+            **changes,
+        )
+        == layout.size
+    )
@@ -0,0 +1,142 @@
+from __future__ import annotations
+
+import asyncio
+import dataclasses
+import json
+import logging
+import os
+import threading
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import pytest
+
+from src.main import configure_logging
+from src.main import memory_report
+from src.main import shuffle
+from src.meme_creator import ImageShuffler
+from src.render_load import RenderLoadPolicy
+from src.schemas import Settings
+from src.template_prefetch import TemplatePrefetcher
+from src.template_record import TemplateRecord
+
+TEST_CONFIG_LOCATION = "./tests/mock_data.json"
+
+with open(TEST_CONFIG_LOCATION) as f:
+    TEST_CONF = json.load(f)
+
+
+class FakeMessage:
+    """
+    Collects the sent photos. Every reply waits until all expected replies
+    are being sent, so the handlers overlap between rendering and cleanup
+    """
+
+    def __init__(self, replies: int):
+        self.photos: list[tuple[str, bytes]] = []
+        self.replies = replies
+        # asyncio.Barrier needs Python 3.11
+        self.all_replied = asyncio.Event()
+
+    async def reply_photo(self, photo) -> None:
+        self.photos.append((photo.name, photo.read()))
+        if len(self.photos) == self.replies:
+            self.all_replied.set()
+        await self.all_replied.wait()
+
+
+@pytest.fixture()
+def settings(settings, tmp_path) -> Settings:
+    # The templates of TEST_DATA_SHUFFLE are in the template directory of dev
+    return dataclasses.replace(settings, stitch_directory=str(tmp_path))
+
+
+@pytest.fixture()
+@patch("pymongo.collection.Collection.count_documents")
+def image_shuffler(mock_count, settings, monkeypatch):
+    mock_count.return_value = 3
+    shuffler = ImageShuffler(settings)
+    # The shuffler is a singleton, it may have been created with other settings
+    monkeypatch.setattr(shuffler, "settings", settings)
+    records = {
+        opt: TemplateRecord.from_document(doc)
+        for opt, doc in TEST_CONF["TEST_DATA_SHUFFLE"].items()
+    }
+    monkeypatch.setattr(shuffler, "shuffle", lambda: records)
+    return shuffler
+
+
+def test_overlapping_shuffles_of_one_user(image_shuffler, settings, tmp_path, caplog):
+    caplog.set_level(logging.INFO, logger="src.main")
+    prefetcher = TemplatePrefetcher(settings, max_bytes=1 << 26, ttl=60)
+    render_load = RenderLoadPolicy(settings)
+    message = FakeMessage(replies=2)
+    update = SimpleNamespace(effective_user=SimpleNamespace(id=1), message=message)
+
+    async def run() -> None:
+        current_shuffle: dict = {}
+        await asyncio.gather(
+            *(
+                shuffle(
+                    update, image_shuffler, current_shuffle, render_load, prefetcher
+                )
+                for _ in range(2)
+            )
+        )
+
+    try:
+        asyncio.run(run())
+    finally:
+        prefetcher.close()
+
+    # Both shuffles sent their own image and removed only that one
+    paths = [path for path, _ in message.photos]
+    assert len(set(paths)) == 2
+    assert all(data for _, data in message.photos)
+    assert not any(os.path.exists(path) for path in paths)
+    assert os.listdir(tmp_path) == []
+    # Every response records the tier that served it
+    tiers = [r.getMessage() for r in caplog.records if r.name == "src.main"]
+    assert tiers == ["Shuffle of user 1 rendered with tier full"] * 2
+
+
+def test_configure_logging(monkeypatch):
+    root = logging.getLogger()
+    monkeypatch.setattr(root, "handlers", [])
+    monkeypatch.setattr(root, "level", root.level)
+    monkeypatch.setattr(logging.getLogger("httpx"), "level", logging.NOTSET)
+
+    configure_logging()
+
+    # The render tiers of the shuffles are written out
+    assert logging.getLogger("src.main").isEnabledFor(logging.INFO)
+    assert len(root.handlers) == 1
+    assert not logging.getLogger("httpx").isEnabledFor(logging.INFO)
+
+
+def test_memory_report_off_the_event_loop():
+    threads = []
+    sent = []
+
+    class FakeDiagnostics:
+        def report(self) -> str:
+            threads.append(threading.get_ident())
+            return "x" * 5000
+
+    async def reply_text(text: str) -> None:
+        sent.append(text)
+
+    update = SimpleNamespace(
+        effective_user=SimpleNamespace(id=1),
+        message=SimpleNamespace(reply_text=reply_text),
+    )
+
+    async def run() -> int:
+        await memory_report(update, None, FakeDiagnostics(), {1})
+        return threading.get_ident()
+
+    loop_thread = asyncio.run(run())
+
+    # The report is taken in a worker thread and cut to the message limit
+    assert threads and threads[0] != loop_thread
+    assert sent == ["x" * 4096]
@@ -0,0 +1,198 @@
+from __future__ import annotations
+
+import gc
+import os
+import tracemalloc
+from unittest.mock import patch
+
+import pytest
+from PIL import Image
+
+from src.meme_creator import image_tracker
+from src.meme_creator import ImageGenerator
+from src.meme_creator import ImageShuffler
+from src.memory_diagnostics import ImageTracker
+from src.memory_diagnostics import MemoryDiagnostics
+from src.schemas import Settings
+from src.template_record import text_boxes_from_locations
+from src.template_record import TemplateRecord
+
+SOAK_RENDERS = 2000
+SOAK_SHUFFLES = 500
+
+
+@pytest.fixture()
+def soak_settings(tmp_settings, tmp_path) -> Settings:
+    """
+    Settings that read a small template from and write the created memes to tmp_path
+    """
+    Image.new("RGB", (96, 64), (255, 255, 255)).save(tmp_path / "small.jpeg")
+    return tmp_settings
+
+
+@pytest.fixture()
+@patch("pymongo.collection.Collection.count_documents")
+def soak_shuffler(mock_count, soak_settings, monkeypatch):
+    mock_count.return_value = 3
+    shuffler = ImageShuffler(soak_settings)
+    # The shuffler is a singleton, it may have been created with other settings
+    monkeypatch.setattr(shuffler, "settings", soak_settings)
+    return shuffler
+
+
+@pytest.fixture()
+def soak_rotation(soak_settings, tmp_path) -> dict[str, TemplateRecord]:
+    rotation = {}
+    for i, opt in enumerate(soak_settings.options):
+        Image.new("RGB", (96 + 16 * i, 64), (80 * i, 20, 200)).save(
+            tmp_path / f"{opt}.jpeg"
+        )
+        rotation[opt] = TemplateRecord(
+            str(i),
+            opt,
+            f"{opt}.jpeg",
+            text_boxes_from_locations([{"x": 4, "y": 4, "width": 88, "height": 56}]),
+        )
+    return rotation
+
+
+def live_pil_blocks() -> int:
+    stats = Image.core.get_stats()
+    return stats["allocated_blocks"] - stats["freed_blocks"]
+
+
+def render(settings: Settings, i: int) -> None:
+    with ImageGenerator(
+        str(i),
+        "small",
+        text_boxes_from_locations([{"x": 4, "y": 4, "width": 88, "height": 56}]),
+        "small.jpeg",
+        "soak_user",
+        settings,
+    ) as gen:
+        os.remove(gen.add_all_text([f"Text {i}"]))
+
+
+class TestImageTracker:
+    def test_track_and_release(self):
+        tracker = ImageTracker()
+        img = tracker.track(Image.new("RGB", (10, 20)))
+
+        assert tracker.count == 1
+        assert tracker.total_bytes == 10 * 20 * 3
+
+        tracker.release(img)
+        assert tracker.count == 0
+        assert tracker.total_bytes == 0
+
+    def test_forget_collected_image(self):
+        tracker = ImageTracker()
+        tracker.track(Image.new("L", (10, 10)))
+        gc.collect()
+
+        assert tracker.count == 0
+
+
+class TestImageGeneratorLifetime:
+    def test_context_closes_image(self, soak_settings):
+        live_before = image_tracker.count
+        with ImageGenerator(
+            "0",
+            "small",
+            text_boxes_from_locations([]),
+            "small.jpeg",
+            "test_user",
+            soak_settings,
+        ) as gen:
+            assert image_tracker.count == live_before + 1
+
+        assert gen.image is None
+        assert image_tracker.count == live_before
+
+    def test_memory_stays_flat(self, soak_settings):
+        """
+        Soak test: memory must not grow over thousands of renders
+        """
+        tracemalloc.start()
+        try:
+            # Warm up caches before the baseline is taken
+            for i in range(100):
+                render(soak_settings, i)
+
+            gc.collect()
+            start, _ = tracemalloc.get_traced_memory()
+            live_images = image_tracker.count
+            pil_blocks = live_pil_blocks()
+
+            for i in range(SOAK_RENDERS):
+                render(soak_settings, i)
+
+            gc.collect()
+            end, _ = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        assert image_tracker.count == live_images
+        assert live_pil_blocks() <= pil_blocks
+        assert end - start < 64 * 1024
+
+
+class TestImageShufflerLifetime:
+    def test_memory_stays_flat(self, soak_shuffler, soak_rotation):
+        """
+        Soak test: the stitched canvases and scaled templates of the shuffle
+        images must be closed, memory must not grow over hundreds of shuffles
+        """
+        tracemalloc.start()
+        try:
+            # Warm up the canvas pool and caches before the baseline is taken
+            for i in range(50):
+                os.remove(soak_shuffler.generate_shuffle_image(i, soak_rotation))
+
+            gc.collect()
+            start, _ = tracemalloc.get_traced_memory()
+            live_images = image_tracker.count
+            pil_blocks = live_pil_blocks()
+
+            for i in range(SOAK_SHUFFLES):
+                os.remove(soak_shuffler.generate_shuffle_image(i, soak_rotation))
+
+            gc.collect()
+            end, _ = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        assert image_tracker.count == live_images
+        assert live_pil_blocks() <= pil_blocks
+        assert end - start < 64 * 1024
+
+
+class TestMemoryDiagnostics:
+    def test_report(self):
+        diagnostics = MemoryDiagnostics(ImageTracker(), interval=60)
+        diagnostics.register_metrics("test", lambda: {"value": 1})
+
+        diagnostics.start()
+        try:
+            report = diagnostics.report()
+        finally:
+            diagnostics.stop()
+
+        assert "Live images: 0" in report
+        assert "test: {'value': 1}" in report
+        assert len(diagnostics.history) == 2
+
+    def test_stop_keeps_tracing_started_elsewhere(self):
+        tracemalloc.start()
+        try:
+            diagnostics = MemoryDiagnostics(ImageTracker(), interval=60)
+            diagnostics.start()
+            diagnostics.stop()
+
+            assert tracemalloc.is_tracing()
+        finally:
+            tracemalloc.stop()
+
+        diagnostics.start()
+        diagnostics.stop()
+        assert not tracemalloc.is_tracing()
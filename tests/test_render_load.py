@@ -0,0 +1,110 @@
+from __future__ import annotations
+
+import contextlib
+import dataclasses
+
+import pytest
+
+from src.render_load import RenderLoadPolicy
+from src.schemas import Settings
+
+
+@pytest.fixture()
+def settings(settings) -> Settings:
+    return dataclasses.replace(
+        settings,
+        load_queue_depth_high=3,
+        load_queue_depth_low=1,
+        load_p95_latency_high=2.0,
+        load_p95_latency_low=0.5,
+        load_latency_window=20,
+        load_tier_cooldown=5.0,
+    )
+
+
+def render(policy: RenderLoadPolicy, clock, duration: float) -> str:
+    with policy.render() as tier:
+        clock.now += duration
+    return tier.name
+
+
+class TestRenderLoadPolicy:
+    def test_full_quality_without_load(self, settings, clock):
+        policy = RenderLoadPolicy(settings, clock)
+
+        for _ in range(10):
+            assert render(policy, clock, 0.1) == "full"
+
+        assert policy.stats()["served"] == {"full": 10}
+        assert policy.p95_latency() == pytest.approx(0.1)
+
+    def test_queue_depth_steps_down_and_up(self, settings, clock):
+        # Only the queue depth matters in this test
+        settings = dataclasses.replace(
+            settings, load_p95_latency_high=1000, load_p95_latency_low=1000
+        )
+        policy = RenderLoadPolicy(settings, clock)
+
+        with contextlib.ExitStack() as stack:
+            tiers = [stack.enter_context(policy.render()).name for _ in range(4)]
+            # The fourth render arrives with three renders in flight
+            assert tiers == ["full", "full", "full", "reduced"]
+
+            # Still overloaded, but within the cooldown
+            assert stack.enter_context(policy.render()).name == "reduced"
+            clock.now += 5
+            assert stack.enter_context(policy.render()).name == "minimal"
+            clock.now += 5
+            # There is no lower tier
+            assert stack.enter_context(policy.render()).name == "minimal"
+            assert policy.stats()["in_flight"] == 7
+
+        # The load subsided, the quality is stepped up one tier per cooldown
+        clock.now += 5
+        assert render(policy, clock, 0.1) == "reduced"
+        assert render(policy, clock, 0.1) == "reduced"
+        clock.now += 5
+        assert render(policy, clock, 0.1) == "full"
+
+        stats = policy.stats()
+        assert stats["tier"] == "full"
+        assert stats["in_flight"] == 0
+        assert stats["served"] == {"full": 4, "reduced": 4, "minimal": 2}
+
+    def test_latency_steps_down_and_up(self, settings, clock):
+        settings = dataclasses.replace(settings, load_tier_cooldown=100)
+        policy = RenderLoadPolicy(settings, clock)
+
+        # 1 in 20 slow renders does not move the p95
+        for _ in range(19):
+            render(policy, clock, 0.1)
+        render(policy, clock, 3.0)
+        assert render(policy, clock, 0.1) == "full"
+        assert policy.p95_latency() == pytest.approx(0.1)
+
+        for _ in range(3):
+            render(policy, clock, 3.0)
+        assert policy.p95_latency() == pytest.approx(3.0)
+        assert render(policy, clock, 3.0) == "reduced"
+        # Only the render at the new tier is left of the latencies
+        assert policy.p95_latency() == pytest.approx(3.0)
+
+        # Still slow after the cooldown
+        clock.now += 100
+        assert render(policy, clock, 3.0) == "minimal"
+
+        # Fast renders at the lower tier bring the quality back
+        for _ in range(settings.load_latency_window):
+            assert render(policy, clock, 0.1) == "minimal"
+        clock.now += 100
+        assert render(policy, clock, 0.1) == "reduced"
+        clock.now += 100
+        assert render(policy, clock, 0.1) == "full"
+
+    def test_single_tier(self, settings, clock):
+        settings = dataclasses.replace(settings, render_tiers=settings.render_tiers[:1])
+        policy = RenderLoadPolicy(settings, clock)
+
+        with contextlib.ExitStack() as stack:
+            for _ in range(10):
+                assert stack.enter_context(policy.render()).name == "full"
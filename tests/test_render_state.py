@@ -0,0 +1,186 @@
+from __future__ import annotations
+
+import dataclasses
+
+import pytest
+from PIL import Image
+from PIL import ImageChops
+
+from src.meme_creator import ImageGenerator
+from src.render_state import RenderStateCache
+from src.schemas import Settings
+from src.template_record import text_boxes_from_locations
+from src.template_record import TemplateRecord
+
+TEXTS = ["First caption", "Second caption", "Third one", "And the fourth"]
+
+
+@pytest.fixture()
+def settings(tmp_settings, tmp_path) -> Settings:
+    gradient = Image.radial_gradient("L").resize((400, 300))
+    Image.merge("RGB", (gradient, gradient.rotate(90), gradient)).save(
+        tmp_path / "template.png"
+    )
+    Image.merge("RGBA", (gradient,) * 4).save(tmp_path / "transparent.png")
+    gradient.convert("P").save(tmp_path / "palette.png")
+    return tmp_settings
+
+
+def make_record(template_location: str, locations: list[dict]) -> TemplateRecord:
+    return TemplateRecord(
+        "0", "Template", template_location, text_boxes_from_locations(locations)
+    )
+
+
+@pytest.fixture()
+def record() -> TemplateRecord:
+    # Four captions, one per quarter of the template
+    return make_record(
+        "template.png",
+        [
+            {"x": x, "y": y, "width": 190, "height": 140}
+            for y in (5, 155)
+            for x in (5, 205)
+        ],
+    )
+
+
+@pytest.fixture()
+def cache(settings, clock):
+    cache = RenderStateCache(
+        settings, max_bytes=10 * 400 * 300 * 4, ttl=60, clock=clock
+    )
+    yield cache
+    cache.close()
+
+
+def render(cache, settings, record, texts, user_id=1) -> Image.Image:
+    with ImageGenerator.from_record(record, f"cached{user_id}", settings) as gen:
+        image_path = cache.render(user_id, gen, texts)
+    with Image.open(image_path) as img:
+        return img.copy()
+
+
+def full_render(settings, record, texts) -> Image.Image:
+    with ImageGenerator.from_record(record, "full", settings) as gen:
+        image_path = gen.add_all_text(texts)
+    with Image.open(image_path) as img:
+        return img.copy()
+
+
+def assert_same(a: Image.Image, b: Image.Image) -> None:
+    assert a.size == b.size
+    assert ImageChops.difference(a, b).getbbox() is None
+
+
+class TestRenderStateCache:
+    def test_render_matches_full_render(self, cache, settings, record):
+        assert_same(
+            render(cache, settings, record, TEXTS),
+            full_render(settings, record, TEXTS),
+        )
+
+        stats = cache.stats()
+        assert stats["misses"] == 1
+        assert stats["redrawn_boxes"] == 4
+        assert stats["states"] == 1
+
+    def test_edit_redraws_changed_box(self, cache, settings, record):
+        render(cache, settings, record, TEXTS)
+        assert cache.holds(1, record)
+
+        # Fix a typo in one of the four captions
+        edited = TEXTS[:2] + ["Third one, fixed"] + TEXTS[3:]
+        assert_same(
+            render(cache, settings, record, edited),
+            full_render(settings, record, edited),
+        )
+        stats = cache.stats()
+        assert stats["hits"] == 1
+        assert stats["redrawn_boxes"] == 4 + 1
+        assert stats["reused_boxes"] == 3
+
+        # Back to the first text, with a much longer second caption
+        edited = [TEXTS[0], "A long caption " * 4] + TEXTS[2:]
+        assert_same(
+            render(cache, settings, record, edited),
+            full_render(settings, record, edited),
+        )
+        assert cache.stats()["redrawn_boxes"] == 4 + 1 + 2
+
+    def test_other_template_replaces_state(self, cache, settings, record):
+        render(cache, settings, record, TEXTS)
+        other = dataclasses.replace(record, template_location="transparent.png")
+        assert not cache.holds(1, other)
+
+        assert_same(
+            render(cache, settings, other, TEXTS),
+            full_render(settings, other, TEXTS),
+        )
+        assert cache.holds(1, other)
+        assert not cache.holds(1, record)
+        stats = cache.stats()
+        assert stats["misses"] == 2
+        assert stats["states"] == 1
+
+    def test_states_per_user(self, cache, settings, record):
+        render(cache, settings, record, TEXTS, user_id=1)
+        render(cache, settings, record, TEXTS, user_id=2)
+
+        assert cache.holds(1, record) and cache.holds(2, record)
+        assert cache.stats()["misses"] == 2
+
+    def test_palette_template_is_not_kept(self, cache, settings, record):
+        palette = dataclasses.replace(record, template_location="palette.png")
+
+        assert_same(
+            render(cache, settings, palette, TEXTS),
+            full_render(settings, palette, TEXTS),
+        )
+        assert not cache.holds(1, palette)
+        assert cache.stats()["states"] == 0
+
+    def test_overlapping_texts_are_not_kept(self, cache, settings):
+        record = make_record(
+            "template.png",
+            [
+                {"x": 20, "y": 20, "width": 300, "height": 120},
+                {"x": 60, "y": 40, "width": 300, "height": 120},
+            ],
+        )
+        texts = ["Overlapping text", "More overlapping text"]
+
+        assert_same(
+            render(cache, settings, record, texts),
+            full_render(settings, record, texts),
+        )
+        assert not cache.holds(1, record)
+        assert cache.stats()["bytes"] == 0
+
+    def test_expires_after_ttl(self, cache, settings, record, clock):
+        render(cache, settings, record, TEXTS)
+
+        clock.now += 61
+        assert_same(
+            render(cache, settings, record, TEXTS),
+            full_render(settings, record, TEXTS),
+        )
+        stats = cache.stats()
+        assert stats["evictions"] == 1
+        assert stats["misses"] == 2
+        assert stats["hits"] == 0
+
+    def test_bounded_by_bytes(self, cache, settings, record):
+        render(cache, settings, record, TEXTS, user_id=0)
+        # Room for two states of the template
+        cache.max_bytes = 2 * cache.stats()["bytes"]
+
+        for user_id in (1, 2):
+            render(cache, settings, record, TEXTS, user_id)
+
+        # The least recently used state was dropped
+        assert not cache.holds(0, record)
+        assert cache.holds(1, record) and cache.holds(2, record)
+        stats = cache.stats()
+        assert stats["evictions"] == 1
+        assert stats["bytes"] <= cache.max_bytes
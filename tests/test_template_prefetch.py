@@ -0,0 +1,183 @@
+from __future__ import annotations
+
+import threading
+
+import pytest
+from PIL import Image
+from PIL import ImageChops
+
+from src.meme_creator import ImageGenerator
+from src.schemas import Settings
+from src import template_prefetch as prefetcher_module
+from src.template_prefetch import TemplatePrefetcher
+from src.template_record import text_boxes_from_locations
+from src.template_record import TemplateRecord
+
+# Bytes of one decoded 120x80 RGB template
+TEMPLATE_BYTES = 120 * 80 * 3
+
+
+@pytest.fixture()
+def settings(tmp_settings, tmp_path) -> Settings:
+    for i in range(4):
+        Image.new("RGB", (120, 80), (60 * i, 20, 200)).save(
+            tmp_path / f"template{i}.jpeg"
+        )
+    return tmp_settings
+
+
+@pytest.fixture()
+def records() -> list[TemplateRecord]:
+    return [
+        TemplateRecord(
+            str(i),
+            f"Template {i}",
+            f"template{i}.jpeg",
+            text_boxes_from_locations(
+                [
+                    {"x": 5, "y": 5, "width": 110, "height": 30},
+                    {"x": 5, "y": 45, "width": 110, "height": 30},
+                ]
+            ),
+        )
+        for i in range(4)
+    ]
+
+
+def is_prefetched(prefetcher: TemplatePrefetcher, user_id: int, record) -> bool:
+    prefetched = prefetcher.get(user_id, record)
+    if prefetched is None:
+        return False
+    prefetched.image.close()
+    return True
+
+
+@pytest.fixture()
+def prefetcher(settings, clock):
+    prefetcher = TemplatePrefetcher(
+        settings, max_bytes=10 * TEMPLATE_BYTES, ttl=60, clock=clock
+    )
+    yield prefetcher
+    prefetcher.close()
+
+
+class TestTemplatePrefetcher:
+    def test_prefetch_and_get(self, prefetcher, settings, records):
+        prefetcher.prefetch(1, records[:3]).result()
+
+        prefetched = prefetcher.get(1, records[1])
+        with Image.open(settings.get_template_directory() + "/template1.jpeg") as img:
+            assert ImageChops.difference(prefetched.image, img).getbbox() is None
+        bounds = ImageGenerator.font_size_bounds(30, settings)
+        assert list(prefetched.font_bounds) == list(bounds) * 2
+
+        # Every get returns a new copy, drawing on it does not change the prefetch
+        prefetched.image.paste((0, 0, 0), (0, 0, 120, 80))
+        prefetched.image.close()
+        again = prefetcher.get(1, records[1])
+        assert again.image.getpixel((0, 0)) != (0, 0, 0)
+        again.image.close()
+
+        assert not is_prefetched(prefetcher, 1, records[3])
+        assert not is_prefetched(prefetcher, 2, records[1])
+        stats = prefetcher.stats()
+        assert stats["hits"] == 2
+        assert stats["misses"] == 2
+        assert stats["bytes"] == 3 * TEMPLATE_BYTES
+
+    def test_cancel_while_copying(self, prefetcher, settings, records, monkeypatch):
+        prefetcher.prefetch(1, records[:1]).result()
+        tracker = prefetcher_module.image_tracker
+
+        class CancellingTracker:
+            def track(self, image):
+                # Another update cancels the prefetch while the image is copied
+                cancel = threading.Thread(target=prefetcher.cancel, args=(1,))
+                cancel.start()
+                cancel.join(5)
+                assert not cancel.is_alive(), "The copy blocks the prefetcher"
+                return tracker.track(image)
+
+        monkeypatch.setattr(prefetcher_module, "image_tracker", CancellingTracker())
+        prefetched = prefetcher.get(1, records[0])
+
+        # The copy is intact, the prefetched image is closed once it was copied
+        with Image.open(settings.get_template_directory() + "/template0.jpeg") as img:
+            assert ImageChops.difference(prefetched.image, img).getbbox() is None
+        prefetched.image.close()
+        stats = prefetcher.stats()
+        assert stats["prefetches"] == 0
+        assert stats["bytes"] == 0
+
+    def test_generator_output_matches(self, prefetcher, settings, records):
+        prefetcher.prefetch(1, records[:1]).result()
+        texts = ["Some text", "More text"]
+
+        with ImageGenerator.from_record(records[0], "cold", settings) as gen:
+            cold_path = gen.add_all_text(texts)
+        with ImageGenerator.from_record(
+            records[0], "hot", settings, prefetcher.get(1, records[0])
+        ) as gen:
+            hot_path = gen.add_all_text(texts)
+
+        with Image.open(cold_path) as cold, Image.open(hot_path) as hot:
+            assert ImageChops.difference(cold, hot).getbbox() is None
+
+    def test_new_shuffle_replaces_prefetch(self, prefetcher, records):
+        prefetcher.prefetch(1, records[:3]).result()
+        prefetcher.prefetch(1, records[3:]).result()
+
+        assert not is_prefetched(prefetcher, 1, records[0])
+        assert is_prefetched(prefetcher, 1, records[3])
+        assert prefetcher.stats()["bytes"] == TEMPLATE_BYTES
+
+    def test_cancel_running_prefetch(self, prefetcher, records, monkeypatch):
+        started = threading.Event()
+        release = threading.Event()
+        prepare = prefetcher._prepare
+
+        def blocking_prepare(record):
+            started.set()
+            release.wait(5)
+            return prepare(record)
+
+        monkeypatch.setattr(prefetcher, "_prepare", blocking_prepare)
+
+        future = prefetcher.prefetch(1, records[:3])
+        assert started.wait(5)
+        prefetcher.cancel(1)
+        release.set()
+        future.result()
+
+        # The template that was being prepared is dropped, the others are skipped
+        assert not is_prefetched(prefetcher, 1, records[0])
+        assert prefetcher.stats()["prefetches"] == 0
+        assert prefetcher.stats()["bytes"] == 0
+
+    def test_expires_after_ttl(self, prefetcher, records, clock):
+        prefetcher.prefetch(1, records[:3]).result()
+
+        clock.now += 61
+        assert not is_prefetched(prefetcher, 1, records[0])
+        stats = prefetcher.stats()
+        assert stats["evictions"] == 1
+        assert stats["prefetches"] == 0
+        assert stats["bytes"] == 0
+
+    def test_bounded_by_bytes(self, settings, records, clock):
+        prefetcher = TemplatePrefetcher(
+            settings, max_bytes=4 * TEMPLATE_BYTES, ttl=60, clock=clock
+        )
+        try:
+            prefetcher.prefetch(1, records[:3]).result()
+            assert is_prefetched(prefetcher, 1, records[0])
+            prefetcher.prefetch(2, records[1:3]).result()
+
+            # The least recently used shuffle was dropped
+            assert not is_prefetched(prefetcher, 1, records[0])
+            assert is_prefetched(prefetcher, 2, records[1])
+            stats = prefetcher.stats()
+            assert stats["bytes"] == 2 * TEMPLATE_BYTES
+            assert stats["evictions"] == 1
+        finally:
+            prefetcher.close()
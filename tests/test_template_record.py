@@ -0,0 +1,52 @@
+from __future__ import annotations
+
+import dataclasses
+import json
+
+import pytest
+
+from src.template_record import iter_text_boxes
+from src.template_record import scale_text_boxes
+from src.template_record import TemplateRecord
+
+TEST_CONFIG_LOCATION = "./tests/mock_data.json"
+
+with open(TEST_CONFIG_LOCATION) as f:
+    TEST_CONF = json.load(f)
+
+
+@pytest.fixture()
+def document():
+    return TEST_CONF["TEST_DATA"][1]
+
+
+class TestTemplateRecord:
+    def test_round_trip(self, document):
+        record = TemplateRecord.from_document(document)
+
+        assert record.num_text_boxes == 3
+        assert record.to_document() == document
+
+    def test_independent_of_key_order(self, document):
+        reordered = dict(document)
+        reordered["text-locations"] = [
+            dict(reversed(location.items())) for location in document["text-locations"]
+        ]
+
+        assert TemplateRecord.from_document(reordered) == TemplateRecord.from_document(
+            document
+        )
+
+    def test_immutable(self, document):
+        record = TemplateRecord.from_document(document)
+
+        assert not hasattr(record, "__dict__")
+        with pytest.raises(dataclasses.FrozenInstanceError):
+            record.name = "Other"  # type: ignore[misc]
+
+    def test_scale_text_boxes(self, document):
+        record = TemplateRecord.from_document(document)
+        scaled = scale_text_boxes(record.text_boxes, 0.5)
+
+        assert list(iter_text_boxes(scaled))[0] == (65, 32, 38, 52)
+        assert list(iter_text_boxes(record.text_boxes))[0] == (130, 64, 76, 104)
@@ -0,0 +1,209 @@
+from __future__ import annotations
+
+import bisect
+import collections
+import random
+
+import mongomock
+import pytest
+
+from src.template_record import TemplateRecord
+from src.template_sampler import RANDOM_KEY_FIELD
+from src.template_sampler import RandomKeySampler
+from src.template_sampler import RENDER_PROJECTION
+
+CATALOG_SIZE = 20000
+LANGUAGES = ("en", "de", "fr")
+
+
+def synthetic_template(i: int, rng: random.Random | None = None) -> dict:
+    template = {
+        "_id": i,
+        "id": str(i),
+        "name": f"Template {i}",
+        "text-locations": [{"x": 1, "y": 2, "width": 30, "height": 40}],
+        "template-location": f"./meme{i}.jpeg",
+        "tags": ["cats"] if i % 100 == 0 else ["dogs"],
+        "language": LANGUAGES[i % len(LANGUAGES)],
+        "uploader": "x" * 100,
+    }
+    if rng is not None:
+        template[RANDOM_KEY_FIELD] = rng.random()
+    return template
+
+
+class IndexedCollection:
+    """
+    In-process stand-in for a mongo collection with the indexes created by
+    RandomKeySampler.ensure_indexes. Supports the lookups of RandomKeySampler.sample
+    and the key updates after them by walking the sorted index like mongo does,
+    counts the examined documents
+    """
+
+    def __init__(self, documents: list[dict]):
+        self.documents = {doc["_id"]: doc for doc in documents}
+        self.examined = 0
+
+        # key: None for the random key index, (field, value) for the compound ones
+        self.indexes: dict = collections.defaultdict(list)
+        for doc in documents:
+            for entries in self._index_entries(doc):
+                entries.append((doc[RANDOM_KEY_FIELD], doc["_id"]))
+        for entries in self.indexes.values():
+            entries.sort()
+
+    def _index_entries(self, doc: dict) -> list[list]:
+        return [
+            self.indexes[None],
+            self.indexes[("language", doc["language"])],
+            *(self.indexes[("tags", tag)] for tag in doc["tags"]),
+        ]
+
+    def bulk_write(self, requests: list, ordered: bool = True) -> None:
+        for request in requests:
+            doc = self.documents[request._filter["_id"]]
+            key = request._doc["$set"][RANDOM_KEY_FIELD]
+            for entries in self._index_entries(doc):
+                entries.remove((doc[RANDOM_KEY_FIELD], doc["_id"]))
+                bisect.insort(entries, (key, doc["_id"]))
+            doc[RANDOM_KEY_FIELD] = key
+
+    @staticmethod
+    def _matches(doc: dict, query: dict) -> bool:
+        if "tags" in query and not set(query["tags"]["$all"]) <= set(doc["tags"]):
+            return False
+        return "language" not in query or doc["language"] == query["language"]
+
+    def find_one(self, query: dict, projection: dict, sort: list) -> dict | None:
+        assert sort == [(RANDOM_KEY_FIELD, 1)]
+        if "tags" in query:
+            entries = self.indexes[("tags", query["tags"]["$all"][0])]
+        elif "language" in query:
+            entries = self.indexes[("language", query["language"])]
+        else:
+            entries = self.indexes[None]
+
+        key_range = query[RANDOM_KEY_FIELD]
+        if "$gte" in key_range:
+            start = bisect.bisect_left(entries, (key_range["$gte"],))
+            stop = len(entries)
+        else:
+            start = 0
+            stop = bisect.bisect_left(entries, (key_range["$lt"],))
+        excluded = set(query.get("_id", {}).get("$nin", []))
+
+        for i in range(start, stop):
+            self.examined += 1
+            doc = self.documents[entries[i][1]]
+            if doc["_id"] not in excluded and self._matches(doc, query):
+                return {"_id": doc["_id"]} | {
+                    field: doc[field] for field in projection if field in doc
+                }
+        return None
+
+
+@pytest.fixture(scope="module")
+def catalog():
+    rng = random.Random(0)
+    return IndexedCollection([synthetic_template(i, rng) for i in range(CATALOG_SIZE)])
+
+
+@pytest.fixture()
+def sampler(catalog):
+    catalog.examined = 0
+    return RandomKeySampler(catalog, random.Random(42))  # type: ignore[arg-type]
+
+
+@pytest.fixture()
+def small_collection():
+    collection = mongomock.MongoClient().db.templates
+    collection.insert_many([synthetic_template(i) for i in range(10)])
+    return collection
+
+
+class TestRandomKeySampler:
+    def test_prepare(self, small_collection):
+        sampler = RandomKeySampler(small_collection, random.Random(1))
+        sampler.prepare()
+
+        assert (
+            small_collection.count_documents({RANDOM_KEY_FIELD: {"$exists": False}})
+            == 0
+        )
+        index_keys = [
+            [field for field, _ in index["key"]]
+            for index in small_collection.index_information().values()
+        ]
+        assert [RANDOM_KEY_FIELD] in index_keys
+        assert ["tags", RANDOM_KEY_FIELD] in index_keys
+        assert ["language", RANDOM_KEY_FIELD] in index_keys
+
+        # Only templates without a random key get one
+        assert sampler.assign_random_keys() == 0
+
+    def test_distinct(self, sampler, catalog):
+        for _ in range(1000):
+            samples = sampler.sample(3)
+            assert len(samples) == 3
+            assert len({doc["id"] for doc in samples}) == 3
+
+        # Index range lookups, no collection scans
+        assert catalog.examined / 1000 < 10
+
+    def test_projection(self, sampler):
+        for doc in sampler.sample(3):
+            assert set(doc) <= {"_id"} | set(RENDER_PROJECTION)
+            assert "uploader" not in doc
+            TemplateRecord.from_document(doc)
+
+    def test_filters(self, sampler, catalog):
+        for _ in range(100):
+            samples = sampler.sample(3, tags=["cats"], language="en")
+            assert len(samples) == 3
+            for doc in samples:
+                template = catalog.documents[doc["_id"]]
+                assert template["tags"] == ["cats"]
+                assert template["language"] == "en"
+
+        assert catalog.examined / 100 < 30
+
+    def test_not_enough_matches(self, sampler):
+        assert sampler.sample(3, tags=["cats", "dogs"]) == []
+        assert sampler.sample(5, language="xx") == []
+
+    def test_wrap_around(self, small_collection):
+        sampler = RandomKeySampler(small_collection, random.Random(1))
+        sampler.prepare()
+
+        # The random number is above every key, the lookup has to wrap around
+        max_key = max(doc[RANDOM_KEY_FIELD] for doc in small_collection.find())
+        sampler.rng.random = lambda: max_key + 1e-9  # type: ignore[method-assign]
+
+        assert len({doc["id"] for doc in sampler.sample(10)}) == 10
+
+    def test_rekeys_picked_templates(self, small_collection):
+        sampler = RandomKeySampler(small_collection, random.Random(7))
+        sampler.prepare()
+        keys = {doc["_id"]: doc[RANDOM_KEY_FIELD] for doc in small_collection.find()}
+
+        picked = {doc["_id"] for doc in sampler.sample(3)}
+        for doc in small_collection.find():
+            assert (doc[RANDOM_KEY_FIELD] != keys[doc["_id"]]) == (doc["_id"] in picked)
+
+    def test_uniform(self):
+        # Without new keys the template after the biggest gap gets picked
+        # several times as often as expected and some are never picked
+        catalog = IndexedCollection(
+            [synthetic_template(i, random.Random(i)) for i in range(50)]
+        )
+        sampler = RandomKeySampler(catalog, random.Random(3))  # type: ignore[arg-type]
+        draws = 5000
+
+        counts = collections.Counter(
+            doc["id"] for _ in range(draws) for doc in sampler.sample(1)
+        )
+        expected = draws / 50
+
+        assert len(counts) == 50
+        assert min(counts.values()) > expected / 2
+        assert max(counts.values()) < expected * 1.5